@@ -0,0 +1,244 @@
+import argparse
+import datetime
+import json
+import os
+import pathlib
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+repositoryDirectory = pathlib.Path(__file__).resolve().parent.parent
+if str(repositoryDirectory) not in sys.path:
+    sys.path.insert(0, str(repositoryDirectory))
+
+from benchmarks import stand_in_makerware, synthetic_config, synthetic_toolpath
+
+
+# A suite of repeatable benchmarks of the expensive parts of make_printable, on synthetic inputs (see synthetic_toolpath,
+# synthetic_config and stand_in_makerware), so that it runs anywhere (in particular, on Linux, without MakerWare).
+# Run it from the repository with:
+#   python -m benchmarks.run_benchmarks [--size quick|default|large] [--only NAME ...] [--compare PREVIOUS_RESULTS_FILE]
+# Each benchmark is run once to warm up and then --repeats times, and we record every time along with the minimum and the median.
+# The results (along with the python version, platform and git commit) are saved, by default under benchmarks/results/, so that
+# a later run can be compared with them (--compare), or two saved runs compared with each other (--compare_files).
+
+
+# the size of the workload at each --size.
+sizes = {
+    'quick': {'layerCount': 40, 'movesPerLayer': 250, 'fanout': 3, 'configCopies': 10, 'repeats': 3},
+    'default': {'layerCount': 200, 'movesPerLayer': 500, 'fanout': 4, 'configCopies': 100, 'repeats': 5},
+    'large': {'layerCount': 1000, 'movesPerLayer': 1000, 'fanout': 5, 'configCopies': 1000, 'repeats': 5},
+}
+
+defaultResultsDirectory = repositoryDirectory.joinpath("benchmarks", "results")
+
+
+# Each benchmark is a function that takes a working directory (a fresh temporary directory) and the parameters (the size, along with
+# the options of the run), does its setup there, and returns (run, details): run is a function, of no arguments, that does the work to
+# be timed, and details is a dict describing the workload (which we record along with the times).
+
+def prepareToolpath(workingDirectory, parameters):
+    toolpathFilePath = workingDirectory.joinpath("synthetic.jsontoolpath")
+    with open(toolpathFilePath, 'w') as toolpathFile:
+        itemCount = synthetic_toolpath.writeSyntheticJsontoolpath(toolpathFile, layerCount=parameters['layerCount'], movesPerLayer=parameters['movesPerLayer'], commentDensity=parameters['commentDensity'])
+    return toolpathFilePath, {'items': itemCount, 'bytes': toolpathFilePath.stat().st_size}
+
+def benchmarkPreviewableGcode(workingDirectory, parameters):
+    import make_printable
+    toolpathFilePath, details = prepareToolpath(workingDirectory, parameters)
+    def run():
+        with open(toolpathFilePath, 'r') as inputJsontoolpathFile, open(os.devnull, 'w') as outputGcodeFile:
+            make_printable.generatePreviewableGcode(inputJsontoolpathFile, outputGcodeFile)
+    return run, details
+
+def benchmarkPreviewableGcodeFromColumnarToolpath(workingDirectory, parameters):
+    import columnar_toolpath
+    import make_printable
+    if not columnar_toolpath.isNumpyAvailable():
+        return None, {'skipped': "numpy is not installed."}
+    toolpathFilePath, details = prepareToolpath(workingDirectory, parameters)
+    columnarToolpathFilePath = workingDirectory.joinpath("synthetic.tpcol")
+    columnar_toolpath.convertJsontoolpathFile(toolpathFilePath, columnarToolpathFilePath)
+    def run():
+        with columnar_toolpath.ColumnarToolpath(columnarToolpathFilePath) as toolpath, open(os.devnull, 'w') as outputGcodeFile:
+            make_printable.generatePreviewableGcode(toolpath, outputGcodeFile)
+    return run, details
+
+# a full config is only a few thousand values, so, to make a config diff that takes long enough to time, we diff a map of configCopies
+# full configs (as a sweep, which diffs every variant against the base, would).
+def benchmarkConfigDiff(workingDirectory, parameters):
+    import jsondiff_by_makerbot
+    schema = synthetic_config.loadResearchSchema("5.31.0")
+    configA = {"variant" + str(i): synthetic_config.buildSyntheticConfig(schema, fanout=parameters['fanout']) for i in range(parameters['configCopies'])}
+    configB = synthetic_config.perturbConfig(configA)
+    def run():
+        diff = jsondiff_by_makerbot.JSONDiff(configA, configB)
+        diff.pretty_str(trim_size=300)
+    return run, {'bytes': len(json.dumps(configA))}
+
+def makeAnnotationBenchmark(schemaVersion):
+    def benchmarkAnnotation(workingDirectory, parameters):
+        import make_printable
+        schema = synthetic_config.loadResearchSchema(schemaVersion)
+        config = synthetic_config.buildSyntheticConfig(schema, fanout=parameters['fanout'])
+        config['unknownKey'] = {"nested": [1, 2, {"x": 1}]}
+        def run():
+            make_printable.dumpsAnnotatedHjsonValue(value=config, path=[], schema=schema)
+        return run, {'bytes': len(json.dumps(config))}
+    return benchmarkAnnotation
+
+# the validator is compiled during the warm-up run, so this times the validation alone (as the second and later jobs of a batch see it).
+def makeValidationBenchmark(schemaVersion):
+    def benchmarkValidation(workingDirectory, parameters):
+        import config_validation
+        schema = synthetic_config.loadResearchSchema(schemaVersion)
+        config = synthetic_config.buildSyntheticConfig(schema, fanout=parameters['fanout'])
+        config['unknownKey'] = {"nested": [1, 2, {"x": 1}]}
+        def run():
+            config_validation.validateConfig(config, schema)
+        return run, {'bytes': len(json.dumps(config))}
+    return benchmarkValidation
+
+def benchmarkEndToEnd(workingDirectory, parameters):
+    makerwareDirectory = stand_in_makerware.createStandInMakerware(
+        workingDirectory.joinpath("makerware"),
+        toolpathParameters={'layerCount': parameters['layerCount'], 'movesPerLayer': parameters['movesPerLayer'], 'commentDensity': parameters['commentDensity']},
+        progressLineCount=parameters['progressLines'],
+        sliceDuration=parameters['sliceDuration']
+    )
+    modelFilePath = workingDirectory.joinpath("model.stl")
+    modelFilePath.write_text("solid synthetic\nendsolid synthetic\n")
+    configFilePath = workingDirectory.joinpath("config.hjson")
+    configFilePath.write_text(json.dumps({'_bot': "replicator_5", '_extruders': ["mk13"], '_materials': ["pla"], 'layerHeight': 0.2, 'doRaft': False}, indent=4))
+    outputDirectory = workingDirectory.joinpath("output")
+    outputDirectory.mkdir()
+    args = [
+        sys.executable, str(repositoryDirectory.joinpath("make_printable.py")),
+        "--makerware_path=" + str(makerwareDirectory),
+        "--input_model_file=" + str(modelFilePath),
+        "--input_miraclegrue_config_file=" + str(configFilePath),
+        "--schema_cache_directory=" + str(workingDirectory.joinpath("schema_cache")),
+        "--output_annotated_miraclegrue_config_file=" + str(outputDirectory.joinpath("annotated.hjson")),
+        "--output_makerbot_file=" + str(outputDirectory.joinpath("synthetic.makerbot")),
+        "--output_gcode_file=" + str(outputDirectory.joinpath("synthetic.gcode")),
+        "--output_previewable_gcode_file=" + str(outputDirectory.joinpath("synthetic.previewable.gcode")),
+        "--output_json_toolpath_file=" + str(outputDirectory.joinpath("synthetic.jsontoolpath")),
+        "--output_metadata_file=" + str(outputDirectory.joinpath("synthetic.json")),
+    ] + parameters['endToEndArguments']
+    def run():
+        process = subprocess.run(args, cwd=workingDirectory, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        if process.returncode != 0:
+            raise RuntimeError("make_printable exited with code " + str(process.returncode) + ":\n" + process.stdout)
+    return run, {'bytes': makerwareDirectory.joinpath("synthetic.jsontoolpath").stat().st_size, 'arguments': parameters['endToEndArguments']}
+
+benchmarks = {
+    'previewable_gcode': benchmarkPreviewableGcode,
+    'previewable_gcode_columnar': benchmarkPreviewableGcodeFromColumnarToolpath,
+    'config_diff': benchmarkConfigDiff,
+    'annotate_5.31.0': makeAnnotationBenchmark("5.31.0"),
+    'annotate_3.9.4': makeAnnotationBenchmark("3.9.4"),
+    'validate_config_5.31.0': makeValidationBenchmark("5.31.0"),
+    'validate_config_3.9.4': makeValidationBenchmark("3.9.4"),
+    'end_to_end': benchmarkEndToEnd,
+}
+
+
+def getGitCommit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=repositoryDirectory, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=repositoryDirectory, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("-dirty" if dirty else "")
+
+# runs the named benchmarks, printing the times as we go, and returns the results (in the form that we save).
+def runBenchmarks(names, parameters):
+    results = {
+        'environment': {
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'commit': getGitCommit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpuCount': os.cpu_count(),
+        },
+        'parameters': parameters,
+        'benchmarks': {}
+    }
+    for name in names:
+        with tempfile.TemporaryDirectory(prefix="benchmark_") as workingDirectory:
+            run, details = benchmarks[name](pathlib.Path(workingDirectory), parameters)
+            if run is None:
+                print("{:<28} skipped: {}".format(name, details.get('skipped')))
+                results['benchmarks'][name] = {'details': details}
+                continue
+            run()
+            times = []
+            for i in range(parameters['repeats']):
+                startTime = time.perf_counter()
+                run()
+                times.append(time.perf_counter() - startTime)
+        results['benchmarks'][name] = {'times': times, 'min': min(times), 'median': statistics.median(times), 'details': details}
+        print("{:<28} min {:9.4f} s   median {:9.4f} s".format(name, min(times), statistics.median(times)))
+    return results
+
+# returns a table comparing the median times of the benchmarks in two sets of results.
+def formatComparison(previousResults, results):
+    lines = ["{:<28} {:>12} {:>12} {:>8}".format("benchmark", "previous", "current", "ratio")]
+    for name, result in results['benchmarks'].items():
+        previousResult = previousResults['benchmarks'].get(name, {})
+        if 'median' not in result or 'median' not in previousResult:
+            lines.append("{:<28} {:>12} {:>12} {:>8}".format(name, "-" if 'median' not in previousResult else "{:.4f} s".format(previousResult['median']), "-" if 'median' not in result else "{:.4f} s".format(result['median']), ""))
+            continue
+        lines.append("{:<28} {:>12} {:>12} {:>8}".format(name, "{:.4f} s".format(previousResult['median']), "{:.4f} s".format(result['median']), "{:.2f}x".format(result['median'] / previousResult['median'])))
+    if previousResults.get('parameters') != results.get('parameters'):
+        lines.append("(the two runs were made with different parameters, so the times are not directly comparable.)")
+    return "\n".join(lines)
+
+def loadResults(path):
+    with open(path, 'r') as resultsFile:
+        return json.load(resultsFile)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the make_printable benchmarks on synthetic inputs, and save (and optionally compare) the results.")
+    parser.add_argument("--size", choices=sorted(sizes), default='default', help="the size of the workload.")
+    parser.add_argument("--only", action='append', choices=list(benchmarks), default=None, help="run only this benchmark (may be given more than once).")
+    parser.add_argument("--repeats", type=int, default=None, help="the number of timed runs of each benchmark (by default, as for --size).")
+    parser.add_argument("--comment_density", type=float, default=0.02, help="the probability that a move of the synthetic toolpath is preceded by a comment.")
+    parser.add_argument("--progress_lines", type=int, default=1001, help="the number of --json-progress lines that the stand-in miracle_grue emits in the end_to_end benchmark.")
+    parser.add_argument("--slice_duration", type=float, default=0.0, help="the number of seconds over which the stand-in miracle_grue spreads its progress lines in the end_to_end benchmark.")
+    parser.add_argument("--end_to_end_argument", action='append', default=[], help="an extra command-line argument for make_printable in the end_to_end benchmark (e.g. --end_to_end_argument=--pipelined); may be given more than once.")
+    parser.add_argument("--output_results_file", default=None, help="the file to which to save the results (by default, a file named after the date and the git commit under benchmarks/results/).")
+    parser.add_argument("--compare", default=None, help="a results file, saved by an earlier run, with which to compare the results of this run.")
+    parser.add_argument("--compare_files", nargs=2, default=None, metavar=("PREVIOUS", "CURRENT"), help="just compare two saved results files, without running anything.")
+    args = parser.parse_args(argv)
+
+    if args.compare_files:
+        print(formatComparison(loadResults(args.compare_files[0]), loadResults(args.compare_files[1])))
+        return
+
+    parameters = dict(sizes[args.size])
+    parameters['size'] = args.size
+    if args.repeats is not None:
+        parameters['repeats'] = args.repeats
+    parameters['commentDensity'] = args.comment_density
+    parameters['progressLines'] = args.progress_lines
+    parameters['sliceDuration'] = args.slice_duration
+    parameters['endToEndArguments'] = args.end_to_end_argument
+    results = runBenchmarks(args.only or list(benchmarks), parameters)
+
+    if args.output_results_file:
+        resultsFilePath = pathlib.Path(args.output_results_file)
+    else:
+        resultsFilePath = defaultResultsDirectory.joinpath(datetime.datetime.now().strftime("%Y%m%d-%H%M%S") + "-" + (results['environment']['commit'] or "unknown") + ".json")
+    resultsFilePath.parent.mkdir(parents=True, exist_ok=True)
+    with open(resultsFilePath, 'w') as resultsFile:
+        json.dump(results, resultsFile, indent=4)
+    print("saved the results to " + str(resultsFilePath))
+    if args.compare:
+        print(formatComparison(loadResults(args.compare), results))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+import argparse
+import json
+import os
+import pathlib
+import shutil
+import stat
+import sys
+import time
+import zipfile
+
+if __package__:
+    from . import synthetic_config, synthetic_toolpath
+else:
+    import synthetic_config
+    import synthetic_toolpath
+
+
+# A stand-in for a MakerWare installation, so that the whole pipeline of make_printable can be run (and benchmarked) on Linux,
+# where MakerWare does not exist.  createStandInMakerware() lays out a directory that getMakerwarePaths() accepts:
+#   miracle_grue.exe   an executable script that behaves like miracle_grue, as far as make_printable is concerned: it answers
+#                      --version-json and --config-schema (with a schema from research/), and, given a model, emits
+#                      --json-progress lines at the configured rate while it writes a synthetic jsontoolpath, gcode and metadata.
+#   sliceconfig        a python script that emits {"progress": ...} lines and packages its inputs into a zip file, the way
+#                      sliceconfig's package_makerbot does.
+#   python3.4.exe      a link to the python that we are running under, with which make_printable runs sliceconfig.
+#   python34/          the working directory for sliceconfig.
+#   stand_in.json      the settings (see createStandInMakerware()), which the scripts read each time they run.
+#   synthetic.jsontoolpath, synthetic.gcode
+#                      the outputs of "slicing", generated once up front, so that running miracle_grue costs little more than
+#                      copying them (which is what we want when we are benchmarking make_printable, rather than the generator).
+
+
+settingsFileName = "stand_in.json"
+
+# lays out a stand-in MakerWare installation (see above) in directory, and returns directory.
+# toolpathParameters are passed to synthetic_toolpath.iterateSyntheticToolpathItems().
+# progressLineCount is the number of progress lines that each run of miracle_grue emits, and sliceDuration the number of
+# seconds over which it spreads them (so the rate is progressLineCount / sliceDuration lines per second; with a sliceDuration
+# of 0, they come as fast as make_printable can read them).
+# schemaVersion selects the schema under research/ with which miracle_grue answers --config-schema.
+def createStandInMakerware(directory, toolpathParameters=None, progressLineCount=101, sliceDuration=0.0, schemaVersion="5.31.0"):
+    directory = pathlib.Path(directory)
+    directory.joinpath("python34").mkdir(parents=True, exist_ok=True)
+    toolpathParameters = dict(toolpathParameters or {})
+    with open(directory.joinpath("synthetic.jsontoolpath"), 'w') as toolpathFile:
+        synthetic_toolpath.writeSyntheticJsontoolpath(toolpathFile, **toolpathParameters)
+    with open(directory.joinpath("synthetic.gcode"), 'w') as gcodeFile:
+        synthetic_toolpath.writeSyntheticGcode(gcodeFile, **toolpathParameters)
+    with open(directory.joinpath(settingsFileName), 'w') as settingsFile:
+        json.dump({
+            'toolpathParameters': {key: value for key, value in toolpathParameters.items() if key != 'tagMix'},
+            'progressLineCount': progressLineCount,
+            'sliceDuration': sliceDuration,
+            'schemaVersion': schemaVersion
+        }, settingsFile, indent=4)
+
+    # the scripts import this module from the repository, whichever directory they are run from.
+    shim = "\n".join([
+        "import sys",
+        "sys.path.insert(0, " + repr(str(pathlib.Path(__file__).resolve().parent.parent)) + ")",
+        "from benchmarks import stand_in_makerware",
+        "sys.exit(stand_in_makerware.{function}(" + repr(str(directory.resolve())) + ", sys.argv[1:]))",
+        ""
+    ])
+    miraclegrueExecutablePath = directory.joinpath("miracle_grue.exe")
+    miraclegrueExecutablePath.write_text("#!" + sys.executable + "\n" + shim.format(function="runMiraclegrue"))
+    miraclegrueExecutablePath.chmod(miraclegrueExecutablePath.stat().st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    directory.joinpath("sliceconfig").write_text(shim.format(function="runSliceconfig"))
+    pythonExecutablePath = directory.joinpath("python3.4.exe")
+    if pythonExecutablePath.is_symlink() or pythonExecutablePath.exists():
+        pythonExecutablePath.unlink()
+    pythonExecutablePath.symlink_to(sys.executable)
+    return directory
+
+def loadSettings(makerwareDirectory):
+    with open(pathlib.Path(makerwareDirectory).joinpath(settingsFileName), 'r') as settingsFile:
+        return json.load(settingsFile)
+
+def _printJsonLine(value):
+    sys.stdout.write(json.dumps(value) + "\n")
+    sys.stdout.flush()
+
+# the stand-in for miracle_grue (see above).  Returns the exit code.
+def runMiraclegrue(makerwareDirectory, argv):
+    parser = argparse.ArgumentParser(prog="miracle_grue")
+    parser.add_argument("--version-json", action='store_true')
+    parser.add_argument("--config-schema", action='store_true')
+    parser.add_argument("-j", "--json-progress", action='store_true')
+    parser.add_argument("-c", "--config")
+    parser.add_argument("--gcode-toolpath-output")
+    parser.add_argument("--json-toolpath-output")
+    parser.add_argument("--metadata-output")
+    parser.add_argument("-m", "--memory-threshold")
+    parser.add_argument("--log-file")
+    parser.add_argument("--log-level")
+    parser.add_argument("--no-log-format", action='store_true')
+    parser.add_argument("model", nargs='?')
+    args = parser.parse_args(argv)
+    makerwareDirectory = pathlib.Path(makerwareDirectory)
+    settings = loadSettings(makerwareDirectory)
+
+    if args.version_json:
+        _printJsonLine({"version": settings['schemaVersion'], "commit": "stand-in"})
+        return 0
+    if args.config_schema:
+        with open(synthetic_config.getResearchSchemaPaths()[settings['schemaVersion']], 'r') as schemaFile:
+            sys.stdout.write(schemaFile.read())
+        return 0
+    if args.model is None or args.config is None:
+        parser.error("a model and a config are required to slice.")
+    with open(args.config, 'r') as configFile:
+        config = json.load(configFile)
+
+    # we "slice" by copying the synthetic jsontoolpath to the output a piece at a time, with a progress line after each piece.
+    progressLineCount = max(settings['progressLineCount'], 1)
+    interval = settings['sliceDuration'] / progressLineCount
+    sourceFile = open(makerwareDirectory.joinpath("synthetic.jsontoolpath"), 'rb')
+    sourceSize = os.fstat(sourceFile.fileno()).st_size
+    outputFile = open(args.json_toolpath_output, 'wb') if args.json_toolpath_output else None
+    try:
+        for i in range(progressLineCount):
+            piece = sourceFile.read(sourceSize * (i + 1) // progressLineCount - sourceFile.tell())
+            if outputFile:
+                outputFile.write(piece)
+                outputFile.flush()
+            if interval:
+                time.sleep(interval)
+            if args.json_progress:
+                _printJsonLine({"totalPercentComplete": round(100 * (i + 1) / progressLineCount, 3)})
+    finally:
+        sourceFile.close()
+        if outputFile:
+            outputFile.close()
+    if args.gcode_toolpath_output:
+        shutil.copyfile(makerwareDirectory.joinpath("synthetic.gcode"), args.gcode_toolpath_output)
+    if args.metadata_output:
+        parameters = settings['toolpathParameters']
+        with open(args.metadata_output, 'w') as metadataFile:
+            json.dump({
+                "duration_s": 60.0 * parameters.get('layerCount', 50),
+                "extrusion_mass_g": [0.01 * parameters.get('layerCount', 50) * parameters.get('movesPerLayer', 200)],
+                "bot_type": config.get('_bot'),
+                "miracle_config": config
+            }, metadataFile, indent=4)
+    if args.log_file:
+        with open(args.log_file, 'w') as logFile:
+            logFile.write("stand-in miracle_grue " + " ".join(argv) + "\n")
+    return 0
+
+# the stand-in for sliceconfig (see above).  Returns the exit code.
+def runSliceconfig(makerwareDirectory, argv):
+    parser = argparse.ArgumentParser(prog="sliceconfig")
+    parser.add_argument("--status-updates", action='store_true')
+    parser.add_argument("--input", required=True)
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--machine_id")
+    parser.add_argument("--extruder_ids")
+    parser.add_argument("--material_ids")
+    parser.add_argument("--profile")
+    parser.add_argument("--metadata")
+    parser.add_argument("--thumbnail-dir")
+    parser.add_argument("command", choices=["package_makerbot"])
+    args = parser.parse_args(argv)
+    with zipfile.ZipFile(args.output, 'w', compression=zipfile.ZIP_DEFLATED) as makerbotFile:
+        for progress, (path, name) in enumerate([(args.input, "print.jsontoolpath"), (args.metadata, "meta.json"), (args.profile, "miracle_config.json")]):
+            if path:
+                makerbotFile.write(path, name)
+            if args.status_updates:
+                _printJsonLine({"progress": 100 * (progress + 1) // 3})
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Lay out a stand-in MakerWare installation (for --makerware_path) that slices synthetic toolpaths.")
+    parser.add_argument("directory", help="the directory in which to lay out the stand-in.")
+    parser.add_argument("--layers", type=int, default=50, help="the number of layers of the synthetic toolpath.")
+    parser.add_argument("--moves_per_layer", type=int, default=200, help="the number of moves in each layer of the synthetic toolpath.")
+    parser.add_argument("--comment_density", type=float, default=0.02, help="the probability that a move of the synthetic toolpath is preceded by a comment.")
+    parser.add_argument("--seed", type=int, default=0, help="the seed of the random number generator.")
+    parser.add_argument("--progress_lines", type=int, default=101, help="the number of --json-progress lines that miracle_grue emits while slicing.")
+    parser.add_argument("--slice_duration", type=float, default=0.0, help="the number of seconds over which miracle_grue spreads its progress lines.")
+    parser.add_argument("--schema_version", default="5.31.0", choices=sorted(synthetic_config.getResearchSchemaPaths()), help="the schema (from research/) with which miracle_grue answers --config-schema.")
+    args = parser.parse_args(argv)
+    createStandInMakerware(
+        args.directory,
+        toolpathParameters={'layerCount': args.layers, 'movesPerLayer': args.moves_per_layer, 'commentDensity': args.comment_density, 'seed': args.seed},
+        progressLineCount=args.progress_lines,
+        sliceDuration=args.slice_duration,
+        schemaVersion=args.schema_version
+    )
+
+if __name__ == "__main__":
+    main()
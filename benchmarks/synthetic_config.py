@@ -0,0 +1,72 @@
+import copy
+import json
+import pathlib
+import random
+
+
+# Synthetic miracle_grue configs, built from a config schema (like the ones under research/), for benchmarking the config
+# diff and the annotation (see run_benchmarks) on configs much larger than a typical hand-written one: every member of every
+# aggregate is present, maps get several entries and arrays several elements.
+
+
+researchDirectory = pathlib.Path(__file__).resolve().parent.parent.joinpath("research")
+
+# returns the paths of the config schemas kept under research/, keyed by miracle_grue version (e.g. "5.31.0").
+def getResearchSchemaPaths():
+    prefix = "miracle_grue_"
+    suffix = "_config_schema.json"
+    return {
+        path.name[len(prefix):-len(suffix)]: path
+        for path in sorted(researchDirectory.glob(prefix + "*" + suffix))
+    }
+
+def loadResearchSchema(version):
+    with open(getResearchSchemaPaths()[version], 'r') as schemaFile:
+        return json.load(schemaFile)
+
+# returns a config of the schema type typeName, with every member of every aggregate, fanout entries in each map and fanout
+# elements in each array.  The leaf values are the default of the member, where the schema gives one.
+def buildSyntheticConfig(schema, typeName="__top__", fanout=4, default=None):
+    schemedType = schema.get(typeName)
+    if not isinstance(schemedType, dict):
+        return default
+    if schemedType.get('mode') == "aggregate":
+        return {
+            member['id']: buildSyntheticConfig(schema, member['type'], fanout=fanout, default=member.get('default'))
+            for member in schemedType.get('members', [])
+        }
+    jsonType = schemedType.get('json_type')
+    if jsonType == "object" and 'value_type' in schemedType:
+        return {"profile" + str(i): buildSyntheticConfig(schema, schemedType['value_type'], fanout=fanout) for i in range(fanout)}
+    if jsonType == "array" and 'element_type' in schemedType:
+        return [buildSyntheticConfig(schema, schemedType['element_type'], fanout=fanout) for i in range(fanout)]
+    if default is not None:
+        return copy.deepcopy(default)
+    return {"array": [], "object": {}, "number": 1.5, "boolean": True, "string": "abc"}.get(jsonType)
+
+# returns a copy of config in which roughly fraction of the leaves have been changed (numbers scaled, booleans flipped and
+# strings extended), along with a few added and removed keys, as a typical config transform or sweep variant would do.
+def perturbConfig(config, fraction=0.05, seed=0):
+    randomNumberGenerator = random.Random(seed)
+    perturbedConfig = copy.deepcopy(config)
+    stack = [perturbedConfig]
+    while stack:
+        container = stack.pop()
+        keys = list(container.keys()) if isinstance(container, dict) else list(range(len(container)))
+        for key in keys:
+            value = container[key]
+            if isinstance(value, (dict, list)):
+                stack.append(value)
+            elif randomNumberGenerator.random() < fraction:
+                if isinstance(value, bool):
+                    container[key] = not value
+                elif isinstance(value, (int, float)):
+                    container[key] = value * 1.1 + 1
+                elif isinstance(value, str):
+                    container[key] = value + "_changed"
+        if isinstance(container, dict) and keys and randomNumberGenerator.random() < fraction:
+            if randomNumberGenerator.random() < 0.5:
+                del container[randomNumberGenerator.choice(keys)]
+            else:
+                container["addedKey"] = 1
+    return perturbedConfig
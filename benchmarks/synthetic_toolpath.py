@@ -0,0 +1,119 @@
+import argparse
+import json
+import random
+
+
+# A generator of synthetic jsontoolpath files, for benchmarking (see run_benchmarks) without MakerWare or a real model.
+# The files have the shape of what miracle_grue emits: a set_toolhead_temperature command, then, for each layer, a
+# "Layer Section" comment and an "Upper Position" comment (sometimes followed by a "(+0.26)" variant, as miracle_grue writes
+# over rafts), followed by the moves of the layer, with stray comments, further layer sections and fan_duty commands sprinkled among them.
+# The content is entirely determined by the parameters (including the seed), so that benchmark runs are repeatable.
+
+
+# the tag combinations that we give to the moves, with the relative frequency of each (a typical mix, by our experience of real toolpaths).
+defaultTagMix = {
+    ("Infill",): 4,
+    ("Inset", "BeadMode External"): 2,
+    ("Inset", "BeadMode Internal"): 2,
+    ("Support",): 1,
+    ("Travel Move",): 2,
+    ("Retract",): 0.5,
+    ("Restart",): 0.5,
+    ("Connection",): 1,
+}
+
+# parses a tag mix given on the command line, like "Infill=4,Inset+BeadMode External=2,Travel Move=1"
+# (tags of one combination are joined by "+", and each combination is followed by its relative frequency).
+def parseTagMix(text):
+    tagMix = {}
+    for entry in text.split(","):
+        if not entry.strip():
+            continue
+        tags, separator, weight = entry.rpartition("=")
+        if not separator:
+            raise ValueError("expected TAG[+TAG...]=WEIGHT, but found " + repr(entry))
+        tagMix[tuple(tag.strip() for tag in tags.split("+") if tag.strip())] = float(weight)
+    return tagMix
+
+def _comment(text):
+    return {"command": {"function": "comment", "parameters": {"comment": text}, "tags": []}}
+
+# yields the items of a synthetic jsontoolpath, one at a time.
+# layerCount and movesPerLayer set the size of the toolpath, tagMix (a dict mapping tuples of tags to relative frequencies, like
+# defaultTagMix) the tags of the moves, and commentDensity the probability that a move is preceded by a comment (a fifth of which
+# are further "Layer Section" comments).
+def iterateSyntheticToolpathItems(layerCount=50, movesPerLayer=200, tagMix=None, commentDensity=0.02, seed=0, layerHeight=0.2):
+    randomNumberGenerator = random.Random(seed)
+    tagCombinations, weights = zip(*(tagMix or defaultTagMix).items())
+    feedrates = (12.5, 20, 40.0, 90)
+    yield {"command": {"function": "set_toolhead_temperature", "parameters": {"temperature": 215}, "tags": [], "metadata": {}}}
+    z = 0.0
+    a = 0.0
+    layerSection = 0
+    for layerNumber in range(layerCount):
+        z = round(z + layerHeight, 3)
+        yield _comment("Layer Section %d (%d)" % (layerSection, layerSection + 1))
+        layerSection += 1
+        yield _comment("Upper Position  %s" % z)
+        if layerNumber % 7 == 3:
+            yield _comment("Upper Position  %s (+0.26)" % z)
+        tagsOfMoves = randomNumberGenerator.choices(tagCombinations, weights=weights, k=movesPerLayer)
+        for tags in tagsOfMoves:
+            if randomNumberGenerator.random() < commentDensity:
+                if randomNumberGenerator.random() < 0.2:
+                    yield _comment("Layer Section %d (%d)" % (layerSection, layerSection + 1))
+                    layerSection += 1
+                else:
+                    yield _comment("Synthetic comment")
+            if randomNumberGenerator.random() < 0.005:
+                yield {"command": {"function": "fan_duty", "parameters": {"value": 0.5}, "tags": []}}
+            a = round(a - 1.3 if "Retract" in tags else a + randomNumberGenerator.random(), 5)
+            yield {"command": {"function": "move", "parameters": {
+                "x": round(randomNumberGenerator.uniform(-50, 50), 4),
+                "y": round(randomNumberGenerator.uniform(-50, 50), 4),
+                "z": z,
+                "a": a,
+                "feedrate": randomNumberGenerator.choice(feedrates)
+            }, "tags": list(tags)}}
+
+# writes a synthetic jsontoolpath (see iterateSyntheticToolpathItems(), to which the keyword arguments are passed) to file (a
+# writable text-mode file-like object), one item at a time, so that the toolpath never has to be held in memory.
+# indent, if given, pretty-prints each item as json.dump() would.
+# returns the number of items written.
+def writeSyntheticJsontoolpath(file, indent=None, **parameters):
+    itemCount = 0
+    file.write("[")
+    for item in iterateSyntheticToolpathItems(**parameters):
+        if itemCount:
+            file.write(",")
+        file.write(("\n" if indent is not None else (" " if itemCount else "")) + json.dumps(item, indent=indent))
+        itemCount += 1
+    file.write("\n]" if indent is not None else "]")
+    return itemCount
+
+# writes the gcode counterpart of a synthetic jsontoolpath (what miracle_grue's --gcode-toolpath-output would have given),
+# so that a stand-in miracle_grue (see stand_in_makerware) can produce both outputs.
+def writeSyntheticGcode(file, **parameters):
+    for item in iterateSyntheticToolpathItems(**parameters):
+        command = item['command']
+        if command['function'] == "move":
+            file.write("G1 X{x} Y{y} Z{z} A{a} F{feedrate}\n".format(**command['parameters']))
+        elif command['function'] == "comment":
+            file.write("; " + command['parameters']['comment'] + "\n")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a synthetic jsontoolpath file.")
+    parser.add_argument("output_file", help="the jsontoolpath file to write.")
+    parser.add_argument("--layers", type=int, default=50, help="the number of layers.")
+    parser.add_argument("--moves_per_layer", type=int, default=200, help="the number of moves in each layer.")
+    parser.add_argument("--tag_mix", type=parseTagMix, default=None, help="the tags of the moves, with their relative frequencies, like \"Infill=4,Inset+BeadMode External=2,Travel Move=1\" (by default, a typical mix).")
+    parser.add_argument("--comment_density", type=float, default=0.02, help="the probability that a move is preceded by a comment.")
+    parser.add_argument("--seed", type=int, default=0, help="the seed of the random number generator.")
+    parser.add_argument("--indent", type=int, default=None, help="pretty-print each item with this indent.")
+    args = parser.parse_args(argv)
+    with open(args.output_file, 'w') as outputFile:
+        itemCount = writeSyntheticJsontoolpath(outputFile, indent=args.indent, layerCount=args.layers, movesPerLayer=args.moves_per_layer, tagMix=args.tag_mix, commentDensity=args.comment_density, seed=args.seed)
+    print("wrote " + str(itemCount) + " items to " + args.output_file)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,367 @@
+import array
+import json
+import mmap
+import os
+import pathlib
+import struct
+import sys
+
+# numpy is only needed for ColumnarToolpath.column() to return numpy arrays; without it, we return memoryviews.  We import it on first 
+# use (see isNumpyAvailable()), since importing it takes longer than the runs that do not need it (e.g. make_printable.py --help).
+numpy = None
+_numpyImportAttempted = False
+
+import jsontoolpath
+
+
+# A compact, columnar, binary form of a jsontoolpath, for the tools that make more than one pass over the same toolpath (generating
+# previewable gcode again, computing statistics, diffing, ...), which would otherwise have to re-parse gigabytes of json each time.
+#
+# Each element of the jsontoolpath (an "item") is one row.  The columns are:
+#   x, y, z, a, feedrate:  the move parameters, as float64 (NaN where a row has no such parameter).
+#   function:              an index into the table of function names ("move", "comment", ...).
+#   tags:                  an index into the table of distinct tag lists.
+#   layout:                an index into the table of layouts (see below).
+#   extras:                the index (into the string table) of the first of the row's "extra" values (with one more element
+#                          than there are rows, so that the extras of row i are extras[i] up to extras[i+1]).
+#   stringOffsets, stringData: the string table: string k is stringData[stringOffsets[k]:stringOffsets[k+1]], in utf-8.
+# A layout records the order of the keys of a command and of its parameters, and where each parameter lives: "f" (a float in its
+# column), "i" (an int, stored as a float in its column), "s" (a string in the string table, e.g. a comment) or "j" (any other value,
+# json-encoded in the string table).  Command members other than function, parameters and tags (e.g. "metadata") are json-encoded
+# in the string table, and an item that does not look like a command at all is stored whole, json-encoded, with a layout of None.
+# Thus, the conversion is lossless: iterateItems() yields items equal to the ones that json.load() would produce (including the
+# distinction between ints and floats, which matters to the gcode that we generate from them).
+#
+# The file consists of the magic number, the offset of the footer (a little-endian uint64), the columns (each aligned to 64 bytes,
+# and in little-endian byte order), and the footer: a json dict giving the tables and the dtype, offset and length of each column.
+# The file is memory-mapped for reading, so opening a toolpath costs next to nothing, and column() gives direct (numpy) access to
+# a column without reading the rest of the file.
+
+
+magic = b"TPCOLv1\n"
+moveParameterNames = ['x', 'y', 'z', 'a', 'feedrate']
+_alignment = 64
+_largestExactInteger = 2**53
+
+# (column name, array typecode) of each of the integer columns.
+_integerColumns = [('function', 'H'), ('tags', 'I'), ('layout', 'I'), ('extras', 'Q'), ('stringOffsets', 'Q')]
+
+def _dtypeOfTypecode(typecode):
+    return ("<f" if typecode == 'd' else "<u") + str(array.array(typecode).itemsize)
+
+# returns True if numpy can be imported (importing it, if we have not already).
+def isNumpyAvailable():
+    global numpy, _numpyImportAttempted
+    if not _numpyImportAttempted:
+        _numpyImportAttempted = True
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+    return numpy is not None
+
+# returns True if the file at path is a columnar toolpath (as opposed to, say, a jsontoolpath).
+def isColumnarToolpathFile(path):
+    try:
+        with open(path, 'rb') as file:
+            return file.read(len(magic)) == magic
+    except OSError:
+        return False
+
+
+class _ColumnSpool:
+    # accumulates the values of one column in an array, and spills them to a temporary file every so often, so that the
+    # conversion of a multi-gigabyte toolpath does not have to hold the columns in memory.
+    def __init__(self, typecode, directory, flushLength=1<<16):
+        import tempfile
+        self.typecode = typecode
+        self.values = array.array(typecode)
+        self.file = tempfile.TemporaryFile(dir=directory)
+        self.flushLength = flushLength
+        self.length = 0
+
+    def append(self, value):
+        self.values.append(value)
+        if len(self.values) >= self.flushLength:
+            self.flush()
+
+    def flush(self):
+        if sys.byteorder != 'little':
+            self.values.byteswap()
+        self.values.tofile(self.file)
+        self.length += len(self.values)
+        self.values = array.array(self.typecode)
+
+
+# converts a jsontoolpath (inputJsontoolpathFile, a readable text-mode file-like object) into a columnar toolpath file at
+# outputColumnarToolpathFilePath.  The file is written under a temporary name and renamed into place once complete.
+# progressReportingCallback is as for jsontoolpath.iterateJsontoolpathItems().
+# returns the number of rows (items).
+def convertJsontoolpath(inputJsontoolpathFile, outputColumnarToolpathFilePath, progressReportingCallback=None):
+    import shutil
+    outputColumnarToolpathFilePath = pathlib.Path(outputColumnarToolpathFilePath)
+    directory = outputColumnarToolpathFilePath.parent
+    floatColumns = {name: _ColumnSpool('d', directory) for name in moveParameterNames}
+    integerColumns = {name: _ColumnSpool(typecode, directory) for name, typecode in _integerColumns}
+    stringData = _ColumnSpool('B', directory, flushLength=1<<20)
+    # the indices of the distinct functions, tag lists, and layouts (keyed by their json encoding, in the case of layouts).
+    functions = {}
+    tagLists = {}
+    layouts = {}
+    nan = float('nan')
+    stringCount = 0
+    stringDataLength = 0
+    integerColumns['stringOffsets'].append(0)
+    integerColumns['extras'].append(0)
+
+    def addString(text):
+        nonlocal stringCount, stringDataLength
+        encoded = text.encode('utf-8')
+        stringData.values.frombytes(encoded)
+        if len(stringData.values) >= stringData.flushLength:
+            stringData.flush()
+        stringDataLength += len(encoded)
+        stringCount += 1
+        integerColumns['stringOffsets'].append(stringDataLength)
+
+    rowCount = 0
+    for item in jsontoolpath.iterateJsontoolpathItems(inputJsontoolpathFile, progressReportingCallback=progressReportingCallback):
+        command = item.get('command') if isinstance(item, dict) and len(item) == 1 else None
+        if not (
+            isinstance(command, dict)
+            and isinstance(command.get('function'), str)
+            and isinstance(command.get('parameters', {}), dict)
+            and isinstance(command.get('tags', []), list)
+            and all(isinstance(tag, str) for tag in command.get('tags', []))
+        ):
+            command = None
+
+        values = dict.fromkeys(moveParameterNames, nan)
+        if command is None:
+            layout = None
+            function = ""
+            tags = ()
+            addString(json.dumps(item))
+        else:
+            function = command['function']
+            tags = tuple(command.get('tags', ()))
+            parameterSpecs = []
+            for name, value in command.get('parameters', {}).items():
+                if name in values and type(value) is float:
+                    kind = "f"
+                elif name in values and type(value) is int and -_largestExactInteger <= value <= _largestExactInteger:
+                    kind = "i"
+                elif type(value) is str:
+                    kind = "s"
+                else:
+                    kind = "j"
+                if kind in ("f", "i"):
+                    values[name] = value
+                else:
+                    addString(value if kind == "s" else json.dumps(value))
+                parameterSpecs.append((name, kind))
+            for key, value in command.items():
+                if key not in ('function', 'parameters', 'tags'):
+                    addString(json.dumps(value))
+            layout = {'commandKeys': list(command.keys()), 'parameters': parameterSpecs}
+
+        layoutKey = json.dumps(layout)
+        if layoutKey not in layouts:
+            layouts[layoutKey] = len(layouts)
+        if function not in functions:
+            functions[function] = len(functions)
+        if tags not in tagLists:
+            tagLists[tags] = len(tagLists)
+        for name in moveParameterNames:
+            floatColumns[name].append(values[name])
+        integerColumns['function'].append(functions[function])
+        integerColumns['tags'].append(tagLists[tags])
+        integerColumns['layout'].append(layouts[layoutKey])
+        integerColumns['extras'].append(stringCount)
+        rowCount += 1
+
+    spools = dict(floatColumns, **integerColumns, stringData=stringData)
+    footer = {
+        'rowCount': rowCount,
+        'functions': list(functions.keys()),
+        'tags': [list(tags) for tags in tagLists.keys()],
+        'layouts': [json.loads(layoutKey) for layoutKey in layouts.keys()],
+        'columns': {}
+    }
+    # (we name the temporary file ourselves, rather than using tempfile, so that it gets the usual permissions.)
+    temporaryPath = directory.joinpath("." + outputColumnarToolpathFilePath.name + "." + str(os.getpid()) + ".tmp")
+    try:
+        with open(temporaryPath, 'wb') as outputFile:
+            outputFile.write(magic + struct.pack('<Q', 0))
+            for name, spool in spools.items():
+                spool.flush()
+                outputFile.write(b"\0" * (-outputFile.tell() % _alignment))
+                footer['columns'][name] = {'dtype': _dtypeOfTypecode(spool.typecode), 'offset': outputFile.tell(), 'length': spool.length}
+                spool.file.seek(0)
+                shutil.copyfileobj(spool.file, outputFile, 1<<20)
+                spool.file.close()
+            footerOffset = outputFile.tell()
+            outputFile.write(json.dumps(footer).encode('utf-8'))
+            outputFile.seek(len(magic))
+            outputFile.write(struct.pack('<Q', footerOffset))
+        os.replace(temporaryPath, outputColumnarToolpathFilePath)
+    except BaseException:
+        os.remove(temporaryPath)
+        raise
+    return rowCount
+
+def convertJsontoolpathFile(jsontoolpathFilePath, outputColumnarToolpathFilePath, progressReportingCallback=None):
+    with open(jsontoolpathFilePath, 'r') as inputJsontoolpathFile:
+        return convertJsontoolpath(inputJsontoolpathFile, outputColumnarToolpathFilePath, progressReportingCallback=progressReportingCallback)
+
+
+# read access to a columnar toolpath file.  Usage:
+#   with ColumnarToolpath(path) as toolpath:
+#       feedrates = toolpath.column('feedrate')   # a numpy array (memory-mapped) of the feedrates of all of the rows
+#       isMove = toolpath.column('function') == toolpath.functions.index('move')
+#       for item in toolpath.iterateItems(): ...  # the items of the jsontoolpath, as json.load() would give them
+class ColumnarToolpath:
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            if file.read(len(magic)) != magic:
+                raise ValueError(str(path) + " is not a columnar toolpath file.")
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        footerOffset, = struct.unpack_from('<Q', self._mmap, len(magic))
+        footer = json.loads(self._mmap[footerOffset:].decode('utf-8'))
+        self.rowCount = footer['rowCount']
+        self.functions = footer['functions']
+        self.tags = footer['tags']
+        self.layouts = footer['layouts']
+        self.columns = footer['columns']
+        self._stringDataOffset = self.columns['stringData']['offset']
+
+    def __len__(self):
+        return self.rowCount
+
+    # returns the named column (see above) as a read-only numpy array backed by the memory-mapped file, or, if numpy is not
+    # available, as a memoryview.
+    def column(self, name):
+        spec = self.columns[name]
+        if isNumpyAvailable():
+            return numpy.frombuffer(self._mmap, dtype=numpy.dtype(spec['dtype']), count=spec['length'], offset=spec['offset'])
+        if sys.byteorder != 'little':
+            raise RuntimeError("reading a columnar toolpath without numpy is only supported on little-endian machines.")
+        itemSize = int(spec['dtype'][2:])
+        format = {('f', 8): 'd', ('u', 1): 'B', ('u', 2): 'H', ('u', 4): 'I', ('u', 8): 'Q'}[(spec['dtype'][1], itemSize)]
+        return memoryview(self._mmap)[spec['offset']:spec['offset'] + spec['length'] * itemSize].cast(format)
+
+    # returns string k of the string table.
+    def getString(self, k):
+        stringOffsets = self.column('stringOffsets')
+        return self._mmap[self._stringDataOffset + int(stringOffsets[k]):self._stringDataOffset + int(stringOffsets[k + 1])].decode('utf-8')
+
+    # returns the list of the values of the string parameter parameterName (e.g. 'comment') of each of the given rows (an iterable of
+    # row indices), with None for a row whose command has no such parameter (or where it is not a string).
+    def getStringParameters(self, rows, parameterName):
+        # the position, among the string-table values of a row of each layout, of the parameter (or None if there is no such parameter).
+        positions = []
+        for layout in self.layouts:
+            position = None
+            if layout is not None:
+                stringKinds = [(name, kind) for name, kind in layout['parameters'] if kind in ("s", "j")]
+                if (parameterName, "s") in stringKinds:
+                    position = stringKinds.index((parameterName, "s"))
+            positions.append(position)
+        layoutColumn = self.column('layout')
+        extras = self.column('extras')
+        values = []
+        for row in rows:
+            position = positions[int(layoutColumn[row])]
+            values.append(None if position is None else self.getString(int(extras[row]) + position))
+        return values
+
+    # yields the items of rows start up to (but not including) stop, as dicts equal to the corresponding elements of the jsontoolpath.
+    # progressReportingCallback, if given, is passed the completion ratio (the fraction of the rows that have been yielded).
+    def iterateItems(self, start=0, stop=None, progressReportingCallback=None, chunkSize=1<<16):
+        stop = self.rowCount if stop is None else min(stop, self.rowCount)
+        columns = {name: self.column(name) for name in moveParameterNames + ['function', 'tags', 'layout', 'extras', 'stringOffsets']}
+        stringData = self._mmap
+        stringDataOffset = self._stringDataOffset
+        functions = self.functions
+        tagLists = self.tags
+        # for each layout, the list of (key, source) pairs from which we build the parameters of a command, where source is the position
+        # of the parameter's column within moveParameterNames (for a float), the negated position minus one (for an int), or one of "s" 
+        # and "j" (for a value from the string table).  A layout is "plain" if its parameters all come from the columns and its
+        # command has just the usual members, in the usual order, which is the case for the vast majority of the rows (the moves).
+        parameterSources = []
+        plainLayouts = []
+        for layout in self.layouts:
+            if layout is None:
+                parameterSources.append(None)
+                plainLayouts.append(False)
+                continue
+            parameterSources.append([
+                (name, (moveParameterNames.index(name) if kind == "f" else -1 - moveParameterNames.index(name)) if kind in ("f", "i") else kind)
+                for name, kind in layout['parameters']
+            ])
+            plainLayouts.append(
+                layout['commandKeys'] == ['function', 'parameters', 'tags']
+                and all(kind in ("f", "i") for _, kind in layout['parameters'])
+            )
+        for chunkStart in range(start, stop, chunkSize):
+            chunkStop = min(stop, chunkStart + chunkSize)
+            chunk = {name: columns[name][chunkStart:chunkStop].tolist() for name in moveParameterNames + ['function', 'tags', 'layout']}
+            extras = columns['extras'][chunkStart:chunkStop + 1].tolist()
+            stringOffsets = columns['stringOffsets'][extras[0]:extras[-1] + 1].tolist()
+            firstString = extras[0]
+
+            def nextString():
+                nonlocal stringIndex
+                text = stringData[stringDataOffset + stringOffsets[stringIndex - firstString]:stringDataOffset + stringOffsets[stringIndex - firstString + 1]].decode('utf-8')
+                stringIndex += 1
+                return text
+
+            rows = zip(chunk['layout'], chunk['function'], chunk['tags'], zip(*(chunk[name] for name in moveParameterNames)), extras)
+            for layoutIndex, functionIndex, tagsIndex, values, stringIndex in rows:
+                if plainLayouts[layoutIndex]:
+                    yield {'command': {
+                        'function': functions[functionIndex],
+                        'parameters': {name: (values[source] if source >= 0 else int(values[-1 - source])) for name, source in parameterSources[layoutIndex]},
+                        'tags': list(tagLists[tagsIndex])
+                    }}
+                    continue
+                layout = self.layouts[layoutIndex]
+                if layout is None:
+                    yield json.loads(nextString())
+                    continue
+                parameters = {}
+                for name, source in parameterSources[layoutIndex]:
+                    if source == "s":
+                        parameters[name] = nextString()
+                    elif source == "j":
+                        parameters[name] = json.loads(nextString())
+                    else:
+                        parameters[name] = values[source] if source >= 0 else int(values[-1 - source])
+                command = {}
+                for key in layout['commandKeys']:
+                    if key == 'function':
+                        command[key] = functions[functionIndex]
+                    elif key == 'parameters':
+                        command[key] = parameters
+                    elif key == 'tags':
+                        command[key] = list(tagLists[tagsIndex])
+                    else:
+                        command[key] = json.loads(nextString())
+                yield {'command': command}
+            if progressReportingCallback and self.rowCount:
+                progressReportingCallback(chunkStop / self.rowCount)
+
+    def close(self):
+        try:
+            self._mmap.close()
+        except BufferError:
+            # a numpy array (or memoryview) returned by column() is still using the mapping, which will be released along with it.
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exceptionType, exception, traceback):
+        self.close()
+        return False
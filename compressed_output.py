@@ -0,0 +1,118 @@
+import collections
+import io
+import os
+import pathlib
+
+try:
+    import zstandard
+except ImportError:
+    # zstandard is only needed for .zst outputs.
+    zstandard = None
+
+
+# Compressed output files (for the gcode and the previewable gcode, which can run to several gigabytes), with the compression
+# chosen by the extension of the output file: ".gz", ".xz" or ".zst".
+# The text is compressed as it is written: we cut it into blocks, compress the blocks independently on a pool of threads (zlib,
+# lzma and zstandard all release the GIL while they work), and write the compressed blocks out in order.  Each block becomes a
+# complete gzip member, xz stream or zstd frame, and a file made of several of those, one after another, is a valid file of that
+# format (which gunzip, xz, zstd, and python's gzip and lzma modules all read as a whole), so the blocks do not depend on one
+# another, at the cost of a slightly worse compression ratio (the dictionary starts afresh with each block).
+
+
+blockSize = 4 << 20
+
+# returns a function that compresses one block (bytes) into a complete member/stream/frame.
+def _getBlockCompressor(compression, level=None):
+    # (gzip and lzma, like the thread pool and shutil below, are imported only once something is to be compressed, since most runs
+    # compress nothing, and make_printable.py --help should not have to wait for them.)
+    if compression == "gz":
+        import gzip
+        return lambda block: gzip.compress(block, compresslevel=(6 if level is None else level), mtime=0)
+    if compression == "xz":
+        import lzma
+        return lambda block: lzma.compress(block, format=lzma.FORMAT_XZ, preset=(6 if level is None else level))
+    if compression == "zst":
+        if zstandard is None:
+            raise RuntimeError("writing a .zst file requires the zstandard package, which is not installed.")
+        # a ZstdCompressor may not be used by more than one thread at once, so we make one per block.
+        return lambda block: zstandard.ZstdCompressor(level=(3 if level is None else level)).compress(block)
+    raise ValueError("unknown compression " + repr(compression))
+
+# returns the compression implied by the extension of path ("gz", "xz" or "zst"), or None if path is not the name of a compressed file.
+def getCompression(path):
+    suffix = pathlib.Path(path).suffix.lower()
+    return {".gz": "gz", ".xz": "xz", ".zst": "zst"}.get(suffix)
+
+# returns a message explaining why we cannot write a file at path (with the compression implied by its extension), or None if we can.
+def getCompressionError(path):
+    if getCompression(path) == "zst" and zstandard is None:
+        return "cannot write " + str(path) + ": writing a .zst file requires the zstandard package, which is not installed."
+    return None
+
+
+class ParallelCompressingWriter(io.BufferedIOBase):
+    # a writable binary file-like object that compresses what is written to it (see above) and writes the result to outputFile
+    # (a writable binary file-like object, which we close when we are closed).
+    # threadCount is the number of blocks to compress at once (by default, the number of processors).
+    def __init__(self, outputFile, compression, threadCount=None, level=None):
+        self._outputFile = outputFile
+        self._compressBlock = _getBlockCompressor(compression, level=level)
+        self._threadCount = threadCount or os.cpu_count() or 1
+        import concurrent.futures
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self._threadCount, thread_name_prefix="compression")
+        # the blocks being compressed, in order.  We keep at most twice as many as there are threads, to bound the memory use.
+        self._pendingBlocks = collections.deque()
+        self._buffer = bytearray()
+        self.uncompressedSize = 0
+        self.compressedSize = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("write to a closed file.")
+        self._buffer += data
+        self.uncompressedSize += len(data)
+        while len(self._buffer) >= blockSize:
+            self._submit(bytes(self._buffer[:blockSize]))
+            del self._buffer[:blockSize]
+        return len(data)
+
+    def _submit(self, block):
+        self._pendingBlocks.append(self._executor.submit(self._compressBlock, block))
+        while self._pendingBlocks and (len(self._pendingBlocks) > 2 * self._threadCount or self._pendingBlocks[0].done()):
+            self._writePendingBlock()
+
+    def _writePendingBlock(self):
+        compressedBlock = self._pendingBlocks.popleft().result()
+        self._outputFile.write(compressedBlock)
+        self.compressedSize += len(compressedBlock)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._buffer:
+                self._submit(bytes(self._buffer))
+                self._buffer = bytearray()
+            while self._pendingBlocks:
+                self._writePendingBlock()
+        finally:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._outputFile.close()
+            super().close()
+
+
+# opens path for writing text, compressing it (see above) if the extension of path calls for that, and otherwise just as open(path, 'w') would.
+def openTextOutput(path, threadCount=None):
+    compression = getCompression(path)
+    if compression is None:
+        return open(path, 'w')
+    return io.TextIOWrapper(ParallelCompressingWriter(open(path, 'wb'), compression, threadCount=threadCount))
+
+# writes a compressed copy of the file at sourcePath to destinationPath (with the compression implied by the extension of destinationPath).
+def compressFile(sourcePath, destinationPath, threadCount=None):
+    import shutil
+    with open(sourcePath, 'rb') as sourceFile, ParallelCompressingWriter(open(destinationPath, 'wb'), getCompression(destinationPath), threadCount=threadCount) as destinationFile:
+        shutil.copyfileobj(sourceFile, destinationFile, blockSize)
@@ -0,0 +1,177 @@
+import copy
+import itertools
+import json
+import re
+
+import hjson
+
+from jsondiff_by_makerbot import JSONDiff
+
+
+# Helpers for parameter sweeps: expanding one miracle_grue config into a set of variants by overriding a few keys, for
+# instance to try several shell counts, infill densities and layer heights without hand-writing a transform for each combination.
+# A sweep file is a json (or hjson) dict with either or both of the following members:
+#   grid:     a dict mapping key paths to lists of values.  There is one variant for every combination of the values.
+#   variants: a list of dicts, each mapping key paths to values.  There is one variant for each dict.
+# A key path is either a list of keys (strings for dict members, integers for list elements), or a string like
+# "extruderProfiles[0].extrusionProfiles.infill.infillDensity" (the notation that JSONDiff.flatten() uses).
+# For example:
+#   {
+#       grid: {
+#           layerHeight: [0.2, 0.3]
+#           doRaft: [true, false]
+#       }
+#   }
+
+
+_keyPathTokenPattern = re.compile(r'([^.\[\]]+)|\[(\d+)\]')
+
+# returns the list of keys denoted by keyPath (see above).
+def parseKeyPath(keyPath):
+    if isinstance(keyPath, (list, tuple)):
+        return list(keyPath)
+    keys = []
+    position = 0
+    while position < len(keyPath):
+        if keys and keyPath[position] == '.':
+            position += 1
+        match = _keyPathTokenPattern.match(keyPath, position)
+        if not match:
+            raise ValueError("cannot parse the key path " + repr(keyPath) + " at offset " + str(position))
+        keys.append(match.group(1) if match.group(1) is not None else int(match.group(2)))
+        position = match.end()
+    return keys
+
+def formatKeyPath(keys):
+    return "".join(
+        ("[" + str(key) + "]") if isinstance(key, int) else (("." if index else "") + str(key))
+        for index, key in enumerate(keys)
+    )
+
+# sets the value at keyPath within config (in place).  Every key along the way, except for the last, must already exist.
+def setValueAtKeyPath(config, keyPath, value):
+    keys = parseKeyPath(keyPath)
+    if not keys:
+        raise ValueError("a key path must contain at least one key.")
+    container = config
+    for index, key in enumerate(keys[:-1]):
+        try:
+            container = container[key]
+        except (KeyError, IndexError, TypeError):
+            raise KeyError("the config has no entry at " + formatKeyPath(keys[:index + 1]) + " (while setting " + formatKeyPath(keys) + ")")
+    if isinstance(container, list) and not (isinstance(keys[-1], int) and keys[-1] < len(container)):
+        raise KeyError("the config has no entry at " + formatKeyPath(keys) + " (the list has " + str(len(container)) + " elements)")
+    if not isinstance(container, (dict, list)):
+        raise KeyError("the config entry at " + formatKeyPath(keys[:-1]) + " is neither a dict nor a list (while setting " + formatKeyPath(keys) + ")")
+    container[keys[-1]] = value
+
+# returns the list of the overrides of each variant described by the sweep (a dict, as described above), in order:
+# the combinations of the grid (varying the last key path fastest), followed by the listed variants.
+# Each element of the returned list is a list of (keyPath, value) pairs.
+def expandSweep(sweep):
+    if not isinstance(sweep, dict) or not (sweep.get('grid') or sweep.get('variants')):
+        raise ValueError("a sweep is expected to be a dict having a 'grid' and/or a 'variants' member.")
+    unknownMemberNames = set(sweep.keys()) - {'grid', 'variants'}
+    if unknownMemberNames:
+        raise ValueError("the sweep has unrecognized members: " + ", ".join(sorted(unknownMemberNames)))
+    overridesOfEachVariant = []
+    grid = sweep.get('grid') or {}
+    for keyPath, values in grid.items():
+        if not isinstance(values, list) or not values:
+            raise ValueError("the grid entry for " + str(keyPath) + " is expected to be a non-empty list of values.")
+    if grid:
+        for combination in itertools.product(*grid.values()):
+            overridesOfEachVariant.append(list(zip(grid.keys(), combination)))
+    for variant in sweep.get('variants') or []:
+        if not isinstance(variant, dict):
+            raise ValueError("each element of the sweep's 'variants' is expected to be a dict mapping key paths to values.")
+        overridesOfEachVariant.append(list(variant.items()))
+    return overridesOfEachVariant
+
+def loadSweep(sweep_file_path):
+    return expandSweep(hjson.load(open(sweep_file_path, 'r')))
+
+# the canonical json of a config: two configs are equivalent (as far as miracle_grue is concerned) exactly when their canonical json is the same.
+def getCanonicalConfig(config):
+    return json.dumps(config, sort_keys=True)
+
+# builds the variant configs by applying each element of overridesOfEachVariant (as returned by expandSweep()) to a copy of baseConfig.
+# The base config itself is the first variant.  Variants whose canonical config matches that of an earlier variant are dropped.
+# returns a list of dicts:
+#   'variant':    the index of the variant (0 for the base config, 1... for the elements of overridesOfEachVariant).
+#   'overrides':  a dict mapping the formatted key paths to the overriding values.
+#   'config':     the variant config.
+#   'duplicates': the indices of the variants that were dropped because their config is the same as this one.
+def buildVariants(baseConfig, overridesOfEachVariant):
+    variants = []
+    variantsByCanonicalConfig = {}
+    for index, overrides in enumerate([[]] + list(overridesOfEachVariant)):
+        config = copy.deepcopy(baseConfig)
+        for keyPath, value in overrides:
+            setValueAtKeyPath(config, keyPath, value)
+        canonicalConfig = getCanonicalConfig(config)
+        if canonicalConfig in variantsByCanonicalConfig:
+            variantsByCanonicalConfig[canonicalConfig]['duplicates'].append(index)
+            continue
+        variant = {
+            'variant': index,
+            'overrides': {formatKeyPath(parseKeyPath(keyPath)): value for keyPath, value in overrides},
+            'config': config,
+            'duplicates': []
+        }
+        variantsByCanonicalConfig[canonicalConfig] = variant
+        variants.append(variant)
+    return variants
+
+# returns a one-line description of the differences between a variant config and the base config, e.g. "layerHeight: 0.2 -> 0.3".
+def describeConfigDiff(baseConfig, config):
+    diff = JSONDiff(baseConfig, config)
+    diff.flatten()
+    descriptions = []
+    for keyPath in sorted(diff.dict_diff.keys(), key=str):
+        keyDiff = diff.dict_diff[keyPath]
+        if keyDiff.is_similar_value():
+            continue
+        if keyDiff.is_added_value():
+            descriptions.append(str(keyPath) + ": (added) " + json.dumps(keyDiff.json_b))
+        elif keyDiff.is_removed_value():
+            descriptions.append(str(keyPath) + ": (removed)")
+        else:
+            descriptions.append(str(keyPath) + ": " + json.dumps(keyDiff.json_a) + " -> " + json.dumps(keyDiff.json_b))
+    return "; ".join(descriptions)
+
+# the figures that we pull out of the miracle_grue metadata for each variant: (heading, metadata member name).
+# Where a member is a list (e.g. the mass of material used by each extruder), we report the sum.
+metadataColumns = [
+    ("print time (s)", 'duration_s'),
+    ("material (g)", 'extrusion_mass_g'),
+    ("material (mm)", 'extrusion_distance_mm')
+]
+
+def getMetadataFigures(metadata):
+    figures = {}
+    for _, memberName in metadataColumns:
+        value = (metadata or {}).get(memberName)
+        if isinstance(value, list):
+            value = sum(element for element in value if isinstance(element, (int, float)))
+        figures[memberName] = value if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+    return figures
+
+# rows is a list of dicts having the members of a variant (see buildVariants()), plus 'status', 'metadata' (see getMetadataFigures())
+# and 'changes' (see describeConfigDiff()).
+def formatSweepTable(rows):
+    formatFigure = lambda value: "-" if value is None else "{:.1f}".format(value)
+    columns = (
+        [
+            ("variant", lambda row: str(row['variant']) + ("" if not row['duplicates'] else " (=" + ",".join(map(str, row['duplicates'])) + ")")),
+            ("status",  lambda row: row['status'])
+        ]
+        + [(heading, (lambda memberName: lambda row: formatFigure(row['metadata'][memberName]))(memberName)) for heading, memberName in metadataColumns]
+        + [("changes", lambda row: row['changes'] or "(base)")]
+    )
+    tableRows = [[heading for heading, _ in columns]] + [[getCell(row) for _, getCell in columns] for row in rows]
+    widths = [max(len(tableRow[i]) for tableRow in tableRows) for i in range(len(columns))]
+    return "\n".join(
+        "  ".join(cell.ljust(width) for cell, width in zip(tableRow, widths)).rstrip()
+        for tableRow in tableRows
+    )
@@ -0,0 +1,161 @@
+import copy
+import functools
+
+import incremental_build
+import miraclegrue_schema
+
+
+# Pre-flight validation of a miracle_grue config against the config schema of the miracle_grue at hand, so that a bad value is
+# reported in milliseconds, before we launch miracle_grue, rather than minutes into a slice.
+# The miracle_grue schema (see miraclegrue_schema) is compiled into a JSON Schema (draft 7), and that into a jsonschema validator,
+# once per schema (see getConfigValidator()):
+#   aggregate types        become objects with a property per member.
+#   object specializations become objects whose values are all of the value_type (the maps of profiles).
+#   array specializations  become arrays whose elements are all of the element_type.
+#   primitive types        become the corresponding json type (an unsigned_integer is an integer that is not negative), along with
+#                          the min, max and validStrings of the member.  A member may also be null (as in the output of
+#                          --regurgitate-config, for a member that has no default).
+# A value equal to the default of its member is always accepted, since a few of the defaults in the schemas do not meet the
+# constraints of their own member (e.g. extruderTemp1, an unsigned_integer, has a default of -1).
+# The step of a member (the granularity of the slider in MakerBot Print) is not something that miracle_grue insists on, so a value that
+# is not a whole number of steps from the min is only a warning.  So are unknown keys, which miracle_grue ignores: regurgitateConfig()
+# emulates miracle_grue --regurgitate-config, which omits the keys that the schema does not describe, to find them.
+
+
+# what to do about a config that has errors (see --config_validation in make_printable.py).
+configValidationModes = ["error", "warn", "off"]
+
+class ConfigValidationError(ValueError):
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__("the miracle_grue config is not valid:\n" + "\n".join("    " + error for error in errors))
+
+_primitiveJsonTypes = {
+    'number': ["number", "null"],
+    'boolean': ["boolean", "null"],
+    'string': ["string", "null"],
+    'array': ["array", "object", "null"],
+    'object': ["object", "null"],
+}
+
+# returns the JSON Schema for the member described by memberSpec (a member of an aggregate type of schema).
+def _compileMemberJsonSchema(memberSpec, compileType):
+    memberJsonSchema = dict(compileType(memberSpec['type']))
+    if isinstance(memberSpec.get('min'), (int, float)) and not isinstance(memberSpec.get('min'), bool):
+        memberJsonSchema['minimum'] = memberSpec['min']
+    if isinstance(memberSpec.get('max'), (int, float)) and not isinstance(memberSpec.get('max'), bool):
+        memberJsonSchema['maximum'] = memberSpec['max']
+    if isinstance(memberSpec.get('step'), (int, float)) and not isinstance(memberSpec.get('step'), bool) and memberSpec['step'] > 0:
+        memberJsonSchema['miraclegrueStep'] = {'step': memberSpec['step'], 'base': memberJsonSchema.get('minimum', 0)}
+    if memberSpec.get('validStrings'):
+        memberJsonSchema['enum'] = list(memberSpec['validStrings']) + [None]
+    if memberSpec.get('default') is not None:
+        memberJsonSchema = {'if': {'const': memberSpec['default']}, 'then': True, 'else': memberJsonSchema}
+    return memberJsonSchema
+
+# returns the JSON Schema (as a dict) equivalent to the miracle_grue config schema (see above).
+# Types that the schema refers to but does not describe (e.g. BotPosition) accept anything.
+def compileConfigJsonSchema(schema):
+    compiledTypes = {}
+    def compileType(typeName):
+        if typeName in compiledTypes:
+            # (an empty schema stands in for a type that refers to itself, while we are still compiling it.)
+            return compiledTypes[typeName] or {}
+        schemedType = schema.get(typeName)
+        if not isinstance(schemedType, dict):
+            return {}
+        compiledTypes[typeName] = None
+        jsonType = schemedType.get('json_type')
+        if schemedType.get('mode') == "aggregate":
+            properties = {}
+            for memberSpec in schemedType.get('members', []):
+                properties.setdefault(memberSpec['id'], _compileMemberJsonSchema(memberSpec, compileType))
+            compiledType = {'type': ["object", "null"], 'properties': properties}
+        elif jsonType == "object" and schemedType.get('value_type'):
+            compiledType = {'type': ["object", "null"], 'additionalProperties': compileType(schemedType['value_type'])}
+        elif jsonType == "array" and schemedType.get('element_type'):
+            compiledType = {'type': ["array", "null"], 'items': compileType(schemedType['element_type'])}
+        elif typeName == "unsigned_integer":
+            compiledType = {'type': ["integer", "null"], 'minimum': 0}
+        elif typeName == "integer":
+            compiledType = {'type': ["integer", "null"]}
+        else:
+            compiledType = ({'type': _primitiveJsonTypes[jsonType]} if jsonType in _primitiveJsonTypes else {})
+        compiledTypes[typeName] = compiledType
+        return compiledType
+    jsonSchema = compileType('__top__')
+    return dict(jsonSchema, **{'$schema': "http://json-schema.org/draft-07/schema#"})
+
+# the miraclegrueStep keyword of the compiled schema (see _compileMemberJsonSchema()).  The errors that it yields are warnings.
+def _checkStep(validator, stepSpec, instance, jsonSchema):
+    import jsonschema
+    if not validator.is_type(instance, "number"):
+        return
+    stepCount = (instance - stepSpec['base']) / stepSpec['step']
+    if abs(stepCount - round(stepCount)) > 1e-6 * max(1, abs(stepCount)):
+        yield jsonschema.ValidationError(repr(instance) + " is not a whole number of steps of " + repr(stepSpec['step']) + " from " + repr(stepSpec['base']))
+
+@functools.lru_cache(maxsize=None)
+def _getValidatorClass():
+    import jsonschema
+    return jsonschema.validators.extend(jsonschema.Draft7Validator, {'miraclegrueStep': _checkStep})
+
+_configValidators = {}
+
+# returns the jsonschema validator of configs of schema, compiling it the first time that we see a given schema object.
+def getConfigValidator(schema):
+    # as with miraclegrue_schema.getSchemaIndex(), we hold on to the schema so that the id cannot be recycled for a different object.
+    cachedSchema, validator = _configValidators.get(id(schema), (None, None))
+    if cachedSchema is not schema:
+        validator = _getValidatorClass()(compileConfigJsonSchema(schema))
+        _configValidators[id(schema)] = (schema, validator)
+    return validator
+
+# emulates miracle_grue --regurgitate-config: returns (the config as miracle_grue would see it, in which the keys that the schema
+# does not describe are omitted, and the members that the config does not specify are set to their default, or to None; the list
+# of the key paths of the omitted keys).
+# The keys of incremental_build.packagingOnlyKeyPaths, which are meant for sliceconfig rather than miracle_grue, are omitted but not listed.
+def regurgitateConfig(config, schema):
+    schemaIndex = miraclegrue_schema.getSchemaIndex(schema)
+    unknownKeyPaths = []
+    def regurgitate(value, typeName, path):
+        schemedType = schema.get(typeName)
+        if not isinstance(schemedType, dict) or value is None:
+            return value
+        if typeName in schemaIndex.memberSpecs:
+            if not isinstance(value, dict):
+                return value
+            memberSpecs = schemaIndex.memberSpecs[typeName]
+            regurgitatedValue = {}
+            for memberId, memberSpec in memberSpecs.items():
+                if memberId in value:
+                    regurgitatedValue[memberId] = regurgitate(value[memberId], memberSpec['type'], path + (memberId,))
+                else:
+                    regurgitatedValue[memberId] = copy.deepcopy(memberSpec.get('default'))
+            for key in value:
+                if key not in memberSpecs and path + (key,) not in incremental_build.packagingOnlyKeyPaths:
+                    unknownKeyPaths.append(path + (key,))
+            return regurgitatedValue
+        if schemedType.get('json_type') == "object" and schemedType.get('value_type') and isinstance(value, dict):
+            return {key: regurgitate(child, schemedType['value_type'], path + (key,)) for key, child in value.items()}
+        if schemedType.get('json_type') == "array" and schemedType.get('element_type') and isinstance(value, list):
+            return [regurgitate(child, schemedType['element_type'], path + (index,)) for index, child in enumerate(value)]
+        return value
+    regurgitatedConfig = regurgitate(config, "__top__", ())
+    return regurgitatedConfig, unknownKeyPaths
+
+def _formatKeyPath(keys):
+    import config_sweep
+    return (config_sweep.formatKeyPath(list(keys)) or "(the whole config)")
+
+# checks config against schema.  returns (errors, warnings), each a list of strings like "extruderProfiles[0].layerHeight: 0.5 is
+# greater than the maximum of 0.4", sorted by key path.
+def validateConfig(config, schema):
+    errors = []
+    warnings = []
+    for error in sorted(getConfigValidator(schema).iter_errors(config), key=lambda error: [str(key) for key in error.absolute_path]):
+        (warnings if error.validator == 'miraclegrueStep' else errors).append(_formatKeyPath(error.absolute_path) + ": " + error.message)
+    regurgitatedConfig, unknownKeyPaths = regurgitateConfig(config, schema)
+    for keyPath in sorted(unknownKeyPaths, key=lambda keyPath: [str(key) for key in keyPath]):
+        warnings.append(_formatKeyPath(keyPath) + ": not in the config schema, so miracle_grue ignores it")
+    return errors, warnings
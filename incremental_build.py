@@ -0,0 +1,136 @@
+import json
+import os
+
+import slice_cache
+
+
+# Incremental rebuilds: re-running make_printable on a model after changing only the keys of the config that miracle_grue does not
+# read, without re-slicing.  A few keys of the config are only there for the packaging step (sliceconfig's package_makerbot), which
+# gets them as command-line options, and which, along with the previewable gcode, the columnar toolpath and the statistics, is all
+# that has to be redone when they change.  Any other change means a new toolpath.
+# We keep, for each model (and miracle_grue version), the outputs of the last time that we sliced it along with the config that
+# produced them, compare the new config with that one, key by key, and classify each changed key with packagingOnlyKeyPaths (below).
+# If no changed key affects the slice, the retained outputs are used in place of slicing, except that the metadata, which records
+# some of the packaging-only keys (and the whole config), is patched to match the new config (see patchMetadata()).
+# The outputs are kept in an IncrementalBuildStore, which is a SliceCache whose entries are keyed by the model and the miracle_grue
+# version alone (rather than also the config), and which also holds the config of each entry.
+
+
+# the key paths of the config (as tuples of keys) that do not affect the slice, mapped to the outputs that they do reach:
+#   'sliceconfig': the option of sliceconfig (and so of the packaging of the .makerbot) that the value is passed as.
+#   'metadata':    the members of the metadata (as miracle_grue writes it) that are copied from the value.
+# A change to one of these keys does not affect the slice; a change to any other key does (including keys that we have never heard
+# of, since miracle_grue might read them).  Each of them is a top-level key (see classifyConfigChanges()).
+# These are not members of the config schema (which is what miracle_grue reads), and classifyConfigChanges() checks that against the
+# schema of the miracle_grue at hand: should a later miracle_grue take to reading one of them, a change to it is taken to affect the slice.
+# Keep this up to date with packageMakerbot() in make_printable.py.
+packagingOnlyKeyPaths = {
+    ("_bot",):       {'sliceconfig': "--machine_id",   'metadata': ["bot_type"]},
+    ("_extruders",): {'sliceconfig': "--extruder_ids", 'metadata': []},
+    ("_materials",): {'sliceconfig': "--material_ids", 'metadata': []},
+}
+
+# the member of the metadata in which miracle_grue records the whole config, which any change to the config reaches.
+metadataConfigMemberName = "miracle_config"
+
+# returns a description of where a packaging-only key ends up, e.g. "sliceconfig --machine_id, and bot_type in the metadata".
+def describeDestinations(keyPath):
+    destinations = packagingOnlyKeyPaths[keyPath]
+    return "sliceconfig " + destinations['sliceconfig'] + "".join(", and " + memberName + " in the metadata" for memberName in destinations['metadata'])
+
+# returns the entries of packagingOnlyKeyPaths that schema (a miracle_grue config schema) says miracle_grue reads after all, which
+# we therefore do not treat as packaging-only.
+def getKeyPathsReadBySchema(schema):
+    import miraclegrue_schema
+    schemaIndex = miraclegrue_schema.getSchemaIndex(schema)
+    return [keyPath for keyPath in packagingOnlyKeyPaths if schemaIndex.getSchemedTypeName(keyPath)]
+
+# returns a list of (key, affectsSlice, reason) for each top-level key at which newConfig differs from previousConfig (including keys
+# that only one of them has), where affectsSlice is True or False, and reason says why (where the key ends up, for a key that does
+# not affect the slice).
+# Since every packaging-only key is a top-level key, that is as deep as we need to look: a change anywhere within any other top-level key
+# affects the slice.  (Comparing the values as a whole also spares us from spelling out key paths, which is ambiguous for keys that
+# contain "." or "[".)
+# schema, if given, is the config schema against which to check packagingOnlyKeyPaths (see getKeyPathsReadBySchema()).
+def classifyConfigChanges(previousConfig, newConfig, schema=None):
+    keyPathsReadBySchema = (getKeyPathsReadBySchema(schema) if schema else [])
+    missing = object()
+    changes = []
+    for key in sorted(set(previousConfig) | set(newConfig), key=str):
+        if previousConfig.get(key, missing) == newConfig.get(key, missing):
+            continue
+        affectsSlice = True
+        reason = "read by miracle_grue"
+        if (key,) in packagingOnlyKeyPaths:
+            if (key,) in keyPathsReadBySchema:
+                reason = "in the config schema"
+            else:
+                affectsSlice = False
+                reason = describeDestinations((key,))
+        changes.append((key, affectsSlice, reason))
+    return changes
+
+# writes the metadata of a build whose config was previousConfig, patched to match newConfig (which differs from it only in
+# packaging-only keys), to patchedMetadataFilePath: the members of the metadata that packagingOnlyKeyPaths says come from a changed
+# key are set to the new value, and the copy of the config (if the metadata has one) is replaced with newConfig.
+def patchMetadata(metadataFilePath, previousConfig, newConfig, patchedMetadataFilePath):
+    with open(metadataFilePath, 'r') as metadataFile:
+        metadata = json.load(metadataFile)
+    for (key,), destinations in packagingOnlyKeyPaths.items():
+        if previousConfig.get(key) != newConfig.get(key):
+            for memberName in destinations['metadata']:
+                if memberName in metadata:
+                    metadata[memberName] = newConfig.get(key)
+    if metadataConfigMemberName in metadata:
+        metadata[metadataConfigMemberName] = newConfig
+    with open(patchedMetadataFilePath, 'w') as patchedMetadataFile:
+        json.dump(metadata, patchedMetadataFile, indent=4)
+
+
+class IncrementalBuildStore(slice_cache.SliceCache):
+    # the config that produced the outputs of an entry is kept along with them.
+    configName = "miraclegrue_config"
+    outputNames = slice_cache.SliceCache.outputNames + [configName]
+
+    # modelFilePath is the path of a file; miraclegrueVersion is a string.
+    def computeKey(self, modelFilePath, miraclegrueVersion):
+        hasher = slice_cache.hashFile(modelFilePath)
+        hasher.update(b'\0' + str(miraclegrueVersion).encode('utf-8'))
+        return hasher.hexdigest()
+
+    # returns (the config of the last build of key, a dict mapping each of wantedOutputNames to the path of the retained file), or
+    # None if there is no such build, or it lacks some of the wanted outputs.  Unlike lookup(), this does not count as a hit or a miss
+    # (see recordReuse()), since it is up to the caller whether the build is any use.
+    def getPreviousBuild(self, key, wantedOutputNames):
+        entryDirectory = self.getEntryDirectory(key)
+        retainedPaths = {name: entryDirectory.joinpath(name) for name in list(wantedOutputNames) + [self.configName]}
+        if not all(path.is_file() for path in retainedPaths.values()) or self.hasSharedFiles(retainedPaths.values()):
+            return None
+        try:
+            with open(retainedPaths.pop(self.configName), 'r') as configFile:
+                previousConfig = json.load(configFile)
+        except (OSError, ValueError):
+            return None
+        return previousConfig, retainedPaths
+
+    def recordReuse(self, key, reused):
+        if reused:
+            self.hits += 1
+            self._touch(self.getEntryDirectory(key))
+        else:
+            self.misses += 1
+        self._recordStats(hits=int(reused), misses=int(not reused))
+
+    # records a fresh build of key: outputPaths (as for store()) must include the config.  Whatever the entry held from an earlier
+    # build is discarded, so that the entry never mixes outputs from different configs.
+    def storeBuild(self, key, outputPaths):
+        if self.configName not in outputPaths:
+            raise ValueError("a build must be stored along with its " + self.configName)
+        entryDirectory = self.getEntryDirectory(key)
+        for name in self.outputNames:
+            if name not in outputPaths:
+                try:
+                    os.remove(entryDirectory.joinpath(name))
+                except FileNotFoundError:
+                    pass
+        return self.store(key, outputPaths)
@@ -6,17 +6,19 @@ and analysis.
 """
 
 class JSONDiff:
-    
+
     class Missing:
-        
+
+        __slots__ = ()
+
         def __eq__(self, other):
             if isinstance(other, JSONDiff.Missing):
                 return True
             return False
-        
+
         def __hash__(self):
             return 0
-        
+
     """There are a number of different kinds of diffs:
        - Empty (values are similar)
        - Value is missing (list/dict)
@@ -26,139 +28,227 @@ class JSONDiff:
        - Values do not match
          - Numeric values do not match
        - List of diffs
-       - Dict of diffs 
+       - Dict of diffs
+
+       The tree of diffs is built iteratively (so deeply nested values do not
+       run into the recursion limit), and a JSONDiff node is only allocated for
+       a value that actually differs; similar subtrees are walked without
+       allocating anything, and identical (`is`) subtrees are skipped outright.
+       Note that this means that an object compared with itself is similar,
+       even if it contains a NaN.
     """
 
+    __slots__ = ('json_a', 'json_b', 'type_diff', 'numeric_type_diff',
+                 'value_diff', 'dict_diff')
+
     def __init__(self, json_a, json_b):
-        
+
+        self._reset(json_a, json_b)
+        self._build()
+
+    @classmethod
+    def _new_node(cls, json_a, json_b):
+        """
+        Allocate a node without diffing its values (the caller fills it in).
+        """
+
+        node = cls.__new__(cls)
+        node._reset(json_a, json_b)
+        return node
+
+    def _reset(self, json_a, json_b):
+
         self.json_a = json_a
         self.json_b = json_b
-        
+
         self.type_diff = None
         self.numeric_type_diff = None
         self.value_diff = None
         self.dict_diff = {}
 
+    @staticmethod
+    def _compare_scalar(json_a, json_b):
+        """
+        Compare two values, at least one of which is not a container that we
+        descend into.  Returns a (type_diff, numeric_type_diff, value_diff)
+        triple, or None if json_a is a list/tuple or dict and json_b is of a
+        compatible type (i.e. the caller must descend into them).
+        """
+
         if isinstance(json_a, bool):
-            self.init_bool(json_a, json_b)
+            if not isinstance(json_b, bool):
+                return (bool, type(json_b)), None, None
+            elif json_a != json_b:
+                return None, None, (json_a, json_b)
+
         elif isinstance(json_a, (int, float)):
-            self.init_number(json_a, json_b)
+            if not isinstance(json_b, (int, float)):
+                return (type(json_a), type(json_b)), None, None
+            elif json_a != json_b:
+                return None, None, (json_a, json_b)
+            elif not isinstance(json_b, type(json_a)):
+                return None, (type(json_a), type(json_b)), None
+
         elif isinstance(json_a, str):
-            self.init_str(json_a, json_b)
+            if not isinstance(json_b, str):
+                return (str, type(json_b)), None, None
+            elif json_a != json_b:
+                return None, None, (json_a, json_b)
+
         elif isinstance(json_a, (list, tuple)):
-            self.init_list(json_a, json_b)
+            if not isinstance(json_b, (list, tuple)):
+                return (type(json_a), type(json_b)), None, None
+            return None
+
         elif isinstance(json_a, dict):
-            self.init_dict(json_a, json_b)
+            if not isinstance(json_b, dict):
+                return (dict, type(json_b)), None, None
+            return None
+
         elif isinstance(json_a, JSONDiff.Missing):
-            self.init_missing(json_a, json_b)
+            if not isinstance(json_b, JSONDiff.Missing):
+                return (JSONDiff.Missing, type(json_b)), None, None
+
         elif isinstance(json_a, type(None)):
-            self.init_null(json_a, json_b)
-        else:
-            self.init_unknown(json_a, json_b)
-
-    def init_bool(self, bool_a, json_b):
-        
-        if not isinstance(json_b, bool):
-            self.type_diff = (bool, type(json_b))
-        elif bool_a != json_b:
-            self.value_diff = (bool_a, json_b)
-    
-    def init_number(self, num_a, json_b):
-
-        if not isinstance(json_b, (int, float)):
-            self.type_diff = (type(num_a), type(json_b))
+            if not isinstance(json_b, type(None)):
+                return (type(None), type(json_b)), None, None
+
         else:
-            if num_a != json_b:
-                self.value_diff = (num_a, json_b)
-            elif not isinstance(json_b, type(num_a)):
-                self.numeric_type_diff = (type(num_a), type(json_b))
+            if not isinstance(json_b, type(json_a)):
+                return (type(json_a), type(json_b)), None, None
+            elif json_a != json_b:
+                return None, None, (json_a, json_b)
 
-    def init_str(self, str_a, json_b):
+        return None, None, None
 
-        if not isinstance(json_b, str):
-            self.type_diff = (str, type(json_b))
-        elif str_a != json_b:
-            self.value_diff = (str_a, json_b)
+    @staticmethod
+    def _children(json_a, json_b):
+        """
+        The (key, value_a, value_b) triples to be compared for two containers,
+        in the order in which their diffs are recorded.
+        """
 
-    def init_dict(self, dict_a, json_b):
-        if not isinstance(json_b, dict):
-            self.type_diff = (dict, type(json_b))
-        else:
-            for key, value_a in dict_a.items():
+        missing = JSONDiff.Missing()
+
+        if isinstance(json_a, dict):
+            for key, value_a in json_a.items():
                 if key in json_b:
-                    value_b = json_b[key]
-                    next_diff = JSONDiff(value_a, value_b)
-                    if not next_diff.is_similar_value():
-                        self.dict_diff[key] = next_diff
+                    yield key, value_a, json_b[key]
                 else:
-                    self.dict_diff[key] = JSONDiff(value_a, JSONDiff.Missing())
+                    yield key, value_a, missing
             for key, value_b in json_b.items():
-                if key not in dict_a:
-                    self.dict_diff[key] = JSONDiff(JSONDiff.Missing(), value_b)
-    
-    def init_missing(self, missing_a, json_b):
-        if not isinstance(json_b, JSONDiff.Missing):
-            self.type_diff = (JSONDiff.Missing, type(json_b))
-
-    def init_null(self, null_a, json_b):
-        if not isinstance(json_b, type(None)):
-            self.type_diff = (type(None), type(json_b))
-
-    def init_list(self, list_a, json_b):
+                if key not in json_a:
+                    yield key, missing, value_b
 
-        if not isinstance(json_b, (list, tuple)):
-            self.type_diff = (type(list_a), type(json_b))
         else:
-            for i, value_a in enumerate(list_a):
+            for i, value_a in enumerate(json_a):
                 if i < len(json_b):
-                    value_b = json_b[i]
-                    next_diff = JSONDiff(value_a, value_b)
-                    if not next_diff.is_similar_value():
-                        self.dict_diff[i] = next_diff
+                    yield i, value_a, json_b[i]
                 else:
-                    self.dict_diff[i] = JSONDiff(value_a, JSONDiff.Missing())
-
-            if len(json_b) > len(list_a):
-                for i, value_b in enumerate(json_b, len(list_a)):
-                    self.dict_diff[i] = JSONDiff(JSONDiff.Missing(), value_b)
-    
-    def init_unknown(self, json_a, json_b):
-        if not isinstance(json_b, type(json_a)):
-            self.type_diff = (type(json_a), type(json_b))
-        elif json_a != json_b:
-            self.value_diff = (json_a, json_b)
-    
+                    yield i, value_a, missing
+
+            if len(json_b) > len(json_a):
+                for i, value_b in enumerate(json_b, len(json_a)):
+                    yield i, missing, value_b
+
+    def _build(self):
+        """
+        Walk json_a and json_b depth-first with an explicit stack.
+
+        Each stack frame is a container pair that we are descending into:
+        [children iterator, json_a, json_b, parent frame, key in parent, node].
+        A container's node is only created (and hooked into its parent's
+        dict_diff, creating the parent's node if need be) once a difference
+        is found somewhere beneath it.
+        """
+
+        compared = JSONDiff._compare_scalar(self.json_a, self.json_b)
+        if compared is not None:
+            self.type_diff, self.numeric_type_diff, self.value_diff = compared
+            return
+
+        def attach(frame, key, node):
+            # record node under key in frame's node, creating that node (and
+            # hooking it into its own parent) first if this is the first
+            # difference found beneath frame.
+            while frame[5] is None:
+                frame[5] = JSONDiff._new_node(frame[1], frame[2])
+                frame[5].dict_diff[key] = node
+                node, key, frame = frame[5], frame[4], frame[3]
+            frame[5].dict_diff[key] = node
+
+        root = [JSONDiff._children(self.json_a, self.json_b),
+                self.json_a, self.json_b, None, None, self]
+        stack = [root]
+
+        while stack:
+            frame = stack[-1]
+            child = next(frame[0], None)
+            if child is None:
+                stack.pop()
+                continue
+
+            key, value_a, value_b = child
+
+            if value_a is value_b and (type(value_a) is not float or value_a == value_a):
+                continue
+
+            compared = JSONDiff._compare_scalar(value_a, value_b)
+            if compared is None:
+                stack.append([JSONDiff._children(value_a, value_b),
+                              value_a, value_b, frame, key, None])
+                continue
+
+            if compared != (None, None, None):
+                node = JSONDiff._new_node(value_a, value_b)
+                node.type_diff, node.numeric_type_diff, node.value_diff = compared
+                attach(frame, key, node)
+
+    def _postorder(self):
+        """
+        All of the nodes of this diff, each one after all of its descendants.
+        """
+
+        nodes = []
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            nodes.append(node)
+            stack.extend(node.dict_diff.values())
+        nodes.reverse()
+        return nodes
+
     def __eq__(self, other):
 
         if self.is_type_diff():
             if self.type_diff != other.type_diff:
                 return False
             return (self.json_a, self.json_b) == (other.json_a, other.json_b)
-        
+
         elif self.is_numeric_type_diff():
             if self.numeric_type_diff != other.numeric_type_diff:
                 return False
             return self.json_a == other.json_b
-        
+
         elif self.is_value_diff():
             return self.value_diff == other.value_diff
-        
+
         else:
-            
+
             if len(self.dict_diff) != len(other.dict_diff):
                 return False
-            
+
             for key, value in self.dict_diff.items():
                 if key not in other.dict_diff:
                     return False
                 if not self.dict_diff[key].__eq__(other.dict_diff[key]):
                     return False
-                
+
             return True
-                
+
     def __hash__(self):
-        
-        return (self.type_diff, 
+
+        return (self.type_diff,
                 self.numeric_type_diff,
                 self.value_diff,
                 hash(frozenset(list(self.dict_diff.items())))).__hash__()
@@ -172,160 +262,184 @@ class JSONDiff:
 
     def is_removed_value(self):
         return self.type_diff and isinstance(self.json_b, JSONDiff.Missing)
-    
+
     def is_type_diff(self):
         return self.type_diff
 
     def is_numeric_type_diff(self):
         return self.numeric_type_diff
-    
+
     def is_value_diff(self):
         return self.value_diff
 
     def is_numeric_value_diff(self):
         return self.value_diff and isinstance(self.json_a, (int, float))
-    
+
     def is_list_diff(self):
         return self.dict_diff and isinstance(self.json_a, (list, tuple))
-    
+
     def is_dict_diff(self):
         return self.dict_diff and not self.is_list_diff()
 
     def flatten(self):
 
+        for node in self._postorder():
+            node._flatten_children()
+
+    def _flatten_children(self):
+        """
+        Flatten one level, assuming that the children have been flattened.
+        """
+
         flat_dict_diff = {}
         for key, value in self.dict_diff.items():
-            
-            value.flatten()
-            
+
             if not value.dict_diff:
                 flat_dict_diff[key] = value
-            
+
             if isinstance(key, int):
                 key = "[%s]" % key
 
             for child_key, child_value in value.dict_diff.items():
-    
+
                 if isinstance(child_key, int):
                     flat_key = "%s[%s]" % (key, child_key)
                 else:
                     flat_key = "%s.%s" % (key, child_key)
-                
+
                 flat_dict_diff[flat_key] = child_value
-                               
+
         self.dict_diff = flat_dict_diff
-    
+
     def ignore_numeric_type_diff(self):
-        
-        if self.numeric_type_diff:
-            self.numeric_type_diff = None
-        
-        elif self.dict_diff:
-
-            keys_to_remove = []
-            for key, diff in self.dict_diff.items():
-                
-                diff.ignore_numeric_type_diff()   
-                if diff.is_similar_value():
-                    keys_to_remove.append(key)
-            
-            for key in keys_to_remove:
-                del self.dict_diff[key]
-    
+
+        for node in self._postorder():
+
+            if node.numeric_type_diff:
+                node.numeric_type_diff = None
+
+            elif node.dict_diff:
+                node._remove_similar_children()
+
     def ignore_numeric_value_diff(self, tolerance):
 
-        if self.is_numeric_value_diff() and \
-           abs(self.json_a - self.json_b) <= tolerance:
-            self.value_diff = None
-        
-        elif self.dict_diff:
-
-            keys_to_remove = []
-            for key, diff in self.dict_diff.items():
-                
-                diff.ignore_numeric_value_diff(tolerance)   
-                if diff.is_similar_value():
-                    keys_to_remove.append(key)
-            
-            for key in keys_to_remove:
-                del self.dict_diff[key]
+        for node in self._postorder():
+
+            if node.is_numeric_value_diff() and \
+               abs(node.json_a - node.json_b) <= tolerance:
+                node.value_diff = None
+
+            elif node.dict_diff:
+                node._remove_similar_children()
+
+    def _remove_similar_children(self):
+
+        keys_to_remove = []
+        for key, diff in self.dict_diff.items():
+            if diff.is_similar_value():
+                keys_to_remove.append(key)
+
+        for key in keys_to_remove:
+            del self.dict_diff[key]
 
     def pretty_str(self, indent_size=2, trim_size=12,
                    root=True):
-        
+
         """
         A pretty-formatted, indented report of diffs.
+
+        Each nested level of the report is indented by indent_size more
+        than its parent; the report is assembled from a flat list of pieces
+        (rather than by re-indenting the report of each child) so that deep
+        diffs do not recurse.
         """
 
         def small_str(value, size):
 
-            if not isinstance(value, str): 
+            if not isinstance(value, str):
                 value_str = json.dumps(value)
             else:
                 value_str = str(value)
 
             if len(value_str) > (size + len('...')):
                 value_str = value_str[:size] + '...'
-            
+
             if isinstance(value, str):
                 value_str = '"' + value_str + '"'
             return value_str
-        
-        def indent_str(value_str, size):
-            indent = " " * size
-            return indent + value_str.replace("\n", "\n" + indent)
 
-        if self.is_added_value():
-            return "+++ %s was added" % small_str(self.json_b, trim_size)
+        def leaf_str(node):
+
+            if node.is_added_value():
+                return "+++ %s was added" % small_str(node.json_b, trim_size)
+
+            elif node.is_removed_value():
+                return "--- %s was removed" % small_str(node.json_a, trim_size)
 
-        elif self.is_removed_value():
-            return "--- %s was removed" % small_str(self.json_a, trim_size)
+            elif node.type_diff:
+                return "*** %s and %s have different types (%s vs %s)" % \
+                        (small_str(node.json_a, trim_size), small_str(node.json_b, trim_size),
+                         node.type_diff[0].__name__, node.type_diff[1].__name__)
 
-        elif self.type_diff:
-            return "*** %s and %s have different types (%s vs %s)" % \
-                    (small_str(self.json_a, trim_size), small_str(self.json_b, trim_size),
-                     self.type_diff[0].__name__, self.type_diff[1].__name__)
+            elif node.numeric_type_diff:
+                return "### %s and %s have different numeric types (%s vs %s)" % \
+                        (small_str(node.json_a, trim_size), small_str(node.json_b, trim_size),
+                         node.numeric_type_diff[0].__name__, node.numeric_type_diff[1].__name__)
 
-        elif self.numeric_type_diff:
-            return "### %s and %s have different numeric types (%s vs %s)" % \
-                    (small_str(self.json_a, trim_size), small_str(self.json_b, trim_size),
-                     self.numeric_type_diff[0].__name__, self.numeric_type_diff[1].__name__)
+            elif node.is_numeric_value_diff():
+                # TODO: Report close values differently?
+                return "::: %s and %s do not match" % (node.json_a, node.json_b)
 
-        elif self.is_numeric_value_diff():
-            # TODO: Report close values differently?
-            return "::: %s and %s do not match" % (self.json_a, self.json_b)
+            elif node.value_diff:
+                return "::: %s and %s do not match" % \
+                        (small_str(node.json_a, trim_size), small_str(node.json_b, trim_size))
 
-        elif self.value_diff:
-            return "::: %s and %s do not match" % \
-                    (small_str(self.json_a, trim_size), small_str(self.json_b, trim_size))
+            elif node.dict_diff:
+                return None
 
-        elif self.dict_diff:
-            keys = list(self.dict_diff.keys())
+            else:
+                return "(empty)"
+
+        pieces = []
+
+        def emit(text, depth):
+            pieces.append(text.replace("\n", "\n" + " " * (indent_size * depth)))
+
+        # each stack entry is either a node to be reported at a given depth
+        # (and root-ness), or a literal piece of text.
+        stack = [(self, 0, root)]
+        while stack:
+            entry = stack.pop()
+            if isinstance(entry[0], str):
+                emit(entry[0], entry[1])
+                continue
+
+            node, depth, is_root = entry
+            text = leaf_str(node)
+            if text is not None:
+                emit(text, depth)
+                continue
+
+            keys = list(node.dict_diff.keys())
             keys.sort()
-            pretty = ""
+            work = []
             for key in keys:
-                
+
                 if key != keys[0]:
-                    pretty = pretty + "\n"
+                    work.append(("\n", depth))
 
-                next_diff = self.dict_diff[key]
+                next_diff = node.dict_diff[key]
                 if next_diff.is_similar_value():
                     continue
-                
+
                 if isinstance(key, int):
                     key = "[%s]" % key
-                elif not root:
+                elif not is_root:
                     key = ".%s" % key
 
-                pretty = pretty + "%s:\n%s" % (key, 
-                    indent_str(next_diff.pretty_str(indent_size=indent_size,
-                                                    trim_size=trim_size,
-                                                    root=False),
-                               indent_size))
-
-            return pretty
-
-        else:
-            return "(empty)"
+                work.append(("%s:\n%s" % (key, " " * indent_size), depth))
+                work.append((next_diff, depth + 1, False))
 
+            stack.extend(reversed(work))
 
+        return "".join(pieces)
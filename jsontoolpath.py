@@ -0,0 +1,324 @@
+import codecs
+import json
+import os
+import re
+
+
+# Helpers for reading jsontoolpath files (the toolpath format that miracle_grue emits in response to the --json-toolpath-output option).
+# A jsontoolpath file is a single json array whose elements are dicts like:
+#   {'command': {'function': 'move', 'parameters': {'x':..., 'y':..., 'z':..., 'a':..., 'feedrate':...}, 'tags': [...]}}
+# For a long print, the file can be several gigabytes, so we want to avoid ever holding the whole array in memory.
+
+
+_decoder = json.JSONDecoder()
+_whitespace = ' \t\n\r'
+_delimiters = _whitespace + ',]'
+# the number of steps in which iterateJsontoolpathItems() reports its progress.
+progressResolution = 1000
+
+#inputJsontoolpathFile is a readable (text-mode) file-like object that is assumed to be a valid jsontoolpath file.
+# yields the elements of the top-level array, one at a time, while only ever holding roughly one chunk of the file in memory.
+# The elements are parsed with the same json decoder that json.load() uses, so the yielded values are identical to
+# the elements of json.load(inputJsontoolpathFile).
+# progressReportingCallback, if given, is expected to be a function that will be passed a single argument:
+# a float representing the completion ratio (based on the number of characters consumed so far, relative to the size of the file).
+# We call it whenever the ratio has advanced by another 1/progressResolution, rather than after every element.
+# withByteOffsets, if True, makes us yield (byteOffset, item) pairs, where byteOffset is the offset (in the utf-8 encoding of the file,
+# relative to where we started reading) at which the element starts, so that we can later seek straight to it.
+# fromElement, if True, means that inputJsontoolpathFile is positioned at the start of an element of the top-level array (e.g. at 
+# an offset yielded with withByteOffsets), rather than at the start of the array.
+def iterateJsontoolpathItems(inputJsontoolpathFile, chunkSize=1<<20, progressReportingCallback=None, withByteOffsets=False, fromElement=False):
+    totalSize = None
+    if progressReportingCallback:
+        try:
+            totalSize = os.fstat(inputJsontoolpathFile.fileno()).st_size or None
+        except (AttributeError, OSError, ValueError):
+            #inputJsontoolpathFile might be something like a StringIO or a pipe, in which case we have no way to know the total size.
+            totalSize = None
+    # the number of characters that we must have consumed before we next call progressReportingCallback.
+    nextProgressPosition = 0
+    progressStep = (totalSize // progressResolution if totalSize else None)
+    consumed = 0
+    # the number of bytes (in utf-8) that precede the buffer, and whether the buffer is all ascii (in which case character 
+    # offsets within it are also byte offsets).  Otherwise, we measure the encoded length of the buffer up to each element
+    # incrementally, from the last position that we measured (measuredPosition, which is measuredBytes bytes into the buffer).
+    # We only keep track of these if withByteOffsets is True.
+    consumedBytes = 0
+    bufferIsAscii = True
+    measuredPosition = 0
+    measuredBytes = 0
+
+    def getByteOffset(characterPosition):
+        nonlocal measuredPosition, measuredBytes
+        if bufferIsAscii:
+            return consumedBytes + characterPosition
+        measuredBytes += len(buffer[measuredPosition:characterPosition].encode('utf-8'))
+        measuredPosition = characterPosition
+        return consumedBytes + measuredBytes
+
+    buffer = ""
+    position = 0
+    endOfFile = False
+
+    # returns False if there is no more data to be read.
+    def readMore():
+        nonlocal buffer, position, endOfFile, consumed, consumedBytes, bufferIsAscii, measuredPosition, measuredBytes
+        if endOfFile:
+            return False
+        chunk = inputJsontoolpathFile.read(chunkSize)
+        if not chunk:
+            endOfFile = True
+            return False
+        consumed += position
+        if withByteOffsets:
+            consumedBytes = getByteOffset(position)
+        buffer = buffer[position:] + chunk
+        position = 0
+        if withByteOffsets:
+            bufferIsAscii = buffer.isascii()
+            measuredPosition = 0
+            measuredBytes = 0
+        return True
+
+    # advances position past any whitespace, reading more of the file as needed.
+    # returns the next non-whitespace character, or None at end of file.
+    def peekSignificantCharacter():
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in _whitespace:
+                position += 1
+            if position < len(buffer):
+                return buffer[position]
+            if not readMore():
+                return None
+
+    if not fromElement:
+        if peekSignificantCharacter() != '[':
+            raise ValueError("a jsontoolpath file is expected to contain a json array.")
+        position += 1
+
+    expectingFirstElement = True
+    while True:
+        character = peekSignificantCharacter()
+        if character is None:
+            raise ValueError("unexpected end of jsontoolpath file (the top-level array was never closed).")
+        if character == ']':
+            position += 1
+            if totalSize:
+                progressReportingCallback(min(1, (consumed + position)/totalSize))
+            break
+        if not expectingFirstElement:
+            if character != ',':
+                raise ValueError("expected ',' or ']' at offset " + str(consumed + position) + " in the jsontoolpath file.")
+            position += 1
+            character = peekSignificantCharacter()
+            if character is None:
+                raise ValueError("unexpected end of jsontoolpath file (the top-level array was never closed).")
+        expectingFirstElement = False
+
+        while True:
+            try:
+                item, endPosition = _decoder.raw_decode(buffer, position)
+            except json.decoder.JSONDecodeError:
+                # the element probably straddles the end of the buffer.  Read more and try again.
+                if readMore():
+                    continue
+                raise
+            # a scalar (e.g. a number) that runs up to the end of the buffer might have been cut short by the chunk boundary,
+            # so we only accept an element once we can see the delimiter that follows it.
+            if (endPosition == len(buffer) or buffer[endPosition] not in _delimiters) and readMore():
+                continue
+            break
+        if withByteOffsets:
+            yield getByteOffset(position), item
+        else:
+            yield item
+        position = endPosition
+
+        if totalSize and consumed + position >= nextProgressPosition:
+            progressReportingCallback(min(1, (consumed + position)/totalSize))
+            nextProgressPosition = consumed + position + progressStep
+
+class FollowedFileReplacedError(Exception):
+    pass
+
+# a readable (text-mode) file-like object for a jsontoolpath file that another process (i.e. miracle_grue) is still writing, so that
+# we can start consuming the toolpath (with iterateJsontoolpathItems()) before it is complete.
+# When we catch up with the writer, read() waits (polling every pollInterval seconds) for more data to appear, until producerFinished
+# (a threading.Event) is set, after which reaching the end of the file means the end of the toolpath.
+# We read bytes and decode them ourselves, so that a multi-byte character that the writer has only partly written is not an error.
+# If, by the time the writer finishes, the path names a different file than the one that we have been following (i.e. the writer 
+# wrote to a new file and renamed it into place), read() raises FollowedFileReplacedError.
+class FollowedFile:
+    def __init__(self, path, producerFinished, pollInterval=0.05):
+        self.path = path
+        self.producerFinished = producerFinished
+        self.pollInterval = pollInterval
+        self._file = open(path, 'rb')
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+
+    def read(self, size=-1):
+        while True:
+            # we note whether the writer had finished before we read, so that, if it had, an empty read really is the end of the file.
+            producerHadFinished = self.producerFinished.is_set()
+            data = self._file.read(size)
+            if data:
+                text = self._decoder.decode(data)
+                if text:
+                    return text
+                continue
+            if producerHadFinished:
+                if os.stat(self.path).st_ino != os.fstat(self._file.fileno()).st_ino:
+                    raise FollowedFileReplacedError(str(self.path) + " was replaced by a new file while we were following it.")
+                return self._decoder.decode(b'', final=True)
+            self.producerFinished.wait(self.pollInterval)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exceptionType, exception, traceback):
+        self.close()
+        return False
+
+#yields (item, nextItem) pairs, where nextItem is the element that follows item in iterable, or endOfItems if item is the last element.
+# This takes the place of random access (i.e. peeking at toolpath[index+1]) for code that walks a streamed toolpath.
+endOfItems = object()
+def withLookahead(iterable):
+    iterator = iter(iterable)
+    item = next(iterator, endOfItems)
+    while item is not endOfItems:
+        nextItem = next(iterator, endOfItems)
+        yield item, nextItem
+        item = nextItem
+
+# the comments by which miracle_grue marks the start of a new layer (e.g. "Upper Position  0.45" or "Upper Position  1.51 (+0.26)")
+# and of a new layer section (e.g. "Layer Section 12 (13)").
+upperPositionPrefix = "Upper Position"
+layerSectionPrefix = "Layer Section "
+
+# returns the noodle type (the ";TYPE:..." of the previewable gcode, e.g. "FILL" or "WALL-OUTER") of a move having the given tags 
+# (a set of strings), or None if the tags do not imply a noodle type, in which case the noodle type of the previous move carries on.
+# This is the mapping that generatePreviewableGcode() (in make_printable.py) uses; the toolpath statistics (see toolpath_stats) use it too.
+# location describes where the move is (e.g. "at index 12 in the json toolpath"), for the message about an unexpected combination of tags.
+def getNoodleType(tags, location="somewhere in the json toolpath"):
+    # tags encountered in a typical jsontoolpath:
+    #   BeadMode External
+    #   BeadMode Internal
+    #   BeadMode Internal Thick
+    #   BeadMode User3
+    #   Connection
+    #   Infill
+    #   Inset
+    #   Invalid Move
+    #   Leaky Travel Move
+    #   Long Restart
+    #   Restart
+    #   Retract
+    #   Support
+    #   Trailing Extrusion Move
+    #   Travel Move
+
+    # we need to map these (or, more accurately, combinations of these tags) to 
+    # one of the following values for noodleType:
+    # The travel and retract moves are detected implicitly by the cura gcode previewer, so they 
+    # don't have an explicit noodleType (which is one of the reasons I chose the name "noodleType":
+    # these categroies only apply to moves that produce a noodle.
+    #
+    #    WALL-INNER         
+    #    WALL-OUTER         
+    #    SKIN               
+    #    SKIRT              
+    #    SUPPORT            
+    #    FILL              
+    #    SUPPORT-INTERFACE  
+    #    PRIME-TOWER        
+
+
+
+    if "Support" in tags:
+        thisNoodleType = "SUPPORT"
+    elif "Infill" in tags:
+        thisNoodleType = "FILL"
+    elif "Inset" in tags:
+        #there are two possible senses for the words inner/internal and outer/external.  On the one hand, we might be
+        #  trying to distinguish between faces of holes vs. "outer" faces.  On the other hand, we might be
+        #  referring to the outermost shell vs. inner shells.
+        # I am not entirely sure if Cura's concept of WALL-OUTER vs. WALL-INNER is the same as MAkerbot's concept of BeadMode External
+    
+        tagsContainingExternal = (tag for tag in tags if "External" in tag)
+        tagsContainingInternal = (tag for tag in tags if "Internal" in tag)
+        # print("\n" + str(len(list(tagsContainingExternal)))  + "\t" + str(len(list(tagsContainingInternal))) + "\n")
+        if tagsContainingExternal:
+            thisNoodleType = "WALL-OUTER"
+        elif tagsContainingInternal:
+            thisNoodleType = "WALL-INNER"
+        else:
+            print(
+                "strangely, " + location + ", we have encountered a \"move\" "
+                + "command having the \"Inset\" tag where none of the tags contains the word \"External\" "
+                + "and none of the tags contains the word \"Internal\"."
+            )
+            #we'll blindly assume that we are dealing with "WALL-OUTER"
+            thisNoodleType = "WALL-OUTER"
+            pass
+    else:
+        #the default is to assume that noodleType has not changed (which we record as None).
+        thisNoodleType = None
+    return thisNoodleType
+
+# returns True if a comment sequence ends just before nextItem (as returned by withLookahead()), i.e. if nextItem is the end of
+# the toolpath or is a command other than a comment.  (An item that is not a command at all does not interrupt a comment sequence.)
+def endsCommentSequence(nextItem):
+    return (nextItem is endOfItems) or bool(nextItem.get('command') and nextItem.get('command').get('function') != 'comment')
+
+# yields the layers of a toolpath, one at a time, given an iterable of toolpath items (such as iterateJsontoolpathItems() returns).
+# A new layer starts with each comment sequence that declares an upper position different from that of the previous layer
+# (the same rule by which generatePreviewableGcode() emits its "; LAYER" comments), and the comment sequence belongs to the layer that it starts.
+# Each layer is a dict:
+#   'layerNumber':          0 for whatever precedes the first layer (typically, the start-up commands), then 1, 2, ... (matching
+#                           the numbers in the "; LAYER" comments of the previewable gcode).
+#   'upperPosition':        the upper position of the layer, as a string (None for layer 0).
+#   'layerSections':        the layer section numbers (i.e. the numbers of the ";LAYER:" comments of the previewable gcode) seen on
+#                           the layer, as in the layer index (see layer_index).
+#   'parenthesizedNumbers': the numbers in parentheses after "Layer Section" in the comments of the layer.
+#   'items':                the items of the layer, in order (items that are not commands are dropped).
+# Only one layer is held in memory at a time.
+def iterateLayers(toolpathItems):
+    layer = {'layerNumber': 0, 'upperPosition': None, 'layerSections': [], 'parenthesizedNumbers': [], 'items': []}
+    lastUpperPosition = None
+    layerSectionIndex = -1
+    commentSequence = []
+    upperPositionOfCommentSequence = None
+    parenthesizedNumberOfCommentSequence = None
+    for item, nextItem in withLookahead(toolpathItems):
+        command = item.get('command')
+        if not command:
+            continue
+        if command['function'] != 'comment':
+            layer['items'].append(item)
+            continue
+        commentSequence.append(item)
+        comment = command['parameters']['comment']
+        if comment.startswith(upperPositionPrefix):
+            upperPositionOfCommentSequence = comment[len(upperPositionPrefix):].strip()
+        if comment.startswith(layerSectionPrefix):
+            parenthesizedNumberOfCommentSequence = int(re.search(r'\(\s*(\d+)\s*\)', comment[len(layerSectionPrefix):]).group(1))
+        if endsCommentSequence(nextItem):
+            if upperPositionOfCommentSequence is not None and upperPositionOfCommentSequence != lastUpperPosition:
+                yield layer
+                layer = {'layerNumber': layer['layerNumber'] + 1, 'upperPosition': upperPositionOfCommentSequence, 'layerSections': [], 'parenthesizedNumbers': [], 'items': []}
+                lastUpperPosition = upperPositionOfCommentSequence
+            # a comment sequence that declares a layer section counts towards the layer that it is on (which might be the layer that it starts).
+            if parenthesizedNumberOfCommentSequence is not None:
+                layerSectionIndex += 1
+                layer['layerSections'].append(layerSectionIndex)
+                layer['parenthesizedNumbers'].append(parenthesizedNumberOfCommentSequence)
+            layer['items'] += commentSequence
+            commentSequence = []
+            upperPositionOfCommentSequence = None
+            parenthesizedNumberOfCommentSequence = None
+    layer['items'] += commentSequence
+    yield layer
@@ -0,0 +1,178 @@
+import collections
+import difflib
+import math
+import re
+
+import jsontoolpath
+from jsondiff_by_makerbot import JSONDiff
+
+
+# A layer-aligned, streaming comparison of two jsontoolpath files, for finding out how the toolpath changed when we upgrade MakerWare
+# or change a config transform.
+# Loading two multi-gigabyte toolpaths into a JSONDiff is out of the question, and comparing the two command lists index by index
+# reports every subsequent command as changed as soon as one move has been inserted.  Instead, we walk both files one layer at a time
+# (see jsontoolpath.iterateLayers()), pair up the layers by their upper position, and, within each pair of layers, line up the moves
+# with difflib, treating two moves as the same if their tags match and their parameters agree to within a numeric tolerance.
+# Memory use is bounded by the size of the largest layer rather than by the size of the toolpath.
+
+
+moveParameterNames = ['x', 'y', 'z', 'a', 'feedrate']
+
+# returns the leading number of an upper position (e.g. 1.51 for "1.51 (+0.26)"), or None if there isn't one.
+def parseUpperPosition(upperPosition):
+    match = re.match(r'\s*([-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?)', upperPosition or "")
+    return float(match.group(1)) if match else None
+
+def getMoves(layer):
+    return [item['command'] for item in layer['items'] if item['command']['function'] == 'move']
+
+# the key by which difflib lines up moves: the tags, along with the parameters rounded to multiples of tolerance.
+# Two moves whose parameters straddle a rounding boundary get different keys even though they are within tolerance of one another;
+# such pairs turn up in the 'replace' blocks, where we compare them properly (see getChangedMoveParameters()).
+def getMoveKey(move, tolerance):
+    parameters = move['parameters']
+    if tolerance:
+        values = tuple(round(parameters.get(name, 0) / tolerance) for name in moveParameterNames)
+    else:
+        values = tuple(parameters.get(name) for name in moveParameterNames)
+    return values + tuple(move.get('tags', []))
+
+# returns the list of the names of the parameters of move_b that differ (by more than tolerance) from those of move_a,
+# (with "tags" standing for the tags), or an empty list if the moves match.
+def getChangedMoveParameters(move_a, move_b, tolerance):
+    diff = JSONDiff(move_a['parameters'], move_b['parameters'])
+    diff.ignore_numeric_type_diff()
+    diff.ignore_numeric_value_diff(tolerance)
+    changedParameters = sorted(map(str, diff.dict_diff.keys())) if not diff.is_similar_value() else []
+    if move_a.get('tags', []) != move_b.get('tags', []):
+        changedParameters.append("tags")
+    return changedParameters
+
+# compares the moves of one layer of toolpath a with those of the corresponding layer of toolpath b.
+# returns a dict with the counts of 'unchanged', 'added', 'removed' and 'changed' moves, and 'changedParameters', a dict mapping
+# the name of each parameter to the number of changed moves in which that parameter changed.
+def diffLayerMoves(moves_a, moves_b, tolerance):
+    summary = {'unchanged': 0, 'added': 0, 'removed': 0, 'changed': 0, 'changedParameters': collections.Counter()}
+    matcher = difflib.SequenceMatcher(
+        a=[getMoveKey(move, tolerance) for move in moves_a],
+        b=[getMoveKey(move, tolerance) for move in moves_b],
+        autojunk=False
+    )
+    for opcode, start_a, end_a, start_b, end_b in matcher.get_opcodes():
+        if opcode == 'equal':
+            summary['unchanged'] += end_a - start_a
+            continue
+        # within a replaced block, we pair up the moves in order, and regard whatever is left over as removed or added.
+        pairCount = min(end_a - start_a, end_b - start_b)
+        for move_a, move_b in zip(moves_a[start_a:start_a + pairCount], moves_b[start_b:start_b + pairCount]):
+            changedParameters = getChangedMoveParameters(move_a, move_b, tolerance)
+            if changedParameters:
+                summary['changed'] += 1
+                summary['changedParameters'].update(changedParameters)
+            else:
+                summary['unchanged'] += 1
+        summary['removed'] += (end_a - start_a) - pairCount
+        summary['added'] += (end_b - start_b) - pairCount
+    summary['changedParameters'] = dict(sorted(summary['changedParameters'].items()))
+    return summary
+
+# given two iterables of layers (as yielded by jsontoolpath.iterateLayers()), yields (layer_a, layer_b) pairs, where one of the
+# two is None if the other toolpath has no layer at the same upper position.
+# Layers are paired by upper position (to within tolerance), on the assumption that the upper position increases from layer to layer.
+# Where the upper position of a layer cannot be parsed as a number, we fall back to pairing the layers in order.
+def alignLayers(layers_a, layers_b, tolerance):
+    layers_a = iter(layers_a)
+    layers_b = iter(layers_b)
+    layer_a = next(layers_a, None)
+    layer_b = next(layers_b, None)
+    while layer_a is not None or layer_b is not None:
+        if layer_a is None or layer_b is None:
+            pairing = 'b' if layer_a is None else 'a'
+        elif layer_a['upperPosition'] is None or layer_b['upperPosition'] is None:
+            # the layers before the first upper position can only pair with one another.
+            pairing = 'a' if layer_b['upperPosition'] is not None else ('b' if layer_a['upperPosition'] is not None else 'both')
+        else:
+            position_a = parseUpperPosition(layer_a['upperPosition'])
+            position_b = parseUpperPosition(layer_b['upperPosition'])
+            if position_a is None or position_b is None or math.isclose(position_a, position_b, rel_tol=0, abs_tol=tolerance):
+                pairing = 'both'
+            else:
+                pairing = 'a' if position_a < position_b else 'b'
+
+        if pairing == 'both':
+            yield layer_a, layer_b
+            layer_a = next(layers_a, None)
+            layer_b = next(layers_b, None)
+        elif pairing == 'a':
+            yield layer_a, None
+            layer_a = next(layers_a, None)
+        else:
+            yield None, layer_b
+            layer_b = next(layers_b, None)
+
+# compares two jsontoolpath files (given as readable text-mode file-like objects), yielding a summary of each (aligned) layer:
+#   'layerNumber_a', 'layerNumber_b', 'upperPosition_a', 'upperPosition_b', 'layerSections_a', 'layerSections_b' (the layer section
+#   numbers seen on the layer; see jsontoolpath.iterateLayers()): None for a layer that is missing from one of the toolpaths.
+#   'unchanged', 'added', 'removed', 'changed', 'changedParameters': as returned by diffLayerMoves().
+# tolerance is the largest difference between two numeric move parameters that is not regarded as a change (in the spirit of
+# JSONDiff.ignore_numeric_value_diff()).
+# progressReportingCallback, if given, is passed the completion ratio of toolpath a.
+def diffJsontoolpaths(jsontoolpathFile_a, jsontoolpathFile_b, tolerance=1e-4, progressReportingCallback=None):
+    layers_a = jsontoolpath.iterateLayers(jsontoolpath.iterateJsontoolpathItems(jsontoolpathFile_a, progressReportingCallback=progressReportingCallback))
+    layers_b = jsontoolpath.iterateLayers(jsontoolpath.iterateJsontoolpathItems(jsontoolpathFile_b))
+    for layer_a, layer_b in alignLayers(layers_a, layers_b, tolerance):
+        summary = {
+            'layerNumber_a': layer_a and layer_a['layerNumber'],
+            'layerNumber_b': layer_b and layer_b['layerNumber'],
+            'upperPosition_a': layer_a and layer_a['upperPosition'],
+            'upperPosition_b': layer_b and layer_b['upperPosition'],
+            'layerSections_a': layer_a and layer_a['layerSections'],
+            'layerSections_b': layer_b and layer_b['layerSections'],
+        }
+        summary.update(diffLayerMoves(getMoves(layer_a) if layer_a else [], getMoves(layer_b) if layer_b else [], tolerance))
+        yield summary
+
+def isUnchangedLayer(summary):
+    return (
+        summary['layerNumber_a'] is not None and summary['layerNumber_b'] is not None
+        and not (summary['added'] or summary['removed'] or summary['changed'])
+    )
+
+# returns a human-readable report of the layer summaries yielded by diffJsontoolpaths(): a table with a row for each layer that
+# differs, followed by the totals.
+def formatJsontoolpathDiffReport(summaries):
+    formatCell = lambda x: "-" if x is None else str(x)
+    formatLayerSections = lambda layerSections: "-" if not layerSections else ", ".join(map(str, layerSections))
+    columns = [
+        ("layer a",    lambda s: formatCell(s['layerNumber_a'])),
+        ("layer b",    lambda s: formatCell(s['layerNumber_b'])),
+        ("z a",        lambda s: formatCell(s['upperPosition_a'])),
+        ("z b",        lambda s: formatCell(s['upperPosition_b'])),
+        ("sections a", lambda s: formatLayerSections(s['layerSections_a'])),
+        ("sections b", lambda s: formatLayerSections(s['layerSections_b'])),
+        ("unchanged",  lambda s: str(s['unchanged'])),
+        ("added",      lambda s: str(s['added'])),
+        ("removed",    lambda s: str(s['removed'])),
+        ("changed",    lambda s: str(s['changed'])),
+        ("changed parameters", lambda s: ", ".join(name + " (" + str(count) + ")" for name, count in s['changedParameters'].items()))
+    ]
+    totals = {'layers': 0, 'changedLayers': 0, 'unchanged': 0, 'added': 0, 'removed': 0, 'changed': 0}
+    rows = [[heading for heading, _ in columns]]
+    for summary in summaries:
+        totals['layers'] += 1
+        for key in ['unchanged', 'added', 'removed', 'changed']:
+            totals[key] += summary[key]
+        if not isUnchangedLayer(summary):
+            totals['changedLayers'] += 1
+            rows.append([getCell(summary) for _, getCell in columns])
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    table = "\n".join(
+        "  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip()
+        for row in rows
+    ) if len(rows) > 1 else "no layers differ."
+    return (
+        table + "\n\n"
+        + str(totals['changedLayers']) + " of " + str(totals['layers']) + " layers differ; moves: "
+        + str(totals['unchanged']) + " unchanged, " + str(totals['added']) + " added, "
+        + str(totals['removed']) + " removed, " + str(totals['changed']) + " changed."
+    )
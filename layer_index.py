@@ -0,0 +1,162 @@
+import json
+import os
+import pathlib
+import re
+
+
+# A persistent "sidecar" index of the layers of a toolpath file (a jsontoolpath or a columnar toolpath), so that we can generate
+# the previewable gcode for a few layers of a big print (see --layers) without processing the whole toolpath.
+# The index is recorded by generatePreviewableGcode() (in make_printable.py) the first time that it converts a toolpath in full, and
+# is kept next to the toolpath, in a file named after it (with ".layers.json" appended).  It is only used while the toolpath's size
+# and modification time are those that were recorded along with it.
+#
+# The index is a list of layers, the first of which (layer 0) is whatever precedes the first "Upper Position" comment.  Each layer
+# is a dict:
+#   'layerNumber':          as in the "; LAYER" comments of the previewable gcode (and jsontoolpath.iterateLayers()).
+#   'upperPosition':        the upper position (z) of the layer, as a string (None for layer 0).
+#   'itemIndex':            the index (in the toolpath) of the first item of the comment sequence that starts the layer.
+#   'byteOffset':           the offset in the jsontoolpath file at which that item starts (None for a columnar toolpath).
+#   'layerSections':        the layer section numbers (i.e. the numbers of the ";LAYER:" comments) seen on the layer.
+#   'parenthesizedNumbers': the numbers in parentheses after "Layer Section" in the comments of the layer, e.g. 13 for "Layer Section 12 (13)".
+#   'noodleType':           the noodle type (see generatePreviewableGcode()) in effect at the start of the layer.
+#   'layerSectionIndex':    the number of the last layer section before the start of the layer (-1 if there is none).
+# These are enough for generatePreviewableGcode() to pick up the conversion at the start of any layer.
+# Where there is no index yet, scanJsontoolpathLayers() (for a jsontoolpath) and toolpath_stats.findLayers() (for a columnar toolpath)
+# find the layers without converting the toolpath.
+
+
+def getLayerIndexFilePath(toolpathFilePath):
+    toolpathFilePath = pathlib.Path(toolpathFilePath)
+    return toolpathFilePath.with_name(toolpathFilePath.name + ".layers.json")
+
+def _getToolpathStamp(toolpathFilePath):
+    status = os.stat(toolpathFilePath)
+    return {'toolpathSize': status.st_size, 'toolpathMtimeNs': status.st_mtime_ns}
+
+# writes the index of the layers of the toolpath at toolpathFilePath (see above) next to it.
+# columnar tells whether the toolpath is a columnar toolpath, in which case the byte offsets (which are offsets into the
+# jsontoolpath from which the layers were recorded) do not apply.
+# returns the path of the index, or None if the layers cannot serve as the index of a jsontoolpath (because they were found in a 
+# columnar toolpath, and so lack byte offsets).
+def saveLayerIndex(toolpathFilePath, layers, columnar=False):
+    layerIndexFilePath = getLayerIndexFilePath(toolpathFilePath)
+    if columnar:
+        layers = [dict(layer, byteOffset=None) for layer in layers]
+    elif any(layer['byteOffset'] is None for layer in layers[1:]):
+        return None
+    temporaryPath = layerIndexFilePath.with_name("." + layerIndexFilePath.name + "." + str(os.getpid()) + ".tmp")
+    with open(temporaryPath, 'w') as layerIndexFile:
+        json.dump(dict(_getToolpathStamp(toolpathFilePath), layers=layers), layerIndexFile)
+    os.replace(temporaryPath, layerIndexFilePath)
+    return layerIndexFilePath
+
+# returns the list of layers recorded for the toolpath at toolpathFilePath, or None if there is no index, or if the toolpath has
+# changed since the index was recorded.
+def loadLayerIndex(toolpathFilePath):
+    try:
+        with open(getLayerIndexFilePath(toolpathFilePath), 'r') as layerIndexFile:
+            layerIndex = json.load(layerIndexFile)
+    except (OSError, ValueError):
+        return None
+    if {key: layerIndex.get(key) for key in ['toolpathSize', 'toolpathMtimeNs']} != _getToolpathStamp(toolpathFilePath):
+        return None
+    return layerIndex['layers']
+
+# returns the layers of a jsontoolpath (see above), given as a readable text-mode file-like object, by the same rules by which
+# generatePreviewableGcode() records them, but without converting the toolpath: we only look at the comments, and at the tags of the
+# moves (for the noodle type).  This costs little more than parsing the toolpath, which is under half of the work of converting it, so
+# that the first conversion of a toolpath can be shared among several processes (see writePreviewableGcodeFile() in make_printable.py).
+# progressReportingCallback is as for jsontoolpath.iterateJsontoolpathItems().
+def scanJsontoolpathLayers(jsontoolpathFile, progressReportingCallback=None):
+    import jsontoolpath
+    layers = [{'layerNumber': 0, 'upperPosition': None, 'itemIndex': 0, 'byteOffset': None, 'layerSections': [], 'parenthesizedNumbers': [], 'noodleType': None, 'layerSectionIndex': -1}]
+    noodleType = None
+    noodleTypesByTags = {}
+    layerSectionIndex = -1
+    lastUpperPosition = None
+    # (as in generatePreviewableGcode(), the toolpath starts out in a comment sequence, whose start has no byte offset.)
+    inCommentSequence = True
+    sequenceStartItemIndex, sequenceStartByteOffset = 0, None
+    upperPositionOfSequence = None
+    parenthesizedNumberOfSequence = None
+    toolpathItems = jsontoolpath.iterateJsontoolpathItems(jsontoolpathFile, progressReportingCallback=progressReportingCallback, withByteOffsets=True)
+    for index, ((byteOffset, item), nextItem) in enumerate(jsontoolpath.withLookahead(toolpathItems)):
+        command = item.get('command')
+        if not command:
+            continue
+        if command['function'] != 'comment':
+            inCommentSequence = False
+            if command['function'] == 'move':
+                tagsKey = tuple(command['tags'])
+                if tagsKey not in noodleTypesByTags:
+                    noodleTypesByTags[tagsKey] = jsontoolpath.getNoodleType(set(tagsKey), location="at index " + str(index) + " in the json toolpath")
+                noodleType = noodleTypesByTags[tagsKey] or noodleType
+            continue
+        if not inCommentSequence:
+            inCommentSequence = True
+            sequenceStartItemIndex, sequenceStartByteOffset = index, byteOffset
+        comment = command['parameters']['comment']
+        if comment.startswith(jsontoolpath.upperPositionPrefix):
+            upperPositionOfSequence = comment[len(jsontoolpath.upperPositionPrefix):].strip()
+        if comment.startswith(jsontoolpath.layerSectionPrefix):
+            parenthesizedNumberOfSequence = int(re.search(r'\(\s*(\d+)\s*\)', comment[len(jsontoolpath.layerSectionPrefix):]).group(1))
+        if jsontoolpath.endsCommentSequence(nextItem if nextItem is jsontoolpath.endOfItems else nextItem[1]):
+            if upperPositionOfSequence is not None and upperPositionOfSequence != lastUpperPosition:
+                layers.append({
+                    'layerNumber': len(layers),
+                    'upperPosition': upperPositionOfSequence,
+                    'itemIndex': sequenceStartItemIndex,
+                    'byteOffset': sequenceStartByteOffset,
+                    'layerSections': [],
+                    'parenthesizedNumbers': [],
+                    'noodleType': noodleType,
+                    'layerSectionIndex': layerSectionIndex
+                })
+                lastUpperPosition = upperPositionOfSequence
+            # a comment sequence that declares a layer section counts towards the layer that it is on (which might be the layer that it starts).
+            if parenthesizedNumberOfSequence is not None:
+                layerSectionIndex += 1
+                layers[-1]['layerSections'].append(layerSectionIndex)
+                layers[-1]['parenthesizedNumbers'].append(parenthesizedNumberOfSequence)
+            upperPositionOfSequence = None
+            parenthesizedNumberOfSequence = None
+    return layers
+
+# parses a range of layer numbers, like "800-820", "800-" (layer 800 to the end), or "800" (just layer 800).
+# returns a (firstLayerNumber, lastLayerNumber) tuple, where lastLayerNumber is None for a range that runs to the end.
+def parseLayerRange(text):
+    match = re.fullmatch(r'\s*(\d+)\s*(?:(-)\s*(\d+)?)?\s*', text)
+    if not match:
+        raise ValueError("cannot parse the layer range " + repr(text) + " (expected something like \"800-820\", \"800-\" or \"800\").")
+    firstLayerNumber = int(match.group(1))
+    lastLayerNumber = (int(match.group(3)) if match.group(3) is not None else None) if match.group(2) else firstLayerNumber
+    if lastLayerNumber is not None and lastLayerNumber < firstLayerNumber:
+        raise ValueError("the layer range " + repr(text) + " ends before it begins.")
+    return firstLayerNumber, lastLayerNumber
+
+# returns the (startItemIndex, stopItemIndex) of the items of layers firstLayerNumber through lastLayerNumber (inclusive),
+# where stopItemIndex is None if the range runs to the end of the toolpath.
+def getItemRange(layers, firstLayerNumber, lastLayerNumber=None):
+    if firstLayerNumber >= len(layers):
+        raise ValueError("the toolpath has no layer " + str(firstLayerNumber) + " (the last layer is " + str(len(layers) - 1) + ").")
+    lastLayerNumber = len(layers) - 1 if lastLayerNumber is None else min(lastLayerNumber, len(layers) - 1)
+    return layers[firstLayerNumber]['itemIndex'], (layers[lastLayerNumber + 1]['itemIndex'] if lastLayerNumber + 1 < len(layers) else None)
+
+# splits layers firstLayerNumber through lastLayerNumber (inclusive; None for the last layer) into at most chunkCount runs of 
+# consecutive layers of roughly equal size, for converting them in parallel (see writePreviewableGcodeFile() in make_printable.py).
+# layerStarts gives the position at which each layer starts, and end the position at which the last layer ends, in some measure of 
+# the size of the toolpath (e.g. byte offsets in a jsontoolpath, or item indices in a columnar toolpath).
+# returns a list of (firstLayerNumber, lastLayerNumber) tuples.
+def splitLayerRange(layerStarts, end, chunkCount, firstLayerNumber=0, lastLayerNumber=None):
+    lastLayerNumber = len(layerStarts) - 1 if lastLayerNumber is None else min(lastLayerNumber, len(layerStarts) - 1)
+    rangeStart = layerStarts[firstLayerNumber]
+    rangeEnd = layerStarts[lastLayerNumber + 1] if lastLayerNumber + 1 < len(layerStarts) else end
+    chunks = []
+    chunkFirstLayerNumber = firstLayerNumber
+    for layerNumber in range(firstLayerNumber + 1, lastLayerNumber + 1):
+        # we start a new chunk at the first layer that starts at or beyond the next of the evenly spaced cut points.
+        if layerStarts[layerNumber] - rangeStart >= (len(chunks) + 1) * (rangeEnd - rangeStart) / chunkCount:
+            chunks.append((chunkFirstLayerNumber, layerNumber - 1))
+            chunkFirstLayerNumber = layerNumber
+    chunks.append((chunkFirstLayerNumber, lastLayerNumber))
+    return chunks
@@ -1,54 +1,40 @@
-import argparse
 import os
 import re
 import json
 import pathlib
 import sys
-import math
 import copy
 # import numpy
 import subprocess
-import hjson #see https://hjson.github.io/hjson-py/
-import tempfile
-import datetime
-import progress
-import progress.bar
-import jsondiff
-import jsondiff_by_makerbot
+# hjson (see https://hjson.github.io/hjson-py/), jsondiff_by_makerbot, and those of our modules that need them (or numpy, or 
+# the http server), are imported by the functions that use them, so that a run only pays for importing what it uses.
+# The same goes for tempfile and shutil (which imports bz2 and lzma), multiprocessing, and concurrent.futures.
+import jsontoolpath
+import columnar_toolpath
+import layer_index
+import tracing
+import progress_reporting
+import slice_cache
+import compressed_output
+import miraclegrue_schema
+import memory_budget
+import incremental_build
+import config_validation
 # import importlib.util
-import shutil
-
-
-# This progress bar library is deficient in that it does not make any effort to output any sort of progress indicator in the case where the 
-# terminal is not a tty (i.e. in the case where the terminal does not support terminal control codes)
-# As a hack, I have simply disable the tty checkinbg so that terminal control codes are blindly emitted, whither the terminal supports them or not.
-# but this is not ideal because in terminals that do not support control codes, we see the literal control codes, which look like gobbledygook.
-class MyProgressBar(progress.bar.Bar):
-    check_tty = False
-    hide_cursor = False
-    suffix='%(percent)d%% - %(elapsed_td)s/%(estimatedTotalDuration_td)s'
-    @property
-    def estimatedTotalDuration(self):
-        try:
-            return int(math.ceil(1/self.progress * self.elapsed))
-        except ZeroDivisionError:
-            return 0
-    @property
-    def estimatedTotalDuration_td(self):
-        return datetime.timedelta(seconds=self.estimatedTotalDuration)
-    
-    def setProgress(self, newValue):
-        self.index = newValue * self.max
+import io
+import time
+import contextlib
+import functools
+import traceback
+import atexit
+import threading
+import collections
+import itertools
 
-    def setProgressAndUpdate(self, newValue):
-        self.setProgress(newValue)
-        self.update()
 
-    # overriding the original clearln() definition so as not to emit control codes.
-    def clearln(self): 
-        if self.file and self.is_tty():
-            # print('\r\x1b[K', end='', file=self.file)
-            print('\r', end='', file=self.file)
+# MyProgressBar(name) makes the progress reporter of a stage (see progress_reporting), which throttles the updates that it is given and 
+# passes the rest to the default sink: a progress bar when stderr is a terminal, json lines when it is not, or whatever --progress says.
+MyProgressBar = progress_reporting.ProgressReporter
 
 
 
@@ -65,124 +51,75 @@ class MyProgressBar(progress.bar.Bar):
 
 
 
-parser = argparse.ArgumentParser(description="Generate a .makerbot toolpath file from a .thing file and a mircale_grue configuration file.")
-parser.add_argument("--makerware_path", action='store', nargs=1, required=True, 
-    help=
-        "the path of the MakerWare folder, which comes with Makerbot Print.  Typically, on a " 
-        + "Windows machine, the MakerWare path is " 
-        + "\"" 
-        + "C:\\Program Files\\MakerBot\\MakerBotPrint\\resources\\app.asar.unpacked\\node_modules\\MB-support-plugin\\mb_ir\\MakerWare"
-        + "\""
-        + "."
-)
-parser.add_argument("--input_model_file", action='store', nargs=1, required=True, help="the .thing file to be sliced.")
-parser.add_argument("--input_miraclegrue_config_file", action='store', nargs=1, required=True, help="The miraclegrue config file.  This may be either a plain old .json file, or an hjson file, which is json with more relaxed syntax, and allows comments.")
-# parser.add_argument("--input_miraclegrue_config_overrides_file", action='store', nargs=1, required=False, help="This is a file of the same structure as the miracle_grue_config_file.  We will construct the configuration that we pass to miracle_grue " 
-#     + " and then applying any values that may be specified in input_miraclegrue_config_overrides_file.")
-parser.add_argument("--input_miraclegrue_config_transform_file", action='store', nargs=1, required=False, 
-    help="is expected to contain valid python code that defines a function "
-        + "named \"transformMiraclegrueConfig\", which is expected to take a single argument, a dict, which is the configuration "
-        + "that is to be transformed.  transformMiraclegrueConfig can modify the configuration as it sees fit."
-)
-parser.add_argument("--output_annotated_miraclegrue_config_file", action='store', nargs=1, required=False, help="An hjson file to be created by inserting the descriptions from the schema, as comments, interspersed within the miracle_grue_config json entries.")
-parser.add_argument("--output_miraclegrue_config_diff_file", action='store', nargs=1, required=False, help="a report showing the difference between the config after applying the transform compared with the input config file.")
-parser.add_argument("--output_makerbot_file", action='store', nargs=1, required=False, help="the .makerbot file to be created.")
-parser.add_argument("--output_gcode_file", action='store', nargs=1, required=False, help="the .gcode file to be created.")
-parser.add_argument("--output_previewable_gcode_file", action='store', nargs=1, required=False, help="A gcode file that we will create by taking the gcode produced by miracle_grue and modifying it to produce a gcode file sutiable for previeiwing in the Cura slicer.")
-parser.add_argument("--output_json_toolpath_file", action='store', nargs=1, required=False, help="the .jsontoolpath file to be created.")
-parser.add_argument("--output_metadata_file", action='store', nargs=1, required=False, help="the .json metadata file to be created.")
-parser.add_argument("--output_miraclegrue_log_file", action='store', nargs=1, required=False, help="an output file to which to write the miraclegrue log.")
-
-
-
-
-args, unknownArgs = parser.parse_known_args()
-
-#resolve all of the paths passed as arguments to fully qualified paths:
-input_model_file_path = pathlib.Path(args.input_model_file[0]).resolve()
-output_makerbot_file_path = (pathlib.Path(args.output_makerbot_file[0]).resolve() if args.output_makerbot_file and args.output_makerbot_file[0] else None)
-output_gcode_file_path = (pathlib.Path(args.output_gcode_file[0]).resolve() if args.output_gcode_file and args.output_gcode_file[0] else None)
-output_previewable_gcode_file_path = (pathlib.Path(args.output_previewable_gcode_file[0]).resolve() if args.output_previewable_gcode_file and args.output_previewable_gcode_file[0] else None)
-output_json_toolpath_file_path = (pathlib.Path(args.output_json_toolpath_file[0]).resolve() if args.output_json_toolpath_file and args.output_json_toolpath_file[0] else None)
-output_metadata_file_path = (pathlib.Path(args.output_metadata_file[0]).resolve() if args.output_metadata_file and args.output_metadata_file[0] else None)
-# input_miraclegrue_config_overrides_file_path = (pathlib.Path(args.input_miraclegrue_config_overrides_file[0]).resolve() if args.input_miraclegrue_config_overrides_file else None)
-input_miraclegrue_config_transform_file_path = (pathlib.Path(args.input_miraclegrue_config_transform_file[0]).resolve() if args.input_miraclegrue_config_transform_file and args.input_miraclegrue_config_transform_file[0] else None)
-output_miraclegrue_config_diff_file_path = (pathlib.Path(args.output_miraclegrue_config_diff_file[0]).resolve() if args.output_miraclegrue_config_diff_file and args.output_miraclegrue_config_diff_file[0] else None)
-output_miraclegrue_log_file_path = (pathlib.Path(args.output_miraclegrue_log_file[0]).resolve() if args.output_miraclegrue_log_file and args.output_miraclegrue_log_file[0] else None)
-
-
-makerware_path = pathlib.Path(args.makerware_path[0]).resolve()
-input_miraclegrue_config_file_path = pathlib.Path(args.input_miraclegrue_config_file[0]).resolve()
-
-
-
-#the path of the python executable included with makerware:
-makerware_python_executable_path = makerware_path.joinpath("python3.4.exe").resolve()
-makerware_python_working_directory_path = makerware_path.joinpath("python34").resolve()
-miraclegrue_executable_path = makerware_path.joinpath("miracle_grue.exe").resolve()
-
-# sliceLibraryEggPath = list(makerware_path.joinpath("python").glob("slice_library*.egg"))[0]
-
-# print("sliceLibraryEggPath.resolve(): " + str(sliceLibraryEggPath.resolve()))		# sliceLibraryEggPath.resolve()
-
-# # spec = importlib.util.spec_from_file_location('slice_library', sliceLibraryEggPath.resolve())
-# # module = importlib.util.module_from_spec(spec)
-# # sys.modules['slice_library'] = module
-# # spec.loader.exec_module(module)
-
-# sys.path.insert(0, str(sliceLibraryEggPath.resolve()))
-# # This is how sliceconfig finds its resource files
-# os.environ['MB_RESOURCE_PATH'] = str(makerware_path)
-# import slice_library.tinything_processor
-
-# print("dir(slice_library): " + str(dir(slice_library)))		# dir(slice_library)
-# print("dir(slice_library.tinything_processor): " + str(dir(slice_library.tinything_processor)))		# dir(slice_library.tinything_processor)
-
-#the path of the makerware sliceconfig python script:
-makerware_sliceconfig_path = makerware_path.joinpath("sliceconfig").resolve()
-
-miraclegrueConfig = hjson.load(open(input_miraclegrue_config_file_path ,'r'))
-
-if input_miraclegrue_config_transform_file_path:
-    #modify miraclegrueConfig by applying any overrides that may be specified in input_miraclegrue_config_overrides_file
-    #miraclegrueConfigOverrides = hjson.load(open(input_miraclegrue_config_overrides_file_path ,'r'))
-    # print("miraclegrueConfigOverrides: " + str(type(miraclegrueConfigOverrides)))
-
-    # record the initia; state of miracleGrueConfig, before we allow the transform to (possibly) modify it.
-    # We do this so that we can, if the user has requested a output_miraclegrue_config_diff_file, generate
-    # a report showing the differences between miraclegrueConfig before and after the transform operates on it.
-    initialMiraclegrueConfig = copy.deepcopy(miraclegrueConfig)
-
-    #input_miraclegrue_config_overrides_file is expected to contain valid python code that defines a function
-    # named "transformMiraclegrueConfig", which is expected to take a single argument, a dict, which is the configuration
-    # that is to be transformed.  transformMiraclegrueConfig can modify the configuration as it sees fit.
-    # Should we expect transformMiraclegrueConfig() to return a dict, that we will then take to be the new miraclegrueConfig,
-    # or, alternatively, should we expect to transformMiraclegrueConfig() to modify the dict that is passed to it?  -- I am still deciding.
-    # It seems like the return value approach would be the most flexible.
-
-    isolatedGlobals = dict()
-
-    exec(open(input_miraclegrue_config_transform_file_path, 'r').read(), isolatedGlobals)
-    #I think, although am not entirely certain, that passing the isolatedGlobals object prevents the code in input_miraclegrue_config_transform_file_path
-    # from being able to muck with, or even see, our globals here.  This mechanism does not prevent the execution of arbitrary code and so is certainly not suitable for a production application.
-    # We ought to figure out how to run transformMiraclegrueConfig in a sandbox.
-
-    # print("isolatedGlobals.keys(): " + str(isolatedGlobals.keys()))
-    # print("type(isolatedGlobals[\"transformMiraclegrueConfig\"]): " + str(type(isolatedGlobals["transformMiraclegrueConfig"])))		#     type(isolatedGlobals["transformMiraclegrueConfig"])
-
-    miraclegrueConfig = isolatedGlobals["transformMiraclegrueConfig"](miraclegrueConfig)
-    # print("miraclegrueConfig['foo']: " + str(miraclegrueConfig['foo']))		#     miracleGrueConfig['foo']
-
+# returns the parser of our command-line options.  We only build it (and import argparse) when we are run as a script (see main()), 
+# so that importing this module (e.g. to call makePrintable() or generatePreviewableGcode() from other code) costs as little as possible.
+def getArgumentParser():
+    import argparse
 
+    parser = argparse.ArgumentParser(description="Generate a .makerbot toolpath file from a .thing file and a mircale_grue configuration file.")
+    parser.add_argument("--makerware_path", action='store', nargs=1, required=False, 
+        help=
+            "the path of the MakerWare folder, which comes with Makerbot Print.  Typically, on a " 
+            + "Windows machine, the MakerWare path is " 
+            + "\"" 
+            + "C:\\Program Files\\MakerBot\\MakerBotPrint\\resources\\app.asar.unpacked\\node_modules\\MB-support-plugin\\mb_ir\\MakerWare"
+            + "\""
+            + ".  (required for anything that slices, i.e. unless --diff_json_toolpath_files or --input_toolpath_file is given, or "
+            + "--preload_miraclegrue_config_schema_files is given without anything to slice)"
+    )
+    parser.add_argument("--input_model_file", action='store', nargs=1, required=False, help="the .thing file to be sliced.  (required unless --batch_manifest_file is given)")
+    parser.add_argument("--input_miraclegrue_config_file", action='store', nargs=1, required=False, help="The miraclegrue config file.  This may be either a plain old .json file, or an hjson file, which is json with more relaxed syntax, and allows comments.  (required unless --batch_manifest_file is given)")
+    # parser.add_argument("--input_miraclegrue_config_overrides_file", action='store', nargs=1, required=False, help="This is a file of the same structure as the miracle_grue_config_file.  We will construct the configuration that we pass to miracle_grue " 
+    #     + " and then applying any values that may be specified in input_miraclegrue_config_overrides_file.")
+    parser.add_argument("--input_miraclegrue_config_transform_file", action='store', nargs=1, required=False, 
+        help="is expected to contain valid python code that defines a function "
+            + "named \"transformMiraclegrueConfig\", which is expected to take a single argument, a dict, which is the configuration "
+            + "that is to be transformed.  transformMiraclegrueConfig can modify the configuration as it sees fit."
+    )
+    parser.add_argument("--output_annotated_miraclegrue_config_file", action='store', nargs=1, required=False, help="An hjson file to be created by inserting the descriptions from the schema, as comments, interspersed within the miracle_grue_config json entries.")
+    parser.add_argument("--output_miraclegrue_config_diff_file", action='store', nargs=1, required=False, help="a report showing the difference between the config after applying the transform compared with the input config file.")
+    parser.add_argument("--output_makerbot_file", action='store', nargs=1, required=False, help="the .makerbot file to be created.")
+    parser.add_argument("--output_gcode_file", action='store', nargs=1, required=False, help="the .gcode file to be created.  If the name ends in .gz, .xz or .zst, the gcode is compressed accordingly.")
+    parser.add_argument("--output_previewable_gcode_file", action='store', nargs=1, required=False, help="A gcode file that we will create by taking the gcode produced by miracle_grue and modifying it to produce a gcode file sutiable for previeiwing in the Cura slicer.  If the name ends in .gz, .xz or .zst, the gcode is compressed (as it is generated) accordingly.")
+    parser.add_argument("--output_json_toolpath_file", action='store', nargs=1, required=False, help="the .jsontoolpath file to be created.")
+    parser.add_argument("--output_metadata_file", action='store', nargs=1, required=False, help="the .json metadata file to be created.")
+    parser.add_argument("--output_columnar_toolpath_file", action='store', nargs=1, required=False, help="a compact, columnar, binary form of the jsontoolpath to be created (see columnar_toolpath.py), which later runs (e.g. with --input_toolpath_file) can read much faster than the jsontoolpath.")
+    parser.add_argument("--output_stats_file", action='store', nargs=1, required=False, help="a json report of statistics of the toolpath to be created: the path length and filament length of the extruding moves of each noodle type (as in the \";TYPE:\" comments of the previewable gcode), the travel distance, the number of retracts, and the estimated print time, in total and per layer.  (requires numpy)")
+    parser.add_argument("--stats_acceleration", action='store', nargs=1, required=False, help="an acceleration, in mm/s^2, to be taken into account in the print time estimate of --output_stats_file (with a simple trapezoidal speed profile for each move).  By default, the estimate assumes that every move runs at its feedrate throughout.")
+    parser.add_argument("--layers", action='store', nargs=1, required=False, help="only generate the previewable gcode (--output_previewable_gcode_file) for the given range of layers, numbered as in its \"; LAYER\" comments: e.g. \"800-820\", \"800-\" (to the last layer) or \"800\".  We seek straight to the first of the layers with the help of the layer index (a file next to the toolpath, named after it with \".layers.json\" appended) that is made the first time that a toolpath is converted in full.")
+    parser.add_argument("--input_toolpath_file", action='store', nargs=1, required=False, help="an existing .jsontoolpath file, or a columnar toolpath file (see --output_columnar_toolpath_file), from which to generate --output_previewable_gcode_file and/or --output_columnar_toolpath_file, without slicing anything.")
+    parser.add_argument("--output_miraclegrue_log_file", action='store', nargs=1, required=False, help="an output file to which to write the miraclegrue log.")
+    parser.add_argument("--slice_cache_directory", action='store', nargs=1, required=False, help="a directory in which to keep a cache of miracle_grue outputs (jsontoolpath, gcode and metadata), keyed by a hash of the model file, the final miracle_grue config, and the miracle_grue version.  When a matching entry exists, the outputs are served from the cache instead of running miracle_grue.")
+    parser.add_argument("--slice_cache_max_size", action='store', nargs=1, required=False, help="the maximum total size of the slice cache, as a number of bytes, optionally followed by k, m, or g (e.g. \"10g\").  When the cache grows beyond this size, the least-recently-used entries are evicted.  By default, the cache is unbounded.")
+    parser.add_argument("--incremental_build_directory", action='store', nargs=1, required=False, help="a directory in which to keep, for each model, the miracle_grue outputs of the last time that it was sliced, along with the config.  When the config differs from that one only in keys that do not affect the slice (those that only go to sliceconfig's package_makerbot: _bot, _extruders and _materials), we skip slicing, and only redo the stages downstream of it (packaging, the previewable gcode, the columnar toolpath and the statistics) on the retained outputs.  We print each changed key path, and whether it affects the slice.")
+    parser.add_argument("--schema_cache_directory", action='store', nargs=1, required=False, help="a directory in which to keep the parsed miracle_grue config schema between runs, so that we only have to ask miracle_grue for it (with --config-schema) when the miracle_grue executable changes.  Defaults to a directory under the user's cache directory (" + str(miraclegrue_schema.getDefaultCacheDirectory().joinpath("schemas")) + ").")
+    parser.add_argument("--preload_miraclegrue_config_schema_files", action='store', nargs='+', required=False, help="one or more schema files (for example, research/miracle_grue_5.31.0_config_schema.json) to be added to the schema cache.  The miracle_grue version is taken from the file name.  If no model or config is given, we just preload the schemas and exit.")
+    parser.add_argument("--miraclegrue_version", action='store', nargs=1, required=False, help="use the cached schema for this miracle_grue version (e.g. \"5.31.0\") rather than the schema of the installed miracle_grue.  This allows --output_annotated_miraclegrue_config_file to be used on a machine that does not have MakerWare installed.")
+    parser.add_argument("--batch_manifest_file", action='store', nargs=1, required=False, help="a json (or hjson) file containing a list of jobs to be run in parallel, in place of the single job described by the other options.  Each job is a dict whose keys are any of the options " + ", ".join(["input_model_file", "input_miraclegrue_config_file", "input_miraclegrue_config_transform_file", "output_*_file"]) + " (without the leading \"--\") and whose values are paths (relative paths are relative to the directory containing the manifest).  --makerware_path and the slice cache options apply to all of the jobs.")
+    parser.add_argument("--batch_workers", action='store', nargs=1, required=False, help="the maximum number of batch jobs to run at once.  By default, this is the number of processors on the machine.")
+    parser.add_argument("--output_batch_summary_file", action='store', nargs=1, required=False, help="a json file to be created, summarizing the outcome of each job in the batch.")
+    parser.add_argument("--sweep_file", action='store', nargs=1, required=False, help="a json (or hjson) file describing a parameter sweep: a 'grid' (a dict mapping key paths, like \"extruderProfiles[0].layerHeight\", to lists of values) and/or a list of 'variants' (dicts mapping key paths to values).  Each variant is made by overriding the given keys of the config (after the transform, if any, has been applied).  Variants that come out identical are sliced only once, the rest are sliced in parallel (see --batch_workers), and we print a table of the print time and material use of each variant, along with how it differs from the base config.")
+    parser.add_argument("--sweep_output_directory", action='store', nargs=1, required=False, help="the directory in which to put the config, metadata, miraclegrue log and config diff of each variant of a sweep (in a subdirectory per variant).  Required with --sweep_file.")
+    parser.add_argument("--output_sweep_summary_file", action='store', nargs=1, required=False, help="a json file to be created, summarizing the outcome of each variant of a sweep.")
+    parser.add_argument("--previewable_gcode_workers", action='store', nargs=1, required=False, help="the number of processes among which to share the generation of the previewable gcode (--output_previewable_gcode_file), each converting a different run of layers.  0 means the number of processors on the machine.  By default, the previewable gcode is generated by a single process.  This needs the layers of the toolpath, which are known when the toolpath has a layer index (see --layers), or is a columnar toolpath (see --output_columnar_toolpath_file); otherwise, the conversion is done by a single process, which records the layer index for the next time.  The output is the same as with a single process.")
+    parser.add_argument("--serve", action='store', nargs=1, required=False, help="run as a long-running slicing service (see slicing_service.py), accepting jobs (in the form of the jobs of --batch_manifest_file) over HTTP, at the given address: a port on localhost (e.g. \"8765\"), or a Unix domain socket (e.g. \"unix:/tmp/make_printable.sock\").  The service has no authentication, so it refuses to listen anywhere but the loopback interface.  The jobs run in worker processes that stay up (and keep their caches warm) between jobs.")
+    parser.add_argument("--service_slicers", action='store', nargs=1, required=False, help="the number of jobs that --serve runs at once.  By default, this is the number of processors on the machine.")
+    parser.add_argument("--service_queue_length", action='store', nargs=1, required=False, help="the number of jobs that --serve lets wait for a free slicer, beyond which it refuses new jobs (with HTTP status 503).  Default: 100.")
+    parser.add_argument("--service_job_lifetime", action='store', nargs=1, required=False, help="the number of seconds for which --serve keeps a finished job (its status, and its directory, outputs and all), so that its outputs can be fetched, or \"off\" to keep it until the job limit (see --service_job_limit) says otherwise.  Default: 86400 (a day).")
+    parser.add_argument("--service_job_limit", action='store', nargs=1, required=False, help="the number of finished jobs that --serve keeps, beyond which it forgets the oldest (and removes their directories), or \"off\" for no limit.  Default: 1000.")
+    parser.add_argument("--service_directory", action='store', nargs=1, required=False, help="the directory under which --serve gives each job a directory of its own, against which the relative paths of the job are resolved, and within which the outputs of the job must be.  The inputs of a job must be within its directory, or the \"inputs\" directory under this one.  By default, this is a directory under the cache directory.")
+    parser.add_argument("--memory_budget", action='store', nargs=1, required=False, help="the memory that the slicers (miracle_grue) that run at once may use between them: a size like \"12g\" or \"512m\", \"auto\" for 80%% of the memory available when we start, or \"off\".  Each slicer gets an equal share, which we pass to miracle_grue as its --memory-threshold (beyond which it keeps its intermediate data on disk), and a slicer is held back while the measured memory of those already running leaves no room for its share.  With --batch_manifest_file, --sweep_file and --serve, the default is \"auto\"; for a single run, the default is \"off\", and otherwise the one slicer gets the whole budget.")
+    parser.add_argument("--config_validation", action='store', nargs=1, required=False, choices=config_validation.configValidationModes, help="what to do about a config (after the transform, if any) that does not conform to the config schema of miracle_grue: a value of the wrong type, out of the member's range, or not among its valid strings.  We check the config in-process before slicing: \"error\" (the default) stops the job with a list of the errors (each with the key path of the offending value), \"warn\" prints them and slices anyway, and \"off\" skips the check.  Unless this option is given (or --output_annotated_miraclegrue_config_file, which also needs the schema), a run for which the config schema cannot be had (e.g. because miracle_grue fails to report it) slices without the check, with a warning.  Keys that are not in the schema (which miracle_grue ignores, as its --regurgitate-config would show) and values that are not a whole number of steps of their member are only ever warnings.")
+    parser.add_argument("--pipelined", action='store_true', required=False, help="generate the previewable gcode (--output_previewable_gcode_file) from the jsontoolpath while miracle_grue is still writing it, rather than waiting for miracle_grue to finish, and keep generating it while sliceconfig packages the .makerbot file.  The output is the same as without this option.")
+    parser.add_argument("--progress", action='store', nargs=1, required=False, choices=progress_reporting.sinkKinds, help="how to report the progress of each stage: \"bar\" for a progress bar, \"json\" for a json object per update, one per line (e.g. {\"stage\": \"gcode\", \"progress\": 0.25, \"elapsed\": 1.5}), or \"none\".  The progress goes to stderr.  By default (\"auto\"), we draw a progress bar if stderr is a terminal, and write json lines if it is not.")
+    parser.add_argument("--output_trace_file", action='store', nargs=1, required=False, help="a file to which to write a timed span for each stage of the run (loading and transforming the config, the config diff, fetching the schema and annotating, slicing, copying outputs, generating the previewable gcode, and packaging), including the miracle_grue and sliceconfig subprocesses and their exit codes.  See --trace_format.")
+    parser.add_argument("--trace_format", action='store', nargs=1, required=False, choices=tracing.formats, help="the format of --output_trace_file: \"chrome\" (the default) for a Chrome trace-event json file, which can be loaded into chrome://tracing or https://ui.perfetto.dev, or \"jsonl\" for a log with one json event per line, written as each span ends.")
+    parser.add_argument("--diff_json_toolpath_files", action='store', nargs=2, required=False, help="two .jsontoolpath files to be compared (for instance, the toolpaths of the same model before and after upgrading MakerWare or changing a transform).  The toolpaths are streamed and lined up layer by layer, and we print a per-layer summary of the added, removed and changed moves, and exit.")
+    parser.add_argument("--json_toolpath_diff_tolerance", action='store', nargs=1, required=False, help="the largest difference between corresponding numeric move parameters (x, y, z, a, feedrate) that --diff_json_toolpath_files does not regard as a change.  Defaults to 0.0001.")
+    parser.add_argument("--output_json_toolpath_diff_file", action='store', nargs=1, required=False, help="a json file to be created by --diff_json_toolpath_files, containing the summary of every layer.")
+    return parser
 
-    if output_miraclegrue_config_diff_file_path:
-        # diff = jsondiff.diff(initialMiraclegrueConfig, miraclegrueConfig)
-        # print("diff.keys(): " + str(diff.keys()))		#         diff.keys()
-        # open(output_miraclegrue_config_diff_file_path ,'w').write(str(diff))
 
-        diff = jsondiff_by_makerbot.JSONDiff(initialMiraclegrueConfig, miraclegrueConfig)
-        open(output_miraclegrue_config_diff_file_path ,'w').write(str(diff.pretty_str(trim_size=300)))
-  
 
 
 def tabbedWrite(file, content, tabLevel=0, tabString="    ", linePrefix=""):
@@ -229,34 +166,14 @@ def addParentheticalRemarkAtEndOfFirstLine(x, remark=None):
 
 
 # path is expected to be a list (of keys)
+# The lookups are answered from a miraclegrue_schema.SchemaIndex, which is built the first time we see a given schema, so that
+# each lookup costs a dict access per path step rather than a linear search through the members of every ancestor.
 def getSchemedTypeName(path, schema):
-    if len(path) == 0:
-        return '__top__'
-    schemedTypeOfParent = getSchemedType(path[:-1],schema)
-    if schemedTypeOfParent:
-        if schemedTypeOfParent['mode'] == "aggregate":
-            memberSpec = (
-                    list(
-                        filter(
-                            lambda x: x['id'] == path[-1],
-                            schemedTypeOfParent["members"]
-                        )
-                    ) or [None]
-                )[0]
-            if memberSpec:
-                return memberSpec['type']
-        elif schemedTypeOfParent['json_type'] == "object":
-            return schemedTypeOfParent['value_type']
-        elif schemedTypeOfParent['json_type'] == "array":
-            return schemedTypeOfParent['element_type']
-    return None
+    return miraclegrue_schema.getSchemaIndex(schema).getSchemedTypeName(path)
 
 def getSchemedType(path, schema):
     # print("getSchemedType() was called with path " + str(path))
-    schemedTypeName = getSchemedTypeName(path, schema)
-    if schemedTypeName:
-        return schema.get(schemedTypeName)
-    return None
+    return miraclegrue_schema.getSchemaIndex(schema).getSchemedType(path)
 
 def getMemberIds(schemedType):
     return (
@@ -272,35 +189,38 @@ def getMemberIds(schemedType):
 #returns the annotation text that is to appear immediately
 # before the entry having the specified path.
 def getAnnotationForEntry(path, schema):
-    schemedTypeOfParent = getSchemedType(path[:-1],schema)
-    if schemedTypeOfParent and schemedTypeOfParent['mode'] == "aggregate":
-        memberSpec = (
-                list(
-                    filter(
-                        lambda x: x['id'] == path[-1],
-                        schemedTypeOfParent["members"]
-                    )
-                ) or [None]
-            )[0]
+    isMemberOfAggregate, memberSpec = miraclegrue_schema.getSchemaIndex(schema).getMemberSpec(path)
+    if isMemberOfAggregate:
         if memberSpec:
-            return "\n".join(
-                [path[-1]]
-                + (["name: " + memberSpec.get('name')] if (memberSpec.get('name') and (memberSpec.get('name') != path[-1])) else [])
-                + list(
-                    map(
-                        lambda k: k + ": " + hjson.dumps(memberSpec[k]),
-                        filter(
-                            lambda k: k not in ['id','name'],
-                            memberSpec.keys()
-                        )
-                    )
-                )   
-            )
+            return formatMemberSpecAnnotation(path[-1], memberSpec)
         else:
             return "THIS ELEMENT IS NOT SPECIFIED IN THE SCHEMA."
     else:
         return None
 
+# the annotation text for a member spec only depends on the member spec (and the member's id), so we compute it once per member spec.
+# The cache is keyed by the id of the member spec, and holds on to the member spec so that the id cannot be recycled.
+_memberSpecAnnotations = {}
+def formatMemberSpecAnnotation(memberId, memberSpec):
+    import hjson
+    cachedMemberSpec, annotation = _memberSpecAnnotations.get((id(memberSpec), memberId), (None, None))
+    if cachedMemberSpec is not memberSpec:
+        annotation = "\n".join(
+            [memberId]
+            + (["name: " + memberSpec.get('name')] if (memberSpec.get('name') and (memberSpec.get('name') != memberId)) else [])
+            + list(
+                map(
+                    lambda k: k + ": " + hjson.dumps(memberSpec[k]),
+                    filter(
+                        lambda k: k not in ['id','name'],
+                        memberSpec.keys()
+                    )
+                )
+            )   
+        )
+        _memberSpecAnnotations[(id(memberSpec), memberId)] = (memberSpec, annotation)
+    return annotation
+
 #entryFormat shall be a streing that is either "dictEntry" or "listEntry"
 # def dumpsAnnotatedHjsonEntry(value, path, schema, entryFormat):
 #     # print("dumpsAnnotatedHjsonEntry was called with path: " + str(path))
@@ -311,7 +231,17 @@ def getAnnotationForEntry(path, schema):
 
 def dumpsAnnotatedHjsonValue(value, path, schema):
     # print("now working on path: " + str(path))
-    returnValue=""
+    returnValue = io.StringIO()
+    writeAnnotatedHjsonValue(returnValue, value, path, schema)
+    return returnValue.getvalue()
+
+# writes the annotated hjson text of value (the same text that dumpsAnnotatedHjsonValue returns) to file, as it is generated.
+# Rather than building each child's text and then re-indenting it once per ancestor, we pass the indentation down:
+# every line of the entry is written prefixed by indent, and the first line of the entry is additionally prefixed by firstLinePrefix
+# (which is how the "key: " of a dict entry ends up on the same line as the opening brace or the value).
+# We split text into lines in exactly the way that indentAllLines() does, so that the output is identical.
+def writeAnnotatedHjsonValue(file, value, path, schema, indent="", firstLinePrefix=""):
+    import hjson
     schemedType = getSchemedType(path, schema)
     
     isIterable = (
@@ -332,58 +262,108 @@ def dumpsAnnotatedHjsonValue(value, path, schema):
             keysInValue=set(range(len(value)))
             keysInSchema=set([])
             subentryFormat="listEntry"
-        returnValue += braces[0] + "\n"
+        writeIndentedLines(file, firstLinePrefix + braces[0], indent)
+        subentryIndent = indent + "    "
         for key in sorted(list(keysInValue.union(keysInSchema))):
             annotation = getAnnotationForEntry(path + [key], schema)
+            if annotation:
+                writeIndentedLines(file, "\n" + makeBlockComment(annotation), subentryIndent)
             
             if key in keysInValue:
-                subValue = value[key]
-                entry = (key + ": "  if subentryFormat == "dictEntry" else "") + dumpsAnnotatedHjsonValue(subValue, path + [key], schema)
+                writeAnnotatedHjsonValue(file, value[key], path + [key], schema, indent=subentryIndent, firstLinePrefix=(key + ": "  if subentryFormat == "dictEntry" else ""))
             else:
-                subValue = None
-                entry = "// VALUE NOT SPECIFIED"
-            
-            returnValue += indentAllLines(
-                (
-                    "\n" + makeBlockComment(annotation) + "\n" 
-                    if annotation else ""
-                ) 
-                + entry
-            ) + "\n"
-        returnValue += braces[1] + "\n"
+                writeIndentedLines(file, "// VALUE NOT SPECIFIED", subentryIndent)
+        file.write(indent + braces[1] + "\n")
+    elif indent:
+        writeIndentedLines(file, firstLinePrefix + hjson.dumps(value) + "\n", indent)
     else:
-        returnValue += hjson.dumps(value) + "\n"
-    return returnValue    
+        file.write(hjson.dumps(value) + "\n")
 
-#inputFile is a readable file-like object that is assumed to be a valid jsontoolpath file
+# writes each line of x to file, prefixed by indent and terminated by a newline.
+def writeIndentedLines(file, x, indent):
+    for line in str(x).splitlines():
+        file.write(indent + line + "\n")
+
+#inputFile is a readable file-like object that is assumed to be a valid jsontoolpath file, or a columnar_toolpath.ColumnarToolpath
 #outputGcodeFile is a writeable file-like object that is assumed to be the destination where we want to dump the gcode
 #progressReportingCallback, if given, is expected to be a function that will be passed a single argument:
-# a float representing the completion ratio.
-def generatePreviewableGcode(inputJsontoolpathFile, outputGcodeFile, progressReportingCallback = None):
+# a float representing the completion ratio (measured by how much of inputJsontoolpathFile has been consumed).
+#layers, if given, is a list to which we append the layers of the toolpath, as we come to them, for the layer index (see layer_index).
+#initialState, if given, is the state (as returned by getPreviewableGcodeStateAtLayer()) with which to pick up the conversion
+# at the start of a layer, in which case inputJsontoolpathFile is expected to be positioned at the start of that layer (see 
+# openToolpathFile()).  The output is then exactly the part of the full output that starts with that layer.
+#itemCount, if given, is the number of items of the toolpath to convert (e.g. to stop at the start of a later layer).
+def generatePreviewableGcode(inputJsontoolpathFile, outputGcodeFile, progressReportingCallback = None, layers = None, initialState = None, itemCount = None):
     # print("generating previewable gcode")
-    # read the jsontoolpath into memory (might it be better to do this in a way that does not require us to read the entire file into memory at once?)
-    toolpath = json.load(inputJsontoolpathFile)
+    # we stream the jsontoolpath one command at a time (rather than json.load()ing the whole thing) so that memory usage
+    # does not grow with the size of the toolpath, which, for a long print, can be several gigabytes.
+    # We keep a lookahead of one item, which is all that we need to detect the end of a comment sequence.
+    startItemIndex = initialState['itemIndex'] if initialState else 0
+    # when recording the layers of a jsontoolpath, we note the byte offsets of the last two items that we have read, which (given
+    # the lookahead) are those of the current item and the next.
+    recentByteOffsets = None
+    if isinstance(inputJsontoolpathFile, columnar_toolpath.ColumnarToolpath):
+        toolpathItems = inputJsontoolpathFile.iterateItems(
+            start=startItemIndex, 
+            stop=(None if itemCount is None else startItemIndex + itemCount), 
+            progressReportingCallback=progressReportingCallback
+        )
+    else:
+        toolpathItems = jsontoolpath.iterateJsontoolpathItems(
+            inputJsontoolpathFile, 
+            progressReportingCallback=progressReportingCallback, 
+            withByteOffsets=(layers is not None),
+            fromElement=bool(initialState)
+        )
+        if layers is not None:
+            recentByteOffsets = collections.deque(maxlen=2)
+            def noteByteOffsets(byteOffsetsAndItems):
+                for byteOffset, item in byteOffsetsAndItems:
+                    recentByteOffsets.append(byteOffset)
+                    yield item
+            toolpathItems = noteByteOffsets(toolpathItems)
+        if itemCount is not None:
+            toolpathItems = itertools.islice(toolpathItems, itemCount)
     noodleType = None
     layerIndex = -1
     layerSectionIndex = -1
     lastUpperPosition = None
     thisUpperPosition = None
     allTags: set = set()
+    # the noodle type implied by each distinct combination of tags that we have seen (None meaning that the noodle type does not change).
+    noodleTypesByTags = {}
+    # the lines for a run of consecutive moves (including any ";TYPE:..." lines among them) are collected here and written out with 
+    # a single write when the run ends (i.e. at the next comment sequence) or grows long, rather than with a write per move.
+    pendingMoveLines = []
+    maximumPendingMoveLines = 4096
+    formatMoveLine = "G1 X{} Y{} Z{} E{} F{}\n".format
     # allFunctions: set = set()
     
     weAreInACommentSequence=True
     commentSequence = None
-    upperPositionPrefix = "Upper Position"
-    layerSectionPrefix = "Layer Section "
+    upperPositionPrefix = jsontoolpath.upperPositionPrefix
+    layerSectionPrefix = jsontoolpath.layerSectionPrefix
     thisCommentSequenceDeclaresAnUpperPosition = None
     thisCommentSequenceDeclaresALayerSection = None
     thisLayerSection = None
     parenthesizedNumbersAfterLayerSectionSeenSinceLastLayer = []
     layerSectionsSeenSinceLastLayer = []
-
-    for index in range(len(toolpath)):
+    commentSequenceStartIndex = startItemIndex
+    commentSequenceStartByteOffset = None
+
+    if initialState:
+        noodleType = initialState['noodleType']
+        layerIndex = initialState['layerIndex']
+        layerSectionIndex = initialState['layerSectionIndex']
+        lastUpperPosition = initialState['lastUpperPosition']
+        parenthesizedNumbersAfterLayerSectionSeenSinceLastLayer = list(initialState['parenthesizedNumbersAfterLayerSectionSeenSinceLastLayer'])
+        layerSectionsSeenSinceLastLayer = list(initialState['layerSectionsSeenSinceLastLayer'])
+        weAreInACommentSequence = False
+    if layers is not None:
+        layers.append({'layerNumber': 0, 'upperPosition': None, 'itemIndex': 0, 'byteOffset': None, 'layerSections': [], 'parenthesizedNumbers': [], 'noodleType': None, 'layerSectionIndex': -1})
+
+    for index, (item, nextItem) in enumerate(jsontoolpath.withLookahead(toolpathItems), startItemIndex):
         # print("now working on item " + str(index))
-        item = toolpath[index]
         command = item.get('command')
         if command:
             function = command['function']
@@ -395,6 +375,9 @@ def generatePreviewableGcode(inputJsontoolpathFile, outputGcodeFile, progressRep
                     thisCommentSequenceDeclaresAnUpperPosition = False
                     thisCommentSequenceDeclaresALayerSection = False
                     commentSequence = []
+                    commentSequenceStartIndex = index
+                    if recentByteOffsets is not None:
+                        commentSequenceStartByteOffset = recentByteOffsets[0 if nextItem is not jsontoolpath.endOfItems else -1]
                 comment: str = command['parameters']['comment']
                 # outputGcodeFile.write("; " + comment + "\n")
                 commentSequence += ["; " + comment]
@@ -418,7 +401,7 @@ def generatePreviewableGcode(inputJsontoolpathFile, outputGcodeFile, progressRep
 
 
                 # if the next toolpath entry is not a comment (or if this is the last toolpath entry), then emit the accumulated commentSequence
-                if (index+1 > len(toolpath) - 1) or (toolpath[index+1].get('command') and toolpath[index+1].get('command').get('function') != 'comment') :
+                if jsontoolpath.endsCommentSequence(nextItem):
                     if thisCommentSequenceDeclaresALayerSection:
                         layerSectionIndex += 1
                         commentSequence = [
@@ -456,9 +439,26 @@ def generatePreviewableGcode(inputJsontoolpathFile, outputGcodeFile, progressRep
                             ] 
                         ) + commentSequence
 
+                        if layers is not None:
+                            layers[-1]['layerSections'] = layerSectionsSeenSinceLastLayer
+                            layers[-1]['parenthesizedNumbers'] = parenthesizedNumbersAfterLayerSectionSeenSinceLastLayer
+                            layers.append({
+                                'layerNumber': layerIndex + 1,
+                                'upperPosition': thisUpperPosition,
+                                'itemIndex': commentSequenceStartIndex,
+                                'byteOffset': commentSequenceStartByteOffset,
+                                'layerSections': [],
+                                'parenthesizedNumbers': [],
+                                'noodleType': noodleType,
+                                'layerSectionIndex': layerSectionIndex - (1 if thisCommentSequenceDeclaresALayerSection else 0)
+                            })
+
                         lastUpperPosition = thisUpperPosition
                         parenthesizedNumbersAfterLayerSectionSeenSinceLastLayer = []
                         layerSectionsSeenSinceLastLayer = []
+                    if pendingMoveLines:
+                        outputGcodeFile.write("".join(pendingMoveLines))
+                        pendingMoveLines = []
                     outputGcodeFile.write("\n".join(commentSequence) + "\n")
                     if thisCommentSequenceDeclaresALayerSection:
                         parenthesizedNumbersAfterLayerSectionSeenSinceLastLayer.append(parenthesizedNumberForThisLayerSection)
@@ -470,88 +470,33 @@ def generatePreviewableGcode(inputJsontoolpathFile, outputGcodeFile, progressRep
                 # allFunctions.add(function)
                 if function == 'move':
                     # look at tags to figure out whether we need to emit a ";TYPE:..." line
-                    tags = set(command['tags'])
-                    allTags.update(tags)
-
-                    # tags encountered in a typical jsontoolpath:
-                    #   BeadMode External
-                    #   BeadMode Internal
-                    #   BeadMode Internal Thick
-                    #   BeadMode User3
-                    #   Connection
-                    #   Infill
-                    #   Inset
-                    #   Invalid Move
-                    #   Leaky Travel Move
-                    #   Long Restart
-                    #   Restart
-                    #   Retract
-                    #   Support
-                    #   Trailing Extrusion Move
-                    #   Travel Move
-
-                    # we need to map these (or, more accurately, combinations of these tags) to 
-                    # one of the following values for noodleType:
-                    # The travel and retract moves are detected implicitly by the cura gcode previewer, so they 
-                    # don't have an explicit noodleType (which is one of the reasons I chose the name "noodleType":
-                    # these categroies only apply to moves that produce a noodle.
-                    #
-                    #    WALL-INNER         
-                    #    WALL-OUTER         
-                    #    SKIN               
-                    #    SKIRT              
-                    #    SUPPORT            
-                    #    FILL              
-                    #    SUPPORT-INTERFACE  
-                    #    PRIME-TOWER        
-
-
-
-                    if "Support" in tags:
-                        thisNoodleType = "SUPPORT"
-                    elif "Infill" in tags:
-                        thisNoodleType = "FILL"
-                    elif "Inset" in tags:
-                        #there are two possible senses for the words inner/internal and outer/external.  On the one hand, we might be
-                        #  trying to distinguish between faces of holes vs. "outer" faces.  On the other hand, we might be
-                        #  referring to the outermost shell vs. inner shells.
-                        # I am not entirely sure if Cura's concept of WALL-OUTER vs. WALL-INNER is the same as MAkerbot's concept of BeadMode External
-                        
-                        tagsContainingExternal = (tag for tag in tags if "External" in tag)
-                        tagsContainingInternal = (tag for tag in tags if "Internal" in tag)
-                        # print("\n" + str(len(list(tagsContainingExternal)))  + "\t" + str(len(list(tagsContainingInternal))) + "\n")
-                        if tagsContainingExternal:
-                            thisNoodleType = "WALL-OUTER"
-                        elif tagsContainingInternal:
-                            thisNoodleType = "WALL-INNER"
-                        else:
-                            print(
-                                "strangely, at index " + str(index) + " in the json toolpath, we have encountered a \"move\" "
-                                + "command having the \"Inset\" tag where none of the tags contains the word \"External\" "
-                                + "and none of the tags contains the word \"Internal\"."
-                            )
-                            #we'll blindly assume that we are dealing with "WALL-OUTER"
-                            thisNoodleType = "WALL-OUTER"
-                            pass
-                    else:
-                        #the default is to assume that noodleType has not changed.
-                        thisNoodleType = noodleType
+                    # the noodle type depends only on the combination of tags, so we work it out once per distinct combination, rather than once per move.
+                    tagsKey = tuple(command['tags'])
+                    if tagsKey not in noodleTypesByTags:
+                        tags = set(command['tags'])
+                        allTags.update(tags)
+                        noodleTypesByTags[tagsKey] = jsontoolpath.getNoodleType(tags, location="at index " + str(index) + " in the json toolpath")
+                    thisNoodleType = noodleTypesByTags[tagsKey] or noodleType
 
                     #As far as I can tell, there is no good way to detect which moves in the jsontoolpath correspond to Cura's concepts of SKIN, SKIRT, SUPPORT-INTERFACE, and PRIME-TOWER. 
 
                     if thisNoodleType != noodleType:
                         noodleType =  thisNoodleType
-                        outputGcodeFile.write(";TYPE:" + str(noodleType) + "\n")
-
-                    outputGcodeFile.write(
-                        "G1 X{} Y{} Z{} E{} F{}".format(
-                            command['parameters']['x'],
-                            command['parameters']['y'],
-                            command['parameters']['z'],
-                            command['parameters']['a'],
-                            command['parameters']['feedrate'] * 60
-                        ) + "\n"
+                        pendingMoveLines.append(";TYPE:" + str(noodleType) + "\n")
+
+                    parameters = command['parameters']
+                    pendingMoveLines.append(
+                        formatMoveLine(
+                            parameters['x'],
+                            parameters['y'],
+                            parameters['z'],
+                            parameters['a'],
+                            parameters['feedrate'] * 60
+                        )
                     )
+                    if len(pendingMoveLines) >= maximumPendingMoveLines:
+                        outputGcodeFile.write("".join(pendingMoveLines))
+                        pendingMoveLines = []
                 elif function == 'set_toolhead_temperature':
                     pass
                 elif function == 'toggle_fan':
@@ -561,8 +506,11 @@ def generatePreviewableGcode(inputJsontoolpathFile, outputGcodeFile, progressRep
                 else:
                     pass
 
+    outputGcodeFile.write("".join(pendingMoveLines))
+    if layers is not None:
+        layers[-1]['layerSections'] = layerSectionsSeenSinceLastLayer
+        layers[-1]['parenthesizedNumbers'] = parenthesizedNumbersAfterLayerSectionSeenSinceLastLayer
 
-        if progressReportingCallback: progressReportingCallback((index + 1)/len(toolpath))
     # print("\n") 
     # print("encountered the following tags:\n" + indentAllLines("\n".join(sorted(allTags))) + "\n")        
     # print("encountered the following functions:\n" + indentAllLines("\n".join(sorted(allFunctions))) + "\n")        
@@ -580,231 +528,1306 @@ def generatePreviewableGcode(inputJsontoolpathFile, outputGcodeFile, progressRep
     #
 
 
-# if args.miraclegrue_config_schema_file and args.output_annotated_miraclegrue_config_file:
-if args.output_annotated_miraclegrue_config_file:
-    # generate an annotated hjson version of the config file, by
-    # adding the descriptions in the schema as comments.
+# returns the initialState with which generatePreviewableGcode() picks up the conversion at the start of layer layerNumber, given the
+# layers of the toolpath (see layer_index), or None for layer 0 (i.e. the start of the toolpath).
+def getPreviewableGcodeStateAtLayer(layers, layerNumber):
+    if layerNumber == 0:
+        return None
+    layer = layers[layerNumber]
+    previousLayer = layers[layerNumber - 1]
+    return {
+        'itemIndex': layer['itemIndex'],
+        'byteOffset': layer['byteOffset'],
+        'noodleType': layer['noodleType'],
+        # the index of the previous layer, which generatePreviewableGcode() increments upon reaching this one.
+        'layerIndex': layerNumber - 2,
+        'layerSectionIndex': layer['layerSectionIndex'],
+        'lastUpperPosition': previousLayer['upperPosition'],
+        'parenthesizedNumbersAfterLayerSectionSeenSinceLastLayer': previousLayer['parenthesizedNumbers'],
+        'layerSectionsSeenSinceLastLayer': previousLayer['layerSections']
+    }
+
+# opens a jsontoolpath file (as a text file) or a columnar toolpath file (as a columnar_toolpath.ColumnarToolpath), for generatePreviewableGcode().
+# byteOffset, if given, is the offset (in a jsontoolpath file) of the item at which to start reading.
+def openToolpathFile(toolpathFilePath, byteOffset=None):
+    if columnar_toolpath.isColumnarToolpathFile(toolpathFilePath):
+        return columnar_toolpath.ColumnarToolpath(toolpathFilePath)
+    if byteOffset is None:
+        return open(toolpathFilePath,'r')
+    binaryFile = open(toolpathFilePath,'rb')
+    binaryFile.seek(byteOffset)
+    return io.TextIOWrapper(binaryFile, encoding='utf-8')
+
+# jsontoolpathFilePath may also be the path of a columnar toolpath file (see columnar_toolpath).
+# layerRange, if given, is a (firstLayerNumber, lastLayerNumber) tuple (see layer_index.parseLayerRange()), in which case we only 
+# convert those layers, starting at the first of them with the help of the toolpath's layer index.  If the toolpath has no (up-to-date) 
+# layer index, we first make one with a pass over the toolpath.
+# saveLayerIndex, if True, makes us save the layer index (when we make one) next to the toolpath.
+# workerCount, if greater than 1, is the number of processes among which to share the conversion (see writePreviewableGcodeFileInParallel()).
+# This needs the layers of the toolpath: we use the layer index if there is one, and otherwise find the layers first, which, for a
+# jsontoolpath (say, one that was just sliced), costs a pass over the toolpath that does not convert it (see 
+# layer_index.scanJsontoolpathLayers()), and, for a columnar toolpath, a quick look at its comments (see toolpath_stats.findLayers(),
+# without which, if numpy is not available, we say so, and convert the toolpath with a single process).
+# returns the layers of the toolpath (see layer_index).
+def writePreviewableGcodeFile(jsontoolpathFilePath, output_previewable_gcode_file_path, progressBarFactory=MyProgressBar, layerRange=None, saveLayerIndex=False, workerCount=None):
+    isColumnar = columnar_toolpath.isColumnarToolpathFile(jsontoolpathFilePath)
+    layers = None
+    initialState = None
+    itemCount = None
+    if layerRange or (workerCount and workerCount > 1):
+        layers = layer_index.loadLayerIndex(jsontoolpathFilePath)
+        if layers is None and (not isColumnar or (workerCount and workerCount > 1 and columnar_toolpath.isNumpyAvailable())):
+            if isColumnar:
+                import toolpath_stats
+                with tracing.span("find layers"), columnar_toolpath.ColumnarToolpath(jsontoolpathFilePath) as toolpath:
+                    layers = toolpath_stats.findLayers(toolpath)
+            else:
+                progressBar = progressBarFactory("layers")
+                with tracing.span("find layers"), open(jsontoolpathFilePath, 'r') as jsontoolpathFile:
+                    layers = layer_index.scanJsontoolpathLayers(jsontoolpathFile, progressReportingCallback=progressBar.setProgressAndUpdate)
+                progressBar.finish()
+            if saveLayerIndex:
+                try:
+                    layer_index.saveLayerIndex(jsontoolpathFilePath, layers, columnar=isColumnar)
+                except OSError as error:
+                    print("could not save the layer index of " + str(jsontoolpathFilePath) + ": " + str(error))
+        if layers is None and workerCount and workerCount > 1:
+            print("converting " + str(jsontoolpathFilePath) + " to previewable gcode with a single process, rather than " + str(workerCount) + ", since it has no layer index, and finding its layers takes numpy, which is not available.")
+    if workerCount and workerCount > 1 and layers is not None:
+        writePreviewableGcodeFileInParallel(jsontoolpathFilePath, output_previewable_gcode_file_path, layers, workerCount, progressBarFactory=progressBarFactory, layerRange=layerRange)
+        return layers
+    if layerRange:
+        if layers is None:
+            layers = writePreviewableGcodeFile(jsontoolpathFilePath, os.devnull, progressBarFactory=progressBarFactory, saveLayerIndex=saveLayerIndex)
+        startItemIndex, stopItemIndex = layer_index.getItemRange(layers, *layerRange)
+        initialState = getPreviewableGcodeStateAtLayer(layers, layerRange[0])
+        itemCount = (None if stopItemIndex is None else stopItemIndex - startItemIndex)
+    recordedLayers = (None if layerRange else [])
+    progressBar = progressBarFactory("gcode")
+    with (
+        tracing.span("previewable gcode", columnar=isColumnar, layerRange=layerRange), 
+        openToolpathFile(jsontoolpathFilePath, byteOffset=(initialState and initialState['byteOffset'])) as inputJsontoolpathFile, 
+        compressed_output.openTextOutput(output_previewable_gcode_file_path) as outputGcodeFile
+    ):
+        generatePreviewableGcode(
+            inputJsontoolpathFile=inputJsontoolpathFile,  
+            outputGcodeFile=outputGcodeFile, 
+            progressReportingCallback=progressBar.setProgressAndUpdate,
+            layers=recordedLayers,
+            initialState=initialState,
+            itemCount=itemCount
+        )
+    progressBar.finish()
+    if recordedLayers is not None:
+        layers = recordedLayers
+        if saveLayerIndex:
+            try:
+                layer_index.saveLayerIndex(jsontoolpathFilePath, layers, columnar=isColumnar)
+            except OSError as error:
+                print("could not save the layer index of " + str(jsontoolpathFilePath) + ": " + str(error))
+    return layers
+
+# converts a run of layers of a toolpath (those starting with the state initialState, or at the start of the toolpath if initialState is 
+# None, and running for itemCount items, or to the end of the toolpath if itemCount is None) into the previewable gcode file partFilePath.
+# This is the work of one of the processes of writePreviewableGcodeFileInParallel().
+def convertPreviewableGcodeChunk(toolpathFilePath, initialState, itemCount, partFilePath):
+    with (
+        openToolpathFile(toolpathFilePath, byteOffset=(initialState and initialState['byteOffset'])) as inputJsontoolpathFile, 
+        open(partFilePath, 'w') as outputGcodeFile
+    ):
+        generatePreviewableGcode(
+            inputJsontoolpathFile=inputJsontoolpathFile,
+            outputGcodeFile=outputGcodeFile,
+            initialState=initialState,
+            itemCount=itemCount
+        )
+    return partFilePath
+
+# generates the previewable gcode of a toolpath (all of it, or the layers in layerRange) with workerCount processes, given its layers 
+# (see layer_index).  We split the layers into runs of roughly equal size, at layer boundaries, where generatePreviewableGcode() can 
+# pick up the conversion from the state recorded in the layers (see getPreviewableGcodeStateAtLayer()), so that the runs can be 
+# converted independently.  Each process converts one run at a time into a temporary file, and we append these to the output in order,
+# as they are finished.  The output is the same as that of a single process.
+# There are a few runs per process, so that a process that finishes early can take on another run, and so that we can start writing
+# the output before the last of the runs is finished.
+def writePreviewableGcodeFileInParallel(toolpathFilePath, output_previewable_gcode_file_path, layers, workerCount, progressBarFactory=MyProgressBar, layerRange=None):
+    import concurrent.futures
+    import shutil
+    import tempfile
+    isColumnar = columnar_toolpath.isColumnarToolpathFile(toolpathFilePath)
+    # we measure the size of the layers in items for a columnar toolpath, and in bytes for a jsontoolpath.
+    if isColumnar:
+        with columnar_toolpath.ColumnarToolpath(toolpathFilePath) as toolpath:
+            end = len(toolpath)
+        layerStarts = [layer['itemIndex'] for layer in layers]
+    else:
+        end = os.path.getsize(toolpathFilePath)
+        layerStarts = [layer['byteOffset'] or 0 for layer in layers]
+    firstLayerNumber, lastLayerNumber = (layerRange or (0, None))
+    # (this checks that the range is within the toolpath)
+    layer_index.getItemRange(layers, firstLayerNumber, lastLayerNumber)
+    chunks = layer_index.splitLayerRange(layerStarts, end, chunkCount=4 * workerCount, firstLayerNumber=firstLayerNumber, lastLayerNumber=lastLayerNumber)
+    chunkSizes = [
+        (layerStarts[chunkLastLayerNumber + 1] if chunkLastLayerNumber + 1 < len(layers) else end) - layerStarts[chunkFirstLayerNumber]
+        for chunkFirstLayerNumber, chunkLastLayerNumber in chunks
+    ]
+    progressBar = progressBarFactory("gcode")
+    with (
+        tracing.span("previewable gcode", columnar=isColumnar, layerRange=layerRange, workers=workerCount, chunks=len(chunks)), 
+        tempfile.TemporaryDirectory() as temporaryDirectory,
+        concurrent.futures.ProcessPoolExecutor(max_workers=workerCount) as executor,
+        compressed_output.openTextOutput(output_previewable_gcode_file_path) as outputGcodeFile
+    ):
+        futures = []
+        for chunkIndex, (chunkFirstLayerNumber, chunkLastLayerNumber) in enumerate(chunks):
+            startItemIndex, stopItemIndex = layer_index.getItemRange(layers, chunkFirstLayerNumber, chunkLastLayerNumber)
+            futures.append(executor.submit(
+                convertPreviewableGcodeChunk, 
+                toolpathFilePath, 
+                getPreviewableGcodeStateAtLayer(layers, chunkFirstLayerNumber), 
+                (None if stopItemIndex is None else stopItemIndex - startItemIndex), 
+                pathlib.Path(temporaryDirectory).joinpath(str(chunkIndex) + ".gcode")
+            ))
+        for chunkIndex, future in enumerate(futures):
+            partFilePath = future.result()
+            with open(partFilePath, 'r') as partFile:
+                shutil.copyfileobj(partFile, outputGcodeFile, 1 << 20)
+            os.remove(partFilePath)
+            progressBar.setProgressAndUpdate(sum(chunkSizes[:chunkIndex + 1]) / (sum(chunkSizes) or 1))
+    progressBar.finish()
+
+# runs generatePreviewableGcode() in a background thread, on a jsontoolpath file that miracle_grue is still writing (see jsontoolpath.FollowedFile),
+# so that the conversion overlaps with the slicing (and, afterwards, with the packaging).
+# Usage: start() just before launching miracle_grue, producerFinished() once miracle_grue has exited, and join() once there is nothing 
+# else to do.  join() returns True if the previewable gcode was generated, or False if it was not (because the conversion never started, 
+# or because miracle_grue replaced the jsontoolpath file rather than writing to it), in which case the caller should generate it in the usual way.
+class PipelinedPreviewableGcodeConversion:
+    def __init__(self, output_previewable_gcode_file_path):
+        self.output_previewable_gcode_file_path = output_previewable_gcode_file_path
+        self._producerFinished = threading.Event()
+        self._thread = None
+        self._error = None
+        # the layers of the toolpath (see layer_index), which are recorded as we go.
+        self.layers = []
+
+    def start(self, jsontoolpathFilePath):
+        # we make sure that the file exists (and is empty) before the thread starts following it.
+        open(jsontoolpathFilePath, 'w').close()
+        self._thread = threading.Thread(target=self._run, args=(jsontoolpathFilePath,), name="previewable gcode", daemon=True)
+        self._thread.start()
+
+    def producerFinished(self):
+        self._producerFinished.set()
+
+    def join(self):
+        if self._thread is None:
+            return False
+        # in case the caller bailed out before miracle_grue finished, we do not want to wait forever.
+        self._producerFinished.set()
+        self._thread.join()
+        if isinstance(self._error, jsontoolpath.FollowedFileReplacedError):
+            return False
+        if self._error:
+            raise self._error
+        return True
+
+    def _run(self, jsontoolpathFilePath):
+        try:
+            with tracing.span("previewable gcode", pipelined=True), jsontoolpath.FollowedFile(jsontoolpathFilePath, self._producerFinished) as inputJsontoolpathFile, compressed_output.openTextOutput(self.output_previewable_gcode_file_path) as outputGcodeFile:
+                generatePreviewableGcode(
+                    inputJsontoolpathFile=inputJsontoolpathFile,
+                    outputGcodeFile=outputGcodeFile,
+                    layers=self.layers
+                )
+        except BaseException as error:
+            self._error = error
+
+def writeColumnarToolpathFile(jsontoolpathFilePath, output_columnar_toolpath_file_path, progressBarFactory=MyProgressBar):
+    progressBar = progressBarFactory("columnar")
+    with tracing.span("columnar toolpath") as columnarSpan:
+        rowCount = columnar_toolpath.convertJsontoolpathFile(jsontoolpathFilePath, output_columnar_toolpath_file_path, progressReportingCallback=progressBar.setProgressAndUpdate)
+        columnarSpan.set(rows=rowCount)
+    progressBar.finish()
+
+# writes the statistics of a toolpath (see toolpath_stats) to output_stats_file_path as json, and prints a summary.
+# toolpathFilePath is the path of a columnar toolpath file or of a jsontoolpath file (which we first convert into a temporary columnar toolpath file).
+# layers, if given, are the layers of the toolpath (see layer_index).
+def writeToolpathStatsFile(toolpathFilePath, output_stats_file_path, acceleration=None, layers=None, progressBarFactory=MyProgressBar):
+    import tempfile
+    import toolpath_stats
+    with tracing.span("toolpath stats") as statsSpan, tempfile.TemporaryDirectory() as temporaryDirectory:
+        if not columnar_toolpath.isColumnarToolpathFile(toolpathFilePath):
+            columnarToolpathFilePath = pathlib.Path(temporaryDirectory).joinpath("toolpath.tpcol")
+            writeColumnarToolpathFile(toolpathFilePath, columnarToolpathFilePath, progressBarFactory=progressBarFactory)
+            toolpathFilePath = columnarToolpathFilePath
+        with columnar_toolpath.ColumnarToolpath(toolpathFilePath) as toolpath:
+            stats = toolpath_stats.computeToolpathStats(toolpath, acceleration=acceleration, layers=layers)
+        statsSpan.set(moves=stats['moveCount'])
+    with open(output_stats_file_path, 'w') as statsFile:
+        json.dump(stats, statsFile, indent=4)
+    print(toolpath_stats.formatToolpathStats(stats))
+    return stats
+
+# returns a dict containing the paths of the various things within the MakerWare folder that we need.
+def getMakerwarePaths(makerware_path):
+    makerware_path = pathlib.Path(makerware_path).resolve()
+
+    # sliceLibraryEggPath = list(makerware_path.joinpath("python").glob("slice_library*.egg"))[0]
+
+    # print("sliceLibraryEggPath.resolve(): " + str(sliceLibraryEggPath.resolve()))		# sliceLibraryEggPath.resolve()
+
+    # # spec = importlib.util.spec_from_file_location('slice_library', sliceLibraryEggPath.resolve())
+    # # module = importlib.util.module_from_spec(spec)
+    # # sys.modules['slice_library'] = module
+    # # spec.loader.exec_module(module)
+
+    # sys.path.insert(0, str(sliceLibraryEggPath.resolve()))
+    # # This is how sliceconfig finds its resource files
+    # os.environ['MB_RESOURCE_PATH'] = str(makerware_path)
+    # import slice_library.tinything_processor
+
+    # print("dir(slice_library): " + str(dir(slice_library)))		# dir(slice_library)
+    # print("dir(slice_library.tinything_processor): " + str(dir(slice_library.tinything_processor)))		# dir(slice_library.tinything_processor)
+
+    return {
+        #the path of the python executable included with makerware:
+        'python_executable': makerware_path.joinpath("python3.4.exe").resolve(),
+        'python_working_directory': makerware_path.joinpath("python34").resolve(),
+        'miraclegrue_executable': makerware_path.joinpath("miracle_grue.exe").resolve(),
+        #the path of the makerware sliceconfig python script:
+        'sliceconfig': makerware_path.joinpath("sliceconfig").resolve()
+    }
+
+# the compiled code of the transform files that we have loaded, keyed by path, along with the size and modification time of the file
+# when we compiled it.  In a long-running process (a batch worker, or the slicing service), this saves recompiling the same transform for every job.
+_compiledMiraclegrueConfigTransforms = {}
+
+# returns the compiled code of a transform file (see loadMiraclegrueConfig()), compiling it only if it has changed since we last did.
+def compileMiraclegrueConfigTransform(input_miraclegrue_config_transform_file_path):
+    path = str(pathlib.Path(input_miraclegrue_config_transform_file_path).resolve())
+    status = os.stat(path)
+    stamp = (status.st_size, status.st_mtime_ns)
+    if _compiledMiraclegrueConfigTransforms.get(path, (None, None))[0] != stamp:
+        with open(path, 'r') as transformFile:
+            _compiledMiraclegrueConfigTransforms[path] = (stamp, compile(transformFile.read(), path, 'exec'))
+    return _compiledMiraclegrueConfigTransforms[path][1]
+
+# loads the miraclegrue config file and applies the transform (if any).
+# returns the resulting miraclegrueConfig.
+def loadMiraclegrueConfig(input_miraclegrue_config_file_path, input_miraclegrue_config_transform_file_path=None, output_miraclegrue_config_diff_file_path=None):
+    import hjson
+    with tracing.span("load config", file=str(input_miraclegrue_config_file_path)):
+        miraclegrueConfig = hjson.load(open(input_miraclegrue_config_file_path ,'r'))
+
+    if input_miraclegrue_config_transform_file_path:
+        #modify miraclegrueConfig by applying any overrides that may be specified in input_miraclegrue_config_overrides_file
+        #miraclegrueConfigOverrides = hjson.load(open(input_miraclegrue_config_overrides_file_path ,'r'))
+        # print("miraclegrueConfigOverrides: " + str(type(miraclegrueConfigOverrides)))
+
+        # record the initia; state of miracleGrueConfig, before we allow the transform to (possibly) modify it.
+        # We do this so that we can, if the user has requested a output_miraclegrue_config_diff_file, generate
+        # a report showing the differences between miraclegrueConfig before and after the transform operates on it.
+        initialMiraclegrueConfig = copy.deepcopy(miraclegrueConfig)
+
+        #input_miraclegrue_config_overrides_file is expected to contain valid python code that defines a function
+        # named "transformMiraclegrueConfig", which is expected to take a single argument, a dict, which is the configuration
+        # that is to be transformed.  transformMiraclegrueConfig can modify the configuration as it sees fit.
+        # Should we expect transformMiraclegrueConfig() to return a dict, that we will then take to be the new miraclegrueConfig,
+        # or, alternatively, should we expect to transformMiraclegrueConfig() to modify the dict that is passed to it?  -- I am still deciding.
+        # It seems like the return value approach would be the most flexible.
+
+        isolatedGlobals = dict()
+
+        with tracing.span("load transform", file=str(input_miraclegrue_config_transform_file_path)):
+            exec(compileMiraclegrueConfigTransform(input_miraclegrue_config_transform_file_path), isolatedGlobals)
+        #I think, although am not entirely certain, that passing the isolatedGlobals object prevents the code in input_miraclegrue_config_transform_file_path
+        # from being able to muck with, or even see, our globals here.  This mechanism does not prevent the execution of arbitrary code and so is certainly not suitable for a production application.
+        # We ought to figure out how to run transformMiraclegrueConfig in a sandbox.
+
+        # print("isolatedGlobals.keys(): " + str(isolatedGlobals.keys()))
+        # print("type(isolatedGlobals[\"transformMiraclegrueConfig\"]): " + str(type(isolatedGlobals["transformMiraclegrueConfig"])))		#     type(isolatedGlobals["transformMiraclegrueConfig"])
+
+        with tracing.span("transform"):
+            miraclegrueConfig = isolatedGlobals["transformMiraclegrueConfig"](miraclegrueConfig)
+        # print("miraclegrueConfig['foo']: " + str(miraclegrueConfig['foo']))		#     miracleGrueConfig['foo']
+
+
+
+        if output_miraclegrue_config_diff_file_path:
+            # diff = jsondiff.diff(initialMiraclegrueConfig, miraclegrueConfig)
+            # print("diff.keys(): " + str(diff.keys()))		#         diff.keys()
+            # open(output_miraclegrue_config_diff_file_path ,'w').write(str(diff))
+
+            with tracing.span("config diff"):
+                import jsondiff_by_makerbot
+                diff = jsondiff_by_makerbot.JSONDiff(initialMiraclegrueConfig, miraclegrueConfig)
+                open(output_miraclegrue_config_diff_file_path ,'w').write(str(diff.pretty_str(trim_size=300)))
+
+    return miraclegrueConfig
+
+# generate an annotated hjson version of the config file, by
+# adding the descriptions in the schema as comments.
+def writeAnnotatedMiraclegrueConfig(miraclegrueConfig, schema, output_annotated_miraclegrue_config_file_path):
     # schema = json.load(open(pathlib.Path(args.miraclegrue_config_schema_file[0]).resolve() ,'r'))
-    process = subprocess.run(
-        args=[
-            str(miraclegrue_executable_path),
-            "--config-schema"   
-        ],
-        capture_output = True,
-        text=True
-    )
-    schema = json.loads(process.stdout)
     # oldSchema = json.load(open(pathlib.Path(args.old_miraclegrue_config_schema_file[0]).resolve(),'r'))
     # oldMiraclegrueConfig = json.load(open(pathlib.Path(args.old_miraclegrue_config_file[0]).resolve(),'r'))
     # we might consider running the config through miraclegrue and letting mircalegrue remove any invalid values.
 
-    with open(pathlib.Path(args.output_annotated_miraclegrue_config_file[0]).resolve() ,'w') as annotatedConfigFile:
-        annotatedConfigFile.write(
-            dumpsAnnotatedHjsonValue(
-                value=miraclegrueConfig,
-                schema=schema,
-                path=[]
-            )
+    with open(output_annotated_miraclegrue_config_file_path ,'w') as annotatedConfigFile:
+        writeAnnotatedHjsonValue(
+            file=annotatedConfigFile,
+            value=miraclegrueConfig,
+            schema=schema,
+            path=[]
         )
 
-# generate several temporary files, which we will use during the slicing/makerbot packaging process
-tempFilePaths = dict()
-for key in ["miraclegrue_config", "metadata", "jsontoolpath", "gcode"]:
-    with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix=(".jsontoolpath" if key == "jsontoolpath" else "")) as x:
-        tempFilePaths[key] = pathlib.Path(x.name).resolve()
-tempThumbnailDirectory = tempfile.TemporaryDirectory()
-
-
-json.dump(miraclegrueConfig, open(tempFilePaths["miraclegrue_config"],'w'), sort_keys=True, indent=4)
+# runs one of the makerware tools (miracle_grue or sliceconfig), which report their progress by writing json objects, one per line, to stdout.
+# progressKey is the name of the member of those json objects that holds the percent complete.
+# progressBar is a MyProgressBar (or something that behaves like one).
+# stdout and stderr are drained by background threads (see progress_reporting.startDrainingPipe()), so that the process never stalls 
+# on a full pipe.  The progress lines are parsed on the stdout thread, and we keep the last lines of stderr, which we print if the process fails.
+# processStarted, if given, is called with the process id of the process, once it has started.
+# returns the exit code of the process.
+def runProcessReportingJsonProgress(args, cwd, progressKey, progressBar, processStarted=None):
+    with tracing.span("subprocess " + pathlib.Path(args[0]).name, args=list(args)) as processSpan:
+        process = subprocess.Popen(
+            cwd=cwd,
+            args=args,
+            text=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        ) 
+        if processStarted:
+            processStarted(process.pid)
+
+        def handleStdoutLine(line):
+            # the progress lines are json objects; anything else that the tool writes to stdout, we ignore.
+            if not line.startswith("{"):
+                return
+            try:
+                jsonObject = json.loads(line)
+                progressBar.setProgressAndUpdate(float(jsonObject[progressKey])/100)
+            except (json.decoder.JSONDecodeError, KeyError, TypeError, ValueError):
+                pass
+        # the tool's stderr (its warnings, for instance) is passed on to ours as it arrives, just as if the tool had inherited our stderr, 
+        # and the last lines are also kept, to be repeated in the report of a failure.
+        stderrTail = progress_reporting.LineTail()
+        def handleStderrLine(line):
+            stderrTail(line)
+            sys.stderr.write(line if line.endswith("\n") else line + "\n")
+            sys.stderr.flush()
+        readerThreads = [
+            progress_reporting.startDrainingPipe(process.stdout, handleStdoutLine, name=pathlib.Path(args[0]).name + " stdout"),
+            progress_reporting.startDrainingPipe(process.stderr, handleStderrLine, name=pathlib.Path(args[0]).name + " stderr")
+        ]
+        process.wait()
+        for readerThread in readerThreads:
+            readerThread.join()
+        progressBar.setProgressAndUpdate(1)
+        progressBar.finish()
+        if process.returncode != 0 and stderrTail.lines:
+            print("the last lines that " + pathlib.Path(args[0]).name + " wrote to stderr:\n" + indentAllLines("\n".join(stderrTail.lines)))
+        # print("process.args: " + "\n" + indentAllLines("\n".join(process.args)))
+        # print("process.stdout: " + str(process.stdout))
+        # print("process.stderr: " + str(process.stderr))
+        print("process.returncode: " + str(process.returncode))
+        processSpan.set(returncode=process.returncode)
+    return process.returncode
+
+# runs miracle_grue (or, if a slice cache is given and it has a matching entry, skips running miracle_grue).
+# sliceFilePaths is a dict mapping "miraclegrue_config" to the path of the config file, and each of "jsontoolpath", "gcode" and "metadata" to
+# the path of the file to which miracle_grue is to write that output (either the final output file or a temporary file).
+# wantedSliceOutputs is a list of the keys of sliceFilePaths that we need miracle_grue to produce ("jsontoolpath", "gcode", "metadata").
+# returns a dict with the following members:
+#   sliceOutputPaths: a dict mapping each of wantedSliceOutputs to the path of the file containing that output.  This will be either 
+#       the file in sliceFilePaths that miracle_grue wrote to, or, in the case of a slice cache hit, the file in the cache.
+#   returncode: the exit code of miracle_grue (None if we did not run miracle_grue)
+#   sliceCacheHit: True or False if we consulted a slice cache, else None.
+#   incrementalBuildReuse: True if we reused the outputs of the previous build (see below), False if we looked for them but did not, else None.
+# pipelinedConversion, if given, is a PipelinedPreviewableGcodeConversion, which we start on the jsontoolpath as we launch miracle_grue 
+# (if we do launch miracle_grue).
+# memoryAdmission, if given, is a memory_budget.MemoryAdmission: we pass miracle_grue its share of the memory budget as --memory-threshold, 
+# and wait for room in the budget before launching it.
+# incrementalBuildStore, if given, is an incremental_build.IncrementalBuildStore: if the config differs from the config of the previous 
+# build of the model only in keys that do not affect the slice (see incremental_build.classifyConfigChanges(), which checks its 
+# classification against schema, if given), we use the outputs of the previous build rather than running miracle_grue, with the metadata
+# patched to match the config (see incremental_build.patchMetadata()).  Either way, the outputs and the config become the previous build 
+# for the next time.
+def sliceModel(makerwarePaths, input_model_file_path, sliceFilePaths, wantedSliceOutputs, output_miraclegrue_log_file_path=None, sliceCache=None, progressBarFactory=MyProgressBar, pipelinedConversion=None, memoryAdmission=None, incrementalBuildStore=None, schema=None):
+    sliceOutputPaths = {key: sliceFilePaths[key] for key in wantedSliceOutputs}
+    returncode = None
+    sliceCacheHit = None
+    incrementalBuildReuse = None
+    miraclegrueVersion = (miraclegrue_schema.getMiraclegrueVersion(makerwarePaths['miraclegrue_executable']) if sliceCache or incrementalBuildStore else None)
+
+    cachedSliceOutputPaths = None
+    if sliceCache:
+        with tracing.span("slice cache lookup") as lookupSpan:
+            sliceCacheKey = sliceCache.computeKey(
+                modelFilePath=input_model_file_path,
+                configFilePath=sliceFilePaths["miraclegrue_config"],
+                miraclegrueVersion=miraclegrueVersion
+            )
+            cachedSliceOutputPaths = sliceCache.lookup(sliceCacheKey, wantedSliceOutputs)
+            sliceCacheHit = bool(cachedSliceOutputPaths)
+            lookupSpan.set(key=sliceCacheKey, hit=sliceCacheHit)
+
+    retainedSliceOutputPaths = None
+    if incrementalBuildStore:
+        incrementalBuildKey = incrementalBuildStore.computeKey(modelFilePath=input_model_file_path, miraclegrueVersion=miraclegrueVersion)
+    if incrementalBuildStore and not cachedSliceOutputPaths:
+        with tracing.span("incremental build lookup", key=incrementalBuildKey) as incrementalSpan:
+            previousBuild = incrementalBuildStore.getPreviousBuild(incrementalBuildKey, wantedSliceOutputs)
+            if previousBuild:
+                previousMiraclegrueConfig, retainedSliceOutputPaths = previousBuild
+                with open(sliceFilePaths["miraclegrue_config"], 'r') as miraclegrueConfigFile:
+                    miraclegrueConfig = json.load(miraclegrueConfigFile)
+                configChanges = incremental_build.classifyConfigChanges(previousMiraclegrueConfig, miraclegrueConfig, schema=schema)
+                for keyPath, affectsSlice, reason in configChanges:
+                    print("changed since the previous build: " + keyPath + " (" + ("affects the slice" if affectsSlice else "does not affect the slice: " + reason) + ")")
+                if any(affectsSlice for keyPath, affectsSlice, reason in configChanges):
+                    retainedSliceOutputPaths = None
+                incrementalSpan.set(changes={keyPath: affectsSlice for keyPath, affectsSlice, reason in configChanges})
+            else:
+                print("no previous build of the model with all of the outputs that we need (" + ", ".join(wantedSliceOutputs) + ")")
+            incrementalBuildReuse = bool(retainedSliceOutputPaths)
+            incrementalBuildStore.recordReuse(incrementalBuildKey, incrementalBuildReuse)
+            incrementalSpan.set(reused=incrementalBuildReuse)
+
+    if cachedSliceOutputPaths:
+        print("slice cache hit: " + sliceCacheKey)
+        sliceOutputPaths.update(cachedSliceOutputPaths)
+    elif retainedSliceOutputPaths:
+        print("nothing that affects the slice has changed since the previous build, so we reuse its outputs rather than slicing.")
+        sliceOutputPaths.update(retainedSliceOutputPaths)
+        updatedBuildPaths = {incrementalBuildStore.configName: sliceFilePaths["miraclegrue_config"]}
+        # the metadata records some of the packaging-only keys (and the config as a whole), so we bring it up to date rather than 
+        # serving (and packaging) the metadata of the previous config.
+        if "metadata" in wantedSliceOutputs:
+            incremental_build.patchMetadata(retainedSliceOutputPaths["metadata"], previousMiraclegrueConfig, miraclegrueConfig, sliceFilePaths["metadata"])
+            sliceOutputPaths["metadata"] = updatedBuildPaths["metadata"] = sliceFilePaths["metadata"]
+        # the config (which differs from the previous one only in keys that do not affect the slice) is now that of the previous build.
+        incrementalBuildStore.store(incrementalBuildKey, updatedBuildPaths)
+    else:
+        subprocessArgs = [str(makerwarePaths['miraclegrue_executable']),
+            "--json-progress", # Display progress messages in JSON format
+            "--config=" + str(sliceFilePaths["miraclegrue_config"])
+        ]
 
-if False and output_makerbot_file_path:
+        if "gcode" in wantedSliceOutputs: subprocessArgs.append("--gcode-toolpath-output=" + str(sliceFilePaths["gcode"]))
+        if "jsontoolpath" in wantedSliceOutputs: subprocessArgs.append("--json-toolpath-output=" + str(sliceFilePaths["jsontoolpath"]))
+        if "metadata" in wantedSliceOutputs: subprocessArgs.append("--metadata-output=" + str(sliceFilePaths["metadata"]))
+        if output_miraclegrue_log_file_path: 
+            subprocessArgs.append("--log-file=" + str(output_miraclegrue_log_file_path))
+            subprocessArgs.append("--log-level=" + "FFF")
+            # --log-level level                     
+            # Verbosity of the slicer output log. 
+            # Must be one of ERROR, WARNING, INFO, 
+            # FINE, FINER, FINEST or E, W, I, F, FF, 
+            # FFF respectively
+            subprocessArgs.append("--no-log-format")
+        if memoryAdmission:
+            subprocessArgs.append("--memory-threshold=" + memoryAdmission.getMemoryThreshold())
+
+        subprocessArgs.append(str(input_model_file_path))
+
+        with (memoryAdmission.admit() if memoryAdmission else contextlib.nullcontext()) as setSlicerProcessId:
+            if pipelinedConversion:
+                pipelinedConversion.start(sliceFilePaths["jsontoolpath"])
+            try:
+                returncode = runProcessReportingJsonProgress(
+                    args=subprocessArgs,
+                    cwd=makerwarePaths['python_working_directory'],
+                    progressKey="totalPercentComplete",
+                    progressBar=progressBarFactory("miracle_grue"),
+                    processStarted=setSlicerProcessId
+                )
+            finally:
+                if pipelinedConversion:
+                    pipelinedConversion.producerFinished()
+
+        if sliceCache and returncode == 0:
+            with tracing.span("slice cache store", key=sliceCacheKey):
+                sliceCache.store(sliceCacheKey, sliceOutputPaths)
+    if incrementalBuildStore and (cachedSliceOutputPaths or returncode == 0):
+        with tracing.span("incremental build store", key=incrementalBuildKey):
+            incrementalBuildStore.storeBuild(incrementalBuildKey, dict(sliceOutputPaths, **{incrementalBuildStore.configName: sliceFilePaths["miraclegrue_config"]}))
+    if sliceCache:
+        print("slice cache stats: " + json.dumps(sliceCache.getStats()))
+
+    return {
+        'sliceOutputPaths': sliceOutputPaths,
+        'returncode': returncode,
+        'sliceCacheHit': sliceCacheHit,
+        'incrementalBuildReuse': incrementalBuildReuse
+    }
+
+# runs sliceconfig to package a jsontoolpath (along with its metadata and the config that produced it) into a .makerbot file.
+# returns the exit code of sliceconfig.
+def packageMakerbot(makerwarePaths, miraclegrueConfig, miraclegrueConfigFilePath, jsontoolpathFilePath, metadataFilePath, output_makerbot_file_path, progressBarFactory=MyProgressBar):
     subprocessArgs = [
-        str(makerware_python_executable_path),
-        str(makerware_sliceconfig_path),
+        str(makerwarePaths['python_executable']),
+        str(makerwarePaths['sliceconfig']),
         "--status-updates",
-        "--input=" + str(input_model_file_path) +  "",
-        "--output=" + str(output_makerbot_file_path) +  "",
-        "--machine_id=" + miraclegrueConfig['_bot'] + "",
-        "--extruder_ids=" + ",".join(miraclegrueConfig['_extruders']) + "",
-        "--material_ids=" + ",".join(miraclegrueConfig['_materials']) + "",
-        "--profile=" + str(temporary_miraclegrue_config_file_path) + "" ,
-        "slice"
+        "--input=" + str(jsontoolpathFilePath),
+        "--output=" + str(output_makerbot_file_path),
+        "--machine_id=" + miraclegrueConfig['_bot'],
+        "--extruder_ids=" + ",".join(miraclegrueConfig['_extruders']),
+        "--material_ids=" + ",".join(miraclegrueConfig['_materials']),
+        "--profile=" + str(miraclegrueConfigFilePath),
+        "--metadata=" + str(metadataFilePath),
+        # "--thumbnail-dir=" + str(pathlib.Path(tempThumbnailDirectory.name).resolve()),
+        # having nothing in the thumbnail dir causes an error.  Therefore, we will only pass the thumbnail-dir option if we have thumbnail images.
+        "package_makerbot"
     ]
 
-    process = subprocess.Popen(
-        cwd=makerware_python_working_directory_path,
+    return runProcessReportingJsonProgress(
         args=subprocessArgs,
-        # capture_output = True,
-        text=True,
-        stdout=subprocess.PIPE
+        cwd=makerwarePaths['python_working_directory'],
+        progressKey="progress",
+        progressBar=progressBarFactory("sliceconfig")
     )
 
+# runs the whole pipeline for one model: load (and transform) the config, annotate it, slice, and produce whichever outputs are requested.
+# The arguments correspond to the command-line options of the same names (with "_path" appended), and are expected to be 
+# pathlib.Path objects (or None, for the outputs that are not wanted).
+# schemaCache, if given, is a miraclegrue_schema.SchemaCache from which to get the config schema (rather than asking miracle_grue for it).
+# miraclegrueVersionNumber, if given, selects the cached schema of that miracle_grue version (so that we can annotate without miracle_grue installed).
+# progressBarFactory is called with the name of a stage, and is expected to return a MyProgressBar (or something that behaves like one).
+# pipelined, if True, overlaps the generation of the previewable gcode with slicing and packaging (see PipelinedPreviewableGcodeConversion).
+# layerRange, if given, limits the previewable gcode to a range of layers (see writePreviewableGcodeFile()).
+# previewableGcodeWorkerCount, if greater than 1, is the number of processes among which to share the generation of the previewable gcode 
+# (see writePreviewableGcodeFile()).  Since that goes quicker from a columnar toolpath, we then make the columnar toolpath output (if 
+# requested) first, and generate the previewable gcode from that.
+# statsAcceleration is the acceleration for the print time estimate of the toolpath statistics (see writeToolpathStatsFile()).
+# memoryAdmission, if given, is the memory_budget.MemoryAdmission of the slicers that run at once (see sliceModel()).
+# incrementalBuildStore, if given, is an incremental_build.IncrementalBuildStore, in which case we only re-slice the model if something 
+# that affects the slice has changed since the previous build of it (see sliceModel()); otherwise, only the stages downstream of 
+# slicing (packaging, the previewable gcode, the columnar toolpath and the statistics) are run, on the retained outputs.
+# configValidation is one of config_validation.configValidationModes: unless it is "off", we check the config (after the transform) against 
+# the schema before slicing, printing any warnings, and, if it is "error", raising a config_validation.ConfigValidationError if there are 
+# any errors (if it is "warn", we just print them).  If it is None (i.e. nobody asked for the check), it is "error", except that if the
+# schema cannot be had (say, miracle_grue fails to report it), we print a warning and slice without the check, rather than failing a
+# run that would have gone fine without it.  Otherwise, and whenever the annotated config is wanted, a missing schema is a LookupError.
+# When the previewable gcode is generated in full, the layer index (see layer_index) is saved next to the jsontoolpath and columnar toolpath outputs.
+# returns a dict describing what happened (the exit codes of the subprocesses and whether we hit the slice cache).
+def makePrintable(
+    makerware_path,
+    input_model_file_path,
+    input_miraclegrue_config_file_path,
+    input_miraclegrue_config_transform_file_path=None,
+    output_annotated_miraclegrue_config_file_path=None,
+    output_miraclegrue_config_diff_file_path=None,
+    output_makerbot_file_path=None,
+    output_gcode_file_path=None,
+    output_previewable_gcode_file_path=None,
+    output_json_toolpath_file_path=None,
+    output_metadata_file_path=None,
+    output_miraclegrue_log_file_path=None,
+    output_columnar_toolpath_file_path=None,
+    output_stats_file_path=None,
+    statsAcceleration=None,
+    sliceCache=None,
+    schemaCache=None,
+    miraclegrueVersionNumber=None,
+    progressBarFactory=MyProgressBar,
+    pipelined=False,
+    layerRange=None,
+    previewableGcodeWorkerCount=None,
+    memoryAdmission=None,
+    incrementalBuildStore=None,
+    configValidation=None
+):
+    import tempfile
+    makerwarePaths = getMakerwarePaths(makerware_path)
+    result = {
+        'miraclegrueReturncode': None,
+        'sliceconfigReturncode': None,
+        'sliceCacheHit': None,
+        'incrementalBuildReuse': None,
+        'bytesNotCopied': 0
+    }
+
+    miraclegrueConfig = loadMiraclegrueConfig(
+        input_miraclegrue_config_file_path=input_miraclegrue_config_file_path,
+        input_miraclegrue_config_transform_file_path=input_miraclegrue_config_transform_file_path,
+        output_miraclegrue_config_diff_file_path=output_miraclegrue_config_diff_file_path
+    )
 
-    # for line in iter(process.stdout.readline, 'b'):
-    #     if line:
-    #         # sys.stdout.write(line)
-    #         print(line)
-    #     else:
-    #         break
-   
-   
-    # while True:
-    #     output = process.stdout.readline()
-    #     if output == '' and process.poll() is not None:
-    #         break
-    #     if output:
-    #         now = datetime.datetime.now()
-    #         print(now.strftime("%Y-%m-%d %H:%M:%S") + " " + str(now.microsecond) + " " + ": " + output.strip())
-    #         sys.stdout.flush()
-
-    progressBar = MyProgressBar("sliceconfig")
-    for line in iter(process.stdout.readline, 'b'):
-        if line:
-            #attempt to interpret line as a json expression.
-            jsonObject = None
-            try:
-                jsonObject: dict = json.loads(line)
-            except json.decoder.JSONDecodeError as error:
-                # sys.stdout.write(line); sys.stdout.flush()
-                # # curiously, on some shells (for instance, the shell within notepad++ and git bash), 
-                # # the output from this script was being accumulated in a  buffer and only dumped to stdout 
-                # # once the process had completed.  The fix was to add the sys.stdout.flush() call above.
-                pass
-            else:
-                progressBar.setProgressAndUpdate(float(jsonObject.get("progress"))/100)
+    # the schema is needed for the annotation, the validation, and for checking the classification of the config changes of an incremental build.
+    schema = None
+    if output_annotated_miraclegrue_config_file_path or incrementalBuildStore or configValidation != "off":
+        try:
+            with tracing.span("fetch schema", cached=bool(schemaCache)):
+                schema = (
+                    schemaCache.getSchemaForExecutableOrVersion(miraclegrueExecutablePath=makerwarePaths['miraclegrue_executable'], versionNumber=miraclegrueVersionNumber)
+                    if schemaCache else
+                    miraclegrue_schema.fetchMiraclegrueConfigSchema(makerwarePaths['miraclegrue_executable'])
+                )
+        except LookupError as error:
+            if output_annotated_miraclegrue_config_file_path or configValidation is not None:
+                raise
+            # (an incremental build makes do without the schema; see incremental_build.classifyConfigChanges().)
+            print("warning: skipping the validation of the config, since we could not get the config schema: " + str(error))
+            configValidation = "off"
+    if configValidation is None:
+        configValidation = "error"
+    # if args.miraclegrue_config_schema_file and args.output_annotated_miraclegrue_config_file:
+    if output_annotated_miraclegrue_config_file_path:
+        with tracing.span("annotate config"):
+            writeAnnotatedMiraclegrueConfig(
+                miraclegrueConfig=miraclegrueConfig,
+                schema=schema,
+                output_annotated_miraclegrue_config_file_path=output_annotated_miraclegrue_config_file_path
+            )
 
-        else:
-            break
-    process.wait()
-    progressBar.setProgressAndUpdate(1)
-    progressBar.finish()
-    # print("process.args: " + "\n" + indentAllLines("\n".join(process.args)))
-    # print("process.stdout: " + str(process.stdout))
-    # print("process.stderr: " + str(process.stderr))
-    print("process.returncode: " + str(process.returncode))
-    print("temporary_miraclegrue_config_file_path: " + str(temporary_miraclegrue_config_file_path))
-
-if output_gcode_file_path or output_json_toolpath_file_path or output_metadata_file_path or output_makerbot_file_path: 
-    subprocessArgs = [str(miraclegrue_executable_path),
-        "--json-progress", # Display progress messages in JSON format
-        "--config=" + str(tempFilePaths["miraclegrue_config"])
-    ]
+    # we find out about a bad config here, rather than (perhaps minutes) into slicing.  The annotated config, if requested, has already
+    # been written, for help in finding the problem.
+    if configValidation != "off":
+        with tracing.span("validate config") as validationSpan:
+            configErrors, configWarnings = config_validation.validateConfig(miraclegrueConfig, schema)
+            validationSpan.set(errors=len(configErrors), warnings=len(configWarnings))
+        for configWarning in configWarnings:
+            print("config warning: " + configWarning)
+        if configErrors and configValidation == "error":
+            raise config_validation.ConfigValidationError(configErrors)
+        for configError in configErrors:
+            print("config error: " + configError)
+
+    # miracle_grue writes each of its outputs straight to the requested output file, where one is given, rather than to a temporary file
+    # that we would then have to copy into place (which, for a multi-gigabyte jsontoolpath, is a full extra read and write).
+    # We only need temporary files for the config, and for the outputs that we need along the way (e.g. the jsontoolpath and metadata 
+    # for packaging) but that were not requested, and for a compressed gcode output (see compressed_output), which we compress from a
+    # temporary file once miracle_grue has finished.
+    outputFilePaths = {'gcode': output_gcode_file_path, 'jsontoolpath': output_json_toolpath_file_path, 'metadata': output_metadata_file_path}
+    compressedOutputKeys = [key for key, path in outputFilePaths.items() if path and compressed_output.getCompression(path)]
+    tempFilePaths = dict()
+    for key in ["miraclegrue_config", "metadata", "jsontoolpath", "gcode"]:
+        if outputFilePaths.get(key) and key not in compressedOutputKeys:
+            continue
+        with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix=(".jsontoolpath" if key == "jsontoolpath" else "")) as x:
+            tempFilePaths[key] = pathlib.Path(x.name).resolve()
+    sliceFilePaths = dict(tempFilePaths, **{key: pathlib.Path(path) for key, path in outputFilePaths.items() if path and key not in compressedOutputKeys})
+    tempThumbnailDirectory = tempfile.TemporaryDirectory()
+
+    try:
+        with open(sliceFilePaths["miraclegrue_config"],'w') as miraclegrueConfigFile:
+            json.dump(miraclegrueConfig, miraclegrueConfigFile, sort_keys=True, indent=4)
+
+        if output_gcode_file_path or output_json_toolpath_file_path or output_metadata_file_path or output_makerbot_file_path or output_columnar_toolpath_file_path or output_stats_file_path: 
+            # the outputs that we need from miracle_grue (these are the keys of sliceFilePaths that miracle_grue will write to)
+            wantedSliceOutputs = (
+                (["gcode"] if output_gcode_file_path else [])
+                + (["jsontoolpath"] if output_json_toolpath_file_path or output_makerbot_file_path or output_previewable_gcode_file_path or output_columnar_toolpath_file_path or output_stats_file_path else [])
+                + (["metadata"] if output_metadata_file_path or output_makerbot_file_path else [])
+            )
+            # an existing output file might be a hard link to a slice cache entry (as earlier versions made them), so we remove it rather than letting miracle_grue overwrite it in place.
+            for key in wantedSliceOutputs:
+                if outputFilePaths.get(key) and os.path.lexists(outputFilePaths[key]):
+                    os.remove(outputFilePaths[key])
+            bytesLinkedIntoSliceCache = sliceCache.bytesLinked if sliceCache else 0
+            pipelinedConversion = (PipelinedPreviewableGcodeConversion(output_previewable_gcode_file_path) if pipelined and output_previewable_gcode_file_path and not layerRange else None)
+            with tracing.span("slice", outputs=wantedSliceOutputs) as sliceSpan:
+                sliceResult = sliceModel(
+                    makerwarePaths=makerwarePaths,
+                    input_model_file_path=input_model_file_path,
+                    sliceFilePaths=sliceFilePaths,
+                    wantedSliceOutputs=wantedSliceOutputs,
+                    output_miraclegrue_log_file_path=output_miraclegrue_log_file_path,
+                    sliceCache=sliceCache,
+                    progressBarFactory=progressBarFactory,
+                    pipelinedConversion=pipelinedConversion,
+                    memoryAdmission=memoryAdmission,
+                    incrementalBuildStore=incrementalBuildStore,
+                    schema=schema
+                )
+                sliceSpan.set(returncode=sliceResult['returncode'], sliceCacheHit=sliceResult['sliceCacheHit'], incrementalBuildReuse=sliceResult['incrementalBuildReuse'])
+            sliceOutputPaths = sliceResult['sliceOutputPaths']
+            result['miraclegrueReturncode'] = sliceResult['returncode']
+            result['sliceCacheHit'] = sliceResult['sliceCacheHit']
+            result['incrementalBuildReuse'] = sliceResult['incrementalBuildReuse']
+
+            # the outputs are normally already in place.  In the case of a slice cache hit (or of reusing the outputs of the previous 
+            # build), we reflink them to the cached (or retained) files if we can, and copy them otherwise (see slice_cache.linkOrCopyFile()).
+            # A compressed output is always a fresh file, compressed from what miracle_grue wrote (or from the cached file).
+            with tracing.span("copy outputs") as copySpan:
+                outputMethods = {}
+                bytesNotCopied = (sliceCache.bytesLinked - bytesLinkedIntoSliceCache) if sliceCache else 0
+                for key in wantedSliceOutputs:
+                    if not outputFilePaths.get(key):
+                        continue
+                    if key in compressedOutputKeys:
+                        compressed_output.compressFile(sliceOutputPaths[key], outputFilePaths[key])
+                        outputMethods[key] = "compressed"
+                        continue
+                    if sliceOutputPaths[key] == sliceFilePaths[key]:
+                        outputMethods[key] = "written in place"
+                    else:
+                        outputMethods[key] = slice_cache.linkOrCopyFile(sliceOutputPaths[key], outputFilePaths[key])
+                    if outputMethods[key] != "copy":
+                        bytesNotCopied += os.path.getsize(outputFilePaths[key])
+                copySpan.set(methods=outputMethods, bytesNotCopied=bytesNotCopied)
+            result['bytesNotCopied'] = bytesNotCopied
+            print(
+                "avoided copying " + str(bytesNotCopied) + " bytes of slice outputs"
+                + (" (" + ", ".join(key + ": " + method for key, method in outputMethods.items()) + ")" if outputMethods else "")
+            )
 
-    if output_gcode_file_path: subprocessArgs.append("--gcode-toolpath-output=" + str(tempFilePaths["gcode"]))
-    if output_json_toolpath_file_path or output_makerbot_file_path or output_previewable_gcode_file_path: subprocessArgs.append("--json-toolpath-output=" + str(tempFilePaths["jsontoolpath"]))
-    if output_metadata_file_path or output_makerbot_file_path: subprocessArgs.append("--metadata-output=" + str(tempFilePaths["metadata"]))
-    if output_miraclegrue_log_file_path: 
-        subprocessArgs.append("--log-file=" + str(output_miraclegrue_log_file_path))
-        subprocessArgs.append("--log-level=" + "FFF")
-        # --log-level level                     
-        # Verbosity of the slicer output log. 
-        # Must be one of ERROR, WARNING, INFO, 
-        # FINE, FINER, FINEST or E, W, I, F, FF, 
-        # FFF respectively
-        subprocessArgs.append("--no-log-format")
-        
-
-    subprocessArgs.append(str(input_model_file_path))
-     
-
-    process = subprocess.Popen(
-        cwd=makerware_python_working_directory_path,
-        args=subprocessArgs,
-        # capture_output = True,
-        text=True,
-        stdout=subprocess.PIPE
-    ) 
-
-    # progressBar = MyProgressBar("miracle_grue", file=sys.stdout)
-    progressBar = MyProgressBar("miracle_grue")
-    for line in iter(process.stdout.readline, 'b'): 
-        if line:
-            #attempt to interpret line as a json expression.
-            jsonObject = None
+            # in pipelined mode, the previewable gcode is already being generated (unless we hit the slice cache), and we let that carry on while we package.
+            layers = None
+            columnarFirst = bool(output_columnar_toolpath_file_path and previewableGcodeWorkerCount and previewableGcodeWorkerCount > 1)
+            if output_columnar_toolpath_file_path and columnarFirst:
+                writeColumnarToolpathFile(sliceOutputPaths["jsontoolpath"], output_columnar_toolpath_file_path, progressBarFactory=progressBarFactory)
+            if output_previewable_gcode_file_path and not pipelinedConversion:
+                layers = writePreviewableGcodeFile(
+                    (output_columnar_toolpath_file_path if columnarFirst else sliceOutputPaths["jsontoolpath"]), 
+                    output_previewable_gcode_file_path, 
+                    progressBarFactory=progressBarFactory, 
+                    layerRange=layerRange, 
+                    workerCount=previewableGcodeWorkerCount
+                )
+            if output_columnar_toolpath_file_path and not columnarFirst:
+                writeColumnarToolpathFile(sliceOutputPaths["jsontoolpath"], output_columnar_toolpath_file_path, progressBarFactory=progressBarFactory)
+            if output_makerbot_file_path:
+                with tracing.span("package makerbot") as packageSpan:
+                    result['sliceconfigReturncode'] = packageMakerbot(
+                        makerwarePaths=makerwarePaths,
+                        miraclegrueConfig=miraclegrueConfig,
+                        miraclegrueConfigFilePath=sliceFilePaths["miraclegrue_config"],
+                        jsontoolpathFilePath=sliceOutputPaths["jsontoolpath"],
+                        metadataFilePath=sliceOutputPaths["metadata"],
+                        output_makerbot_file_path=output_makerbot_file_path,
+                        progressBarFactory=progressBarFactory
+                    )
+                    packageSpan.set(returncode=result['sliceconfigReturncode'])
+            if pipelinedConversion:
+                if pipelinedConversion.join():
+                    layers = pipelinedConversion.layers
+                else:
+                    layers = writePreviewableGcodeFile(sliceOutputPaths["jsontoolpath"], output_previewable_gcode_file_path, progressBarFactory=progressBarFactory, workerCount=previewableGcodeWorkerCount)
+            if layers:
+                for toolpathFilePath, isColumnar in [(output_json_toolpath_file_path, False), (output_columnar_toolpath_file_path, True)]:
+                    if toolpathFilePath:
+                        layer_index.saveLayerIndex(toolpathFilePath, layers, columnar=isColumnar)
+            if output_stats_file_path:
+                writeToolpathStatsFile(
+                    output_columnar_toolpath_file_path or sliceOutputPaths["jsontoolpath"], 
+                    output_stats_file_path, 
+                    acceleration=statsAcceleration, 
+                    layers=layers, 
+                    progressBarFactory=progressBarFactory
+                )
+    finally:
+        # clean up the temporary files (when running a batch of hundreds of jobs, leaving these lying around adds up).
+        for tempFilePath in tempFilePaths.values():
             try:
-                jsonObject: dict = json.loads(line)
-            except json.decoder.JSONDecodeError as error:
-                # sys.stdout.write(line); sys.stdout.flush()
-                # # curiously, on some shells (for instance, the shell within notepad++ and git bash), 
-                # # the output from this script was being accumulated in a  buffer and only dumped to stdout 
-                # # once the process had completed.  The fix was to add the sys.stdout.flush() call above.
+                os.remove(tempFilePath)
+            except OSError:
                 pass
-            else:
-                progressBar.setProgressAndUpdate(float(jsonObject.get("totalPercentComplete"))/100)
-                sys.stdout.flush()
-        else:
-            break
-    process.wait()
-    progressBar.setProgressAndUpdate(1)
-    progressBar.finish()
-    # print("process.args: " + "\n" + indentAllLines("\n".join(process.args)))
-    # print("process.stdout: " + str(process.stdout))
-    # print("process.stderr: " + str(process.stderr))
-    print("process.returncode: " + str(process.returncode))
-
-    if output_metadata_file_path: shutil.copyfile(tempFilePaths["metadata"], output_metadata_file_path)
-    if output_json_toolpath_file_path: shutil.copyfile(tempFilePaths["jsontoolpath"], output_json_toolpath_file_path)
-
-    if output_gcode_file_path: shutil.copyfile(tempFilePaths["gcode"], output_gcode_file_path)
-
-    if output_previewable_gcode_file_path:
-        progressBar = MyProgressBar("gcode")
-        generatePreviewableGcode(
-            inputJsontoolpathFile=open(tempFilePaths["jsontoolpath"],'r'),  
-            outputGcodeFile=open(output_previewable_gcode_file_path,'w'), 
-            progressReportingCallback=progressBar.setProgressAndUpdate
+        tempThumbnailDirectory.cleanup()
+
+    return result
+
+
+# compares two jsontoolpath files layer by layer (see jsontoolpath_diff), prints a report of the layers that differ, and,
+# if output_json_toolpath_diff_file_path is given, writes the summaries of all of the layers to that file as json.
+# returns the list of layer summaries.
+def diffJsontoolpathFiles(json_toolpath_file_path_a, json_toolpath_file_path_b, tolerance=1e-4, output_json_toolpath_diff_file_path=None, progressBarFactory=MyProgressBar):
+    import jsontoolpath_diff
+    with open(json_toolpath_file_path_a, 'r') as jsontoolpathFile_a, open(json_toolpath_file_path_b, 'r') as jsontoolpathFile_b:
+        progressBar = progressBarFactory("diff")
+        summaries = list(
+            jsontoolpath_diff.diffJsontoolpaths(
+                jsontoolpathFile_a, 
+                jsontoolpathFile_b, 
+                tolerance=tolerance,
+                progressReportingCallback=progressBar.setProgressAndUpdate
+            )
         )
         progressBar.finish()
-    if output_makerbot_file_path:
-        subprocessArgs = [
-            str(makerware_python_executable_path),
-            str(makerware_sliceconfig_path),
-            "--status-updates",
-            "--input=" + str(tempFilePaths["jsontoolpath"]),
-            "--output=" + str(output_makerbot_file_path),
-            "--machine_id=" + miraclegrueConfig['_bot'],
-            "--extruder_ids=" + ",".join(miraclegrueConfig['_extruders']),
-            "--material_ids=" + ",".join(miraclegrueConfig['_materials']),
-            "--profile=" + str(tempFilePaths["miraclegrue_config"]),
-            "--metadata=" + str(tempFilePaths["metadata"]),
-            # "--thumbnail-dir=" + str(pathlib.Path(tempThumbnailDirectory.name).resolve()),
-            # having nothing in the thumbnail dir causes an error.  Therefore, we will only pass the thumbnail-dir option if we have thumbnail images.
-            "package_makerbot"
-        ]
+    print(jsontoolpath_diff.formatJsontoolpathDiffReport(summaries))
+    if output_json_toolpath_diff_file_path:
+        with open(output_json_toolpath_diff_file_path, 'w') as jsontoolpathDiffFile:
+            json.dump(summaries, jsontoolpathDiffFile, indent=4)
+    return summaries
+
+
+# the options of a job in a batch manifest.  A batch manifest is a json (or hjson) file containing a list of jobs, where each job is a dict 
+# whose keys are the names of any of these command-line options (without the leading "--"), and whose values are paths.
+# Relative paths are interpreted relative to the directory containing the manifest file.
+batchJobOptionNames = [
+    "input_model_file",
+    "input_miraclegrue_config_file",
+    "input_miraclegrue_config_transform_file",
+    "output_annotated_miraclegrue_config_file",
+    "output_miraclegrue_config_diff_file",
+    "output_makerbot_file",
+    "output_gcode_file",
+    "output_previewable_gcode_file",
+    "output_json_toolpath_file",
+    "output_metadata_file",
+    "output_miraclegrue_log_file",
+    "output_columnar_toolpath_file",
+    "output_stats_file"
+]
+
+# returns a list of dicts, one per job, mapping the argument names of makePrintable() (i.e. the option names with "_path" appended) to resolved paths.
+def loadBatchManifest(batch_manifest_file_path):
+    batch_manifest_file_path = pathlib.Path(batch_manifest_file_path).resolve()
+    import hjson
+    manifest = hjson.load(open(batch_manifest_file_path, 'r'))
+    return [
+        resolveBatchJob(job, batch_manifest_file_path.parent, description=("job " + str(index) + " in the batch manifest " + str(batch_manifest_file_path)))
+        for index, job in enumerate(manifest)
+    ]
 
-        process = subprocess.Popen(
-            cwd=makerware_python_working_directory_path,
-            args=subprocessArgs,
-            # capture_output = True,
-            text=True,
-            stdout=subprocess.PIPE
+# checks a job (a dict in the form of a job in a batch manifest) and returns the dict of the arguments of makePrintable() that it 
+# describes, with relative paths taken relative to baseDirectory.  Raises ValueError (starting with description) if the job is invalid.
+def resolveBatchJob(job, baseDirectory, description="the job"):
+    unknownOptionNames = set(job.keys()) - set(batchJobOptionNames)
+    if unknownOptionNames:
+        raise ValueError(description + " has unrecognized options: " + ", ".join(sorted(unknownOptionNames)))
+    for requiredOptionName in ["input_model_file", "input_miraclegrue_config_file"]:
+        if not job.get(requiredOptionName):
+            raise ValueError(description + " does not specify " + requiredOptionName)
+    return {
+        optionName + "_path": pathlib.Path(baseDirectory).joinpath(job[optionName]).resolve()
+        for optionName in batchJobOptionNames
+        if job.get(optionName)
+    }
+
+# the progress sink (see progress_reporting) of the worker processes of a batch.  Rather than drawing a progress bar, it sends 
+# (jobIndex, stageName, percent) tuples to progressQueue, which the parent process reads to report per-job progress.
+# To keep the queue traffic down, it only takes an update when the progress has advanced by at least a tenth.
+class BatchJobProgressSink(progress_reporting.ProgressSink):
+    minimumInterval = 0
+    minimumIncrement = 0.1
+
+    def __init__(self, progressQueue, jobIndex):
+        self.progressQueue = progressQueue
+        self.jobIndex = jobIndex
+        # the last percent that we sent for each reporter, so that finish() does not send 100 twice.
+        self._sentPercents = {}
+
+    def update(self, reporter):
+        percent = int(reporter.progress * 100)
+        self._sentPercents[reporter] = percent
+        self.progressQueue.put((self.jobIndex, reporter.name, percent))
+
+    def finish(self, reporter):
+        if self._sentPercents.pop(reporter, None) != 100:
+            self.progressQueue.put((self.jobIndex, reporter.name, 100))
+
+# the slice cache and schema cache of a worker process, which we keep from one job to the next (so that, for instance, a schema that 
+# one job has loaded is already parsed for the next).
+@functools.lru_cache(maxsize=None)
+def getSliceCache(slice_cache_directory_path, sliceCacheMaxSize=None):
+    return slice_cache.SliceCache(directory=slice_cache_directory_path, maxSize=sliceCacheMaxSize)
+
+@functools.lru_cache(maxsize=None)
+def getSchemaCache(schema_cache_directory_path):
+    return miraclegrue_schema.SchemaCache(directory=schema_cache_directory_path)
+
+# warms up a worker process of the slicing service (see slicing_service), as it starts, by loading the config schema that its jobs will need, 
+# and compiling its config validator.
+def warmUpSlicingServiceWorker(makerware_path, schema_cache_directory_path, miraclegrueVersionNumber):
+    try:
+        schema = getSchemaCache(schema_cache_directory_path).getSchemaForExecutableOrVersion(
+            miraclegrueExecutablePath=getMakerwarePaths(makerware_path)['miraclegrue_executable'], 
+            versionNumber=miraclegrueVersionNumber
         )
+        config_validation.getConfigValidator(schema)
+    except Exception:
+        # the first job will find out what the problem is (and report it properly).
+        pass
+
+# runs one job of a batch (this is what runs in the worker processes).
+# returns a dict summarizing the outcome of the job.
+# If trace is True, the job's spans are recorded (see tracing) and returned, in the 'traceEvents' member of the summary, 
+# for the parent process to merge into its trace.
+# memoryAdmission, if given, is the memory_budget.MemoryAdmission shared by the workers (see sliceModel()).
+# configValidation is as for makePrintable().
+def runBatchJob(jobIndex, job, makerware_path, slice_cache_directory_path, sliceCacheMaxSize, schema_cache_directory_path, miraclegrueVersionNumber, progressQueue, trace=False, memoryAdmission=None, configValidation=None):
+    startTime = time.time()
+    log = io.StringIO()
+    summary = {
+        'job': jobIndex,
+        'input_model_file': str(job['input_model_file_path']),
+        'status': None,
+        'miraclegrueReturncode': None,
+        'sliceconfigReturncode': None,
+        'sliceCacheHit': None,
+        'duration': None,
+        'error': None,
+        'log': None
+    }
+    if trace:
+        tracing.enable()
+    try:
+        # the chatter that makePrintable prints is captured rather than letting the output of all the workers interleave on the console.
+        with contextlib.redirect_stdout(log), tracing.span("batch job", job=jobIndex, input_model_file=str(job['input_model_file_path'])):
+            result = makePrintable(
+                makerware_path=makerware_path,
+                sliceCache=(getSliceCache(slice_cache_directory_path, sliceCacheMaxSize) if slice_cache_directory_path else None),
+                schemaCache=(getSchemaCache(schema_cache_directory_path) if schema_cache_directory_path else None),
+                miraclegrueVersionNumber=miraclegrueVersionNumber,
+                progressBarFactory=functools.partial(progress_reporting.ProgressReporter, sink=BatchJobProgressSink(progressQueue, jobIndex)),
+                memoryAdmission=memoryAdmission,
+                configValidation=configValidation,
+                **job
+            )
+        summary.update(result)
+        summary['status'] = "ok" if all(returncode in (None, 0) for returncode in [result['miraclegrueReturncode'], result['sliceconfigReturncode']]) else "failed"
+    except (config_validation.ConfigValidationError, LookupError) as error:
+        # the errors say all there is to say (as does a missing schema); a traceback would only bury them.
+        summary['status'] = "error"
+        summary['error'] = str(error)
+    except Exception:
+        summary['status'] = "error"
+        summary['error'] = traceback.format_exc()
+    summary['duration'] = time.time() - startTime
+    summary['log'] = log.getvalue()
+    if trace:
+        summary['traceEvents'] = tracing.disable()
+    return summary
+
+def formatBatchSummaryTable(summaries):
+    columns = [
+        ("job",          lambda s: str(s['job'] + 1)),
+        ("model",        lambda s: pathlib.Path(s['input_model_file']).name),
+        ("status",       lambda s: s['status']),
+        ("cache",        lambda s: {True: "hit", False: "miss", None: "-"}[s['sliceCacheHit']]),
+        ("miracle_grue", lambda s: "-" if s['miraclegrueReturncode'] is None else str(s['miraclegrueReturncode'])),
+        ("sliceconfig",  lambda s: "-" if s['sliceconfigReturncode'] is None else str(s['sliceconfigReturncode'])),
+        ("seconds",      lambda s: "{:.1f}".format(s['duration']))
+    ]
+    rows = [[heading for heading, _ in columns]] + [[getCell(summary) for _, getCell in columns] for summary in summaries]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    return "\n".join(
+        "  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip()
+        for row in rows
+    )
 
-        progressBar = MyProgressBar("sliceconfig")
-        for line in iter(process.stdout.readline, 'b'):
-            if line:
-                #attempt to interpret line as a json expression.
-                jsonObject = None
-                try:
-                    jsonObject: dict = json.loads(line)
-                except json.decoder.JSONDecodeError as error:
-                    # sys.stdout.write(line); sys.stdout.flush()
-                    # # curiously, on some shells (for instance, the shell within notepad++ and git bash), 
-                    # # the output from this script was being accumulated in a  buffer and only dumped to stdout 
-                    # # once the process had completed.  The fix was to add the sys.stdout.flush() call above.
-                    pass
-                else:
-                    progressBar.setProgressAndUpdate(float(jsonObject.get("progress"))/100)
-            else:
-                break
-        process.wait()
-        progressBar.setProgressAndUpdate(1)
-        progressBar.finish()
-        # print("process.args: " + "\n" + indentAllLines("\n".join(process.args)))
-        print("process.returncode: " + str(process.returncode))
-
+# runs the jobs (as returned by loadBatchManifest()) in a pool of workerCount processes, printing per-job progress as the jobs run, 
+# and a summary table at the end.
+# memoryBudget, if given, is the memory (in bytes) that the slicers that run at once may use between them (see memory_budget).
+# returns the list of job summaries (see runBatchJob()), in the same order as jobs.
+def runBatch(jobs, makerware_path, workerCount=None, slice_cache_directory_path=None, sliceCacheMaxSize=None, schema_cache_directory_path=None, miraclegrueVersionNumber=None, output_batch_summary_file_path=None, memoryBudget=None, configValidation=None):
+    import concurrent.futures
+    import multiprocessing
+    summaries = [None] * len(jobs)
+    # each job is labeled with its position in the manifest and the name of its model file. 
+    getJobLabel = lambda jobIndex: "[" + str(jobIndex + 1) + "/" + str(len(jobs)) + "] " + jobs[jobIndex]['input_model_file_path'].name
+    with multiprocessing.Manager() as manager:
+        progressQueue = manager.Queue()
+        memoryAdmission = None
+        if memoryBudget:
+            memoryAdmission = memory_budget.MemoryAdmission(memoryBudget, jobCount=min(workerCount or os.cpu_count() or 1, len(jobs)), manager=manager)
+            print("memory budget: " + memory_budget.formatMemoryThreshold(memoryBudget) + ", of which each slicer gets " + memoryAdmission.getMemoryThreshold())
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workerCount) as executor:
+            futures = {
+                executor.submit(runBatchJob, jobIndex, job, makerware_path, slice_cache_directory_path, sliceCacheMaxSize, schema_cache_directory_path, miraclegrueVersionNumber, progressQueue, tracing.isEnabled(), memoryAdmission, configValidation): jobIndex
+                for jobIndex, job in enumerate(jobs)
+            }
+            pendingFutures = set(futures.keys())
+            while pendingFutures:
+                doneFutures, pendingFutures = concurrent.futures.wait(pendingFutures, timeout=0.25, return_when=concurrent.futures.FIRST_COMPLETED)
+                # a job's progress updates are all in the queue by the time its future is done, so we drain the queue before reporting
+                # the completed jobs, in order that each job's progress is printed before its outcome.
+                while not progressQueue.empty():
+                    jobIndex, stageName, percent = progressQueue.get()
+                    print(getJobLabel(jobIndex) + ": " + stageName + " " + str(percent) + "%")
+                for future in doneFutures:
+                    jobIndex = futures[future]
+                    summaries[jobIndex] = future.result()
+                    tracing.addEvents(summaries[jobIndex].pop('traceEvents', []))
+                    print(getJobLabel(jobIndex) + ": " + summaries[jobIndex]['status'] + " after " + "{:.1f}".format(summaries[jobIndex]['duration']) + " seconds")
+                    if summaries[jobIndex]['error']:
+                        print(indentAllLines(summaries[jobIndex]['error']))
+                sys.stdout.flush()
 
+    print(formatBatchSummaryTable(summaries))
+    if output_batch_summary_file_path:
+        with open(output_batch_summary_file_path, 'w') as batchSummaryFile:
+            json.dump(summaries, batchSummaryFile, indent=4)
+    return summaries
+
+# slices each of the variants of baseMiraclegrueConfig described by overridesOfEachVariant (see config_sweep.expandSweep()), running 
+# the distinct variants as a batch (see runBatch()), and prints a table of the metadata of each variant along with how it differs from the base config.
+# Each variant gets a subdirectory of sweep_output_directory_path, containing its config, metadata, miraclegrue log, and diff against the base config.
+# returns the list of rows of the table (see config_sweep.formatSweepTable()).
+def runSweep(baseMiraclegrueConfig, overridesOfEachVariant, input_model_file_path, sweep_output_directory_path, makerware_path, workerCount=None, slice_cache_directory_path=None, sliceCacheMaxSize=None, schema_cache_directory_path=None, miraclegrueVersionNumber=None, output_sweep_summary_file_path=None, memoryBudget=None, configValidation=None):
+    import config_sweep
+    import jsondiff_by_makerbot
+    variants = config_sweep.buildVariants(baseMiraclegrueConfig, overridesOfEachVariant)
+    print(
+        "the sweep has " + str(len(overridesOfEachVariant) + 1) + " variants (including the base config), " 
+        + str(len(variants)) + " of which are distinct."
+    )
+    jobs = []
+    rows = []
+    for variant in variants:
+        variantDirectory = pathlib.Path(sweep_output_directory_path).joinpath("variant_" + str(variant['variant']))
+        variantDirectory.mkdir(parents=True, exist_ok=True)
+        with open(variantDirectory.joinpath("miraclegrue_config.json"), 'w') as variantConfigFile:
+            json.dump(variant['config'], variantConfigFile, sort_keys=True, indent=4)
+        diff = jsondiff_by_makerbot.JSONDiff(baseMiraclegrueConfig, variant['config'])
+        with open(variantDirectory.joinpath("miraclegrue_config_diff.txt"), 'w') as diffFile:
+            diffFile.write(diff.pretty_str(trim_size=300))
+        jobs.append({
+            'input_model_file_path': pathlib.Path(input_model_file_path),
+            'input_miraclegrue_config_file_path': variantDirectory.joinpath("miraclegrue_config.json"),
+            'output_metadata_file_path': variantDirectory.joinpath("metadata.json"),
+            'output_miraclegrue_log_file_path': variantDirectory.joinpath("miraclegrue_log.txt")
+        })
+        rows.append({
+            'variant': variant['variant'],
+            'duplicates': variant['duplicates'],
+            'overrides': variant['overrides'],
+            'changes': config_sweep.describeConfigDiff(baseMiraclegrueConfig, variant['config']),
+            'directory': str(variantDirectory)
+        })
+
+    summaries = runBatch(
+        jobs=jobs,
+        makerware_path=makerware_path,
+        workerCount=workerCount,
+        slice_cache_directory_path=slice_cache_directory_path,
+        sliceCacheMaxSize=sliceCacheMaxSize,
+        schema_cache_directory_path=schema_cache_directory_path,
+        miraclegrueVersionNumber=miraclegrueVersionNumber,
+        memoryBudget=memoryBudget,
+        configValidation=configValidation
+    )
+    for row, job, summary in zip(rows, jobs, summaries):
+        row['status'] = summary['status']
+        try:
+            metadata = json.load(open(job['output_metadata_file_path'], 'r'))
+        except (OSError, ValueError):
+            metadata = None
+        row['metadata'] = config_sweep.getMetadataFigures(metadata)
+
+    print(config_sweep.formatSweepTable(rows))
+    if output_sweep_summary_file_path:
+        with open(output_sweep_summary_file_path, 'w') as sweepSummaryFile:
+            json.dump(rows, sweepSummaryFile, indent=4)
+    return rows
+
+
+# runs the command-line program, with the given arguments (by default, those of the process).
+def main(argv=None):
+    parser = getArgumentParser()
+    args, unknownArgs = parser.parse_known_args(argv)
+
+    # (only the modes that slice need the MakerWare folder; see the check below, after those that don't.)
+    makerware_path = (pathlib.Path(args.makerware_path[0]).resolve() if args.makerware_path and args.makerware_path[0] else None)
+    slice_cache_directory_path = (pathlib.Path(args.slice_cache_directory[0]).resolve() if args.slice_cache_directory and args.slice_cache_directory[0] else None)
+    sliceCacheMaxSize = (slice_cache.parseSize(args.slice_cache_max_size[0]) if args.slice_cache_max_size and args.slice_cache_max_size[0] else None)
+    schema_cache_directory_path = (pathlib.Path(args.schema_cache_directory[0]).resolve() if args.schema_cache_directory and args.schema_cache_directory[0] else None)
+    schemaCache = miraclegrue_schema.SchemaCache(directory=schema_cache_directory_path)
+    miraclegrueVersionNumber = (args.miraclegrue_version[0] if args.miraclegrue_version else None)
+    try:
+        layerRange = (layer_index.parseLayerRange(args.layers[0]) if args.layers else None)
+    except ValueError as error:
+        parser.error(str(error))
+    for outputFileArgument in [args.output_gcode_file, args.output_previewable_gcode_file]:
+        if outputFileArgument and outputFileArgument[0] and compressed_output.getCompressionError(outputFileArgument[0]):
+            parser.error(compressed_output.getCompressionError(outputFileArgument[0]))
+    statsAcceleration = (float(args.stats_acceleration[0]) if args.stats_acceleration else None)
+    previewableGcodeWorkerCount = ((int(args.previewable_gcode_workers[0]) or os.cpu_count()) if args.previewable_gcode_workers else None)
+    # the memory budget of the modes that run several slicers at once, and (only if it was asked for) of a single run.
+    memoryBudgetArgument = (args.memory_budget[0].strip().lower() if args.memory_budget else None)
+    try:
+        memoryBudget = (None if memoryBudgetArgument == "off" else memory_budget.parseMemoryBudget(memoryBudgetArgument or "auto"))
+    except ValueError:
+        parser.error("invalid --memory_budget: " + repr(args.memory_budget[0]))
+
+    # (None, unless it was asked for, so that a run that cannot get the schema skips the check rather than failing; see makePrintable().)
+    configValidation = (args.config_validation[0] if args.config_validation else None)
+
+    if args.progress:
+        progress_reporting.setDefaultSink(progress_reporting.makeSink(args.progress[0]))
+
+    if args.output_trace_file and args.output_trace_file[0]:
+        tracing.enable(path=pathlib.Path(args.output_trace_file[0]).resolve(), format=(args.trace_format[0] if args.trace_format else "chrome"))
+        # the trace is written out when we exit, whichever of the modes below we end up running.
+        atexit.register(tracing.disable)
+
+    if args.preload_miraclegrue_config_schema_files:
+        for schemaFile in args.preload_miraclegrue_config_schema_files:
+            print("preloaded the schema for miracle_grue version " + schemaCache.preload(pathlib.Path(schemaFile).resolve()) + " into " + str(schemaCache.directory))
+        if not (args.batch_manifest_file or args.input_model_file or args.input_miraclegrue_config_file):
+            sys.exit(0)
+
+    if args.diff_json_toolpath_files:
+        summaries = diffJsontoolpathFiles(
+            *(pathlib.Path(path).resolve() for path in args.diff_json_toolpath_files),
+            tolerance=(float(args.json_toolpath_diff_tolerance[0]) if args.json_toolpath_diff_tolerance else 1e-4),
+            output_json_toolpath_diff_file_path=(pathlib.Path(args.output_json_toolpath_diff_file[0]).resolve() if args.output_json_toolpath_diff_file and args.output_json_toolpath_diff_file[0] else None)
+        )
+        import jsontoolpath_diff
+        sys.exit(0 if all(jsontoolpath_diff.isUnchangedLayer(summary) for summary in summaries) else 1)
+
+    if args.input_toolpath_file:
+        input_toolpath_file_path = pathlib.Path(args.input_toolpath_file[0]).resolve()
+        output_previewable_gcode_file_path = (pathlib.Path(args.output_previewable_gcode_file[0]).resolve() if args.output_previewable_gcode_file and args.output_previewable_gcode_file[0] else None)
+        output_columnar_toolpath_file_path = (pathlib.Path(args.output_columnar_toolpath_file[0]).resolve() if args.output_columnar_toolpath_file and args.output_columnar_toolpath_file[0] else None)
+        output_stats_file_path = (pathlib.Path(args.output_stats_file[0]).resolve() if args.output_stats_file and args.output_stats_file[0] else None)
+        if not (output_previewable_gcode_file_path or output_columnar_toolpath_file_path or output_stats_file_path):
+            parser.error("--input_toolpath_file requires --output_previewable_gcode_file, --output_columnar_toolpath_file and/or --output_stats_file")
+        if output_columnar_toolpath_file_path:
+            if columnar_toolpath.isColumnarToolpathFile(input_toolpath_file_path):
+                parser.error("--input_toolpath_file is already a columnar toolpath file")
+            writeColumnarToolpathFile(input_toolpath_file_path, output_columnar_toolpath_file_path)
+        if output_previewable_gcode_file_path:
+            if layerRange:
+                layers = layer_index.loadLayerIndex(input_toolpath_file_path)
+                if layers is not None and layerRange[0] >= len(layers):
+                    parser.error("--layers: the toolpath has no layer " + str(layerRange[0]) + " (the last layer is " + str(len(layers) - 1) + ")")
+            # the columnar file, if we just made one, is the quicker of the two to read.
+            writePreviewableGcodeFile(
+                output_columnar_toolpath_file_path or input_toolpath_file_path, 
+                output_previewable_gcode_file_path, 
+                layerRange=layerRange, 
+                saveLayerIndex=True,
+                workerCount=previewableGcodeWorkerCount
+            )
+        if output_stats_file_path:
+            toolpathFilePath = output_columnar_toolpath_file_path or input_toolpath_file_path
+            writeToolpathStatsFile(toolpathFilePath, output_stats_file_path, acceleration=statsAcceleration, layers=layer_index.loadLayerIndex(toolpathFilePath))
+        sys.exit(0)
 
+    # the rest of the modes slice.
+    if makerware_path is None:
+        parser.error("--makerware_path is required (except with --diff_json_toolpath_files, --input_toolpath_file, or --preload_miraclegrue_config_schema_files alone)")
 
+    if args.serve:
+        import slicing_service
+        try:
+            serviceAddress = slicing_service.parseServiceAddress(args.serve[0])
+        except ValueError as error:
+            parser.error(str(error))
+        serviceSlicerCount = (int(args.service_slicers[0]) if args.service_slicers else None)
+        memoryAdmission = None
+        if memoryBudget:
+            # the record of the running slicers is shared among the workers through a manager of its own, which lives as long as we serve.
+            memoryAdmissionManager = slicing_service.startManager()
+            memoryAdmission = memory_budget.MemoryAdmission(memoryBudget, jobCount=(serviceSlicerCount or os.cpu_count() or 1), manager=memoryAdmissionManager)
+            print("memory budget: " + memory_budget.formatMemoryThreshold(memoryBudget) + ", of which each slicer gets " + memoryAdmission.getMemoryThreshold())
+        service = slicing_service.SlicingService(
+            runJob=functools.partial(
+                runBatchJob, 
+                makerware_path=makerware_path, 
+                slice_cache_directory_path=slice_cache_directory_path, 
+                sliceCacheMaxSize=sliceCacheMaxSize, 
+                schema_cache_directory_path=schemaCache.directory, 
+                miraclegrueVersionNumber=miraclegrueVersionNumber,
+                memoryAdmission=memoryAdmission,
+                configValidation=configValidation
+            ),
+            resolveJob=resolveBatchJob,
+            directory=(pathlib.Path(args.service_directory[0]).resolve() if args.service_directory and args.service_directory[0] else miraclegrue_schema.getDefaultCacheDirectory().joinpath("service")),
+            slicerCount=serviceSlicerCount,
+            maxQueueLength=(int(args.service_queue_length[0]) if args.service_queue_length else 100),
+            jobLifetime=(None if args.service_job_lifetime and args.service_job_lifetime[0] == "off" else float(args.service_job_lifetime[0]) if args.service_job_lifetime else 24*60*60),
+            maxFinishedJobs=(None if args.service_job_limit and args.service_job_limit[0] == "off" else int(args.service_job_limit[0]) if args.service_job_limit else 1000),
+            workerInitializer=warmUpSlicingServiceWorker,
+            workerInitializerArgs=(makerware_path, schemaCache.directory, miraclegrueVersionNumber)
+        )
+        service.serve(serviceAddress)
+        sys.exit(0)
+
+    if args.batch_manifest_file:
+        summaries = runBatch(
+            jobs=loadBatchManifest(args.batch_manifest_file[0]),
+            makerware_path=makerware_path,
+            workerCount=(int(args.batch_workers[0]) if args.batch_workers else None),
+            slice_cache_directory_path=slice_cache_directory_path,
+            sliceCacheMaxSize=sliceCacheMaxSize,
+            schema_cache_directory_path=schemaCache.directory,
+            miraclegrueVersionNumber=miraclegrueVersionNumber,
+            output_batch_summary_file_path=(pathlib.Path(args.output_batch_summary_file[0]).resolve() if args.output_batch_summary_file and args.output_batch_summary_file[0] else None),
+            memoryBudget=memoryBudget,
+            configValidation=configValidation
+        )
+        sys.exit(0 if all(summary['status'] == "ok" for summary in summaries) else 1)
+
+    if not (args.input_model_file and args.input_miraclegrue_config_file):
+        parser.error("the following arguments are required (unless --batch_manifest_file is given): --input_model_file, --input_miraclegrue_config_file")
+
+    if args.sweep_file:
+        import config_sweep
+        if not args.sweep_output_directory:
+            parser.error("--sweep_output_directory is required with --sweep_file")
+        rows = runSweep(
+            baseMiraclegrueConfig=loadMiraclegrueConfig(
+                input_miraclegrue_config_file_path=pathlib.Path(args.input_miraclegrue_config_file[0]).resolve(),
+                input_miraclegrue_config_transform_file_path=(pathlib.Path(args.input_miraclegrue_config_transform_file[0]).resolve() if args.input_miraclegrue_config_transform_file and args.input_miraclegrue_config_transform_file[0] else None)
+            ),
+            overridesOfEachVariant=config_sweep.loadSweep(pathlib.Path(args.sweep_file[0]).resolve()),
+            input_model_file_path=pathlib.Path(args.input_model_file[0]).resolve(),
+            sweep_output_directory_path=pathlib.Path(args.sweep_output_directory[0]).resolve(),
+            makerware_path=makerware_path,
+            workerCount=(int(args.batch_workers[0]) if args.batch_workers else None),
+            slice_cache_directory_path=slice_cache_directory_path,
+            sliceCacheMaxSize=sliceCacheMaxSize,
+            schema_cache_directory_path=schemaCache.directory,
+            miraclegrueVersionNumber=miraclegrueVersionNumber,
+            output_sweep_summary_file_path=(pathlib.Path(args.output_sweep_summary_file[0]).resolve() if args.output_sweep_summary_file and args.output_sweep_summary_file[0] else None),
+            memoryBudget=memoryBudget,
+            configValidation=configValidation
+        )
+        sys.exit(0 if all(row['status'] == "ok" for row in rows) else 1)
+
+    #resolve all of the paths passed as arguments to fully qualified paths:
+    input_model_file_path = pathlib.Path(args.input_model_file[0]).resolve()
+    output_makerbot_file_path = (pathlib.Path(args.output_makerbot_file[0]).resolve() if args.output_makerbot_file and args.output_makerbot_file[0] else None)
+    output_gcode_file_path = (pathlib.Path(args.output_gcode_file[0]).resolve() if args.output_gcode_file and args.output_gcode_file[0] else None)
+    output_previewable_gcode_file_path = (pathlib.Path(args.output_previewable_gcode_file[0]).resolve() if args.output_previewable_gcode_file and args.output_previewable_gcode_file[0] else None)
+    output_json_toolpath_file_path = (pathlib.Path(args.output_json_toolpath_file[0]).resolve() if args.output_json_toolpath_file and args.output_json_toolpath_file[0] else None)
+    output_metadata_file_path = (pathlib.Path(args.output_metadata_file[0]).resolve() if args.output_metadata_file and args.output_metadata_file[0] else None)
+    output_columnar_toolpath_file_path = (pathlib.Path(args.output_columnar_toolpath_file[0]).resolve() if args.output_columnar_toolpath_file and args.output_columnar_toolpath_file[0] else None)
+    output_stats_file_path = (pathlib.Path(args.output_stats_file[0]).resolve() if args.output_stats_file and args.output_stats_file[0] else None)
+    # input_miraclegrue_config_overrides_file_path = (pathlib.Path(args.input_miraclegrue_config_overrides_file[0]).resolve() if args.input_miraclegrue_config_overrides_file else None)
+    input_miraclegrue_config_transform_file_path = (pathlib.Path(args.input_miraclegrue_config_transform_file[0]).resolve() if args.input_miraclegrue_config_transform_file and args.input_miraclegrue_config_transform_file[0] else None)
+    output_miraclegrue_config_diff_file_path = (pathlib.Path(args.output_miraclegrue_config_diff_file[0]).resolve() if args.output_miraclegrue_config_diff_file and args.output_miraclegrue_config_diff_file[0] else None)
+    output_miraclegrue_log_file_path = (pathlib.Path(args.output_miraclegrue_log_file[0]).resolve() if args.output_miraclegrue_log_file and args.output_miraclegrue_log_file[0] else None)
+    output_annotated_miraclegrue_config_file_path = (pathlib.Path(args.output_annotated_miraclegrue_config_file[0]).resolve() if args.output_annotated_miraclegrue_config_file and args.output_annotated_miraclegrue_config_file[0] else None)
+
+    input_miraclegrue_config_file_path = pathlib.Path(args.input_miraclegrue_config_file[0]).resolve()
+
+    try:
+        with tracing.span("make_printable"):
+            makePrintable(
+                makerware_path=makerware_path,
+                input_model_file_path=input_model_file_path,
+                input_miraclegrue_config_file_path=input_miraclegrue_config_file_path,
+                input_miraclegrue_config_transform_file_path=input_miraclegrue_config_transform_file_path,
+                output_annotated_miraclegrue_config_file_path=output_annotated_miraclegrue_config_file_path,
+                output_miraclegrue_config_diff_file_path=output_miraclegrue_config_diff_file_path,
+                output_makerbot_file_path=output_makerbot_file_path,
+                output_gcode_file_path=output_gcode_file_path,
+                output_previewable_gcode_file_path=output_previewable_gcode_file_path,
+                output_json_toolpath_file_path=output_json_toolpath_file_path,
+                output_metadata_file_path=output_metadata_file_path,
+                output_miraclegrue_log_file_path=output_miraclegrue_log_file_path,
+                output_columnar_toolpath_file_path=output_columnar_toolpath_file_path,
+                output_stats_file_path=output_stats_file_path,
+                statsAcceleration=statsAcceleration,
+                sliceCache=(slice_cache.SliceCache(directory=slice_cache_directory_path, maxSize=sliceCacheMaxSize) if slice_cache_directory_path else None),
+                schemaCache=schemaCache,
+                miraclegrueVersionNumber=miraclegrueVersionNumber,
+                pipelined=args.pipelined,
+                layerRange=layerRange,
+                previewableGcodeWorkerCount=previewableGcodeWorkerCount,
+                memoryAdmission=(memory_budget.MemoryAdmission(memoryBudget) if memoryBudgetArgument and memoryBudget else None),
+                incrementalBuildStore=(incremental_build.IncrementalBuildStore(directory=pathlib.Path(args.incremental_build_directory[0]).resolve()) if args.incremental_build_directory and args.incremental_build_directory[0] else None),
+                configValidation=configValidation
+            )
+    except (config_validation.ConfigValidationError, LookupError) as error:
+        print(error, file=sys.stderr)
+        sys.exit(1)
 
 
+if __name__ == "__main__":
+    main()
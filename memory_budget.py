@@ -0,0 +1,173 @@
+import contextlib
+import itertools
+import os
+import sys
+import threading
+import time
+
+import slice_cache
+import tracing
+
+
+# Memory-aware admission control for the slicers (miracle_grue) that run at once, in a batch, a sweep or the slicing service.
+# The host budget is the memory that the slicers may use between them (by default, a fraction of the memory available when we start).
+# Each job gets an equal share of it, which we pass to miracle_grue as its --memory-threshold (beyond which miracle_grue keeps its
+# intermediate data on disk rather than in memory).  miracle_grue only tries to stay under the threshold, though, so, before we start
+# another slicer, we measure the resident memory of the slicers that are already running, and hold the new one back until its share
+# fits into what is left of the host budget.
+# The slicers run in the worker processes of a batch, so the slicers that are running are recorded in a dict shared (along with a
+# lock) through a multiprocessing manager, and any worker can measure the others' slicers (by their process ids).
+# We measure memory with /proc on Linux, and with the Win32 API on Windows.  Elsewhere, we can not measure it, so a slicer whose
+# memory we can not measure is counted as using its whole share.
+
+
+# the fraction of the available memory that the host budget is, by default.
+defaultBudgetFraction = 0.8
+# we do not give a job a share of less than this, however many jobs there are.
+minimumJobBudget = 256 << 20
+# numbers the slicers that this process admits (see MemoryAdmission.admit()).  This is kept here rather than on the MemoryAdmission,
+# which is pickled into the worker processes: pickling itertools objects is deprecated as of python 3.12, and gone in 3.14.
+_admissionCounter = itertools.count()
+
+if sys.platform == "win32":
+    import ctypes
+
+    class _MEMORYSTATUSEX(ctypes.Structure):
+        _fields_ = [
+            ('dwLength', ctypes.c_ulong),
+            ('dwMemoryLoad', ctypes.c_ulong),
+            ('ullTotalPhys', ctypes.c_ulonglong),
+            ('ullAvailPhys', ctypes.c_ulonglong),
+            ('ullTotalPageFile', ctypes.c_ulonglong),
+            ('ullAvailPageFile', ctypes.c_ulonglong),
+            ('ullTotalVirtual', ctypes.c_ulonglong),
+            ('ullAvailVirtual', ctypes.c_ulonglong),
+            ('ullAvailExtendedVirtual', ctypes.c_ulonglong),
+        ]
+
+    class _PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [
+            ('cb', ctypes.c_ulong),
+            ('PageFaultCount', ctypes.c_ulong),
+            ('PeakWorkingSetSize', ctypes.c_size_t),
+            ('WorkingSetSize', ctypes.c_size_t),
+            ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+            ('QuotaPagedPoolUsage', ctypes.c_size_t),
+            ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+            ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+            ('PagefileUsage', ctypes.c_size_t),
+            ('PeakPagefileUsage', ctypes.c_size_t),
+        ]
+
+    _PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+
+# returns the memory (in bytes) that is available for new processes, or None if we have no way to find out.
+def getAvailableMemory():
+    if sys.platform == "win32":
+        memoryStatus = _MEMORYSTATUSEX(dwLength=ctypes.sizeof(_MEMORYSTATUSEX))
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(memoryStatus)):
+            return memoryStatus.ullAvailPhys
+        return None
+    try:
+        with open("/proc/meminfo", 'r') as meminfoFile:
+            for line in meminfoFile:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+# returns the resident memory (in bytes) of the process with the given id, or None if we can not measure it (or the process has exited).
+def getProcessResidentMemory(pid):
+    if sys.platform == "win32":
+        processHandle = ctypes.windll.kernel32.OpenProcess(_PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+        if not processHandle:
+            return None
+        try:
+            counters = _PROCESS_MEMORY_COUNTERS(cb=ctypes.sizeof(_PROCESS_MEMORY_COUNTERS))
+            if ctypes.windll.psapi.GetProcessMemoryInfo(processHandle, ctypes.byref(counters), counters.cb):
+                return counters.WorkingSetSize
+            return None
+        finally:
+            ctypes.windll.kernel32.CloseHandle(processHandle)
+    try:
+        with open("/proc/" + str(pid) + "/status", 'r') as statusFile:
+            for line in statusFile:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+# formats a number of bytes as miracle_grue expects its --memory-threshold: a whole number of megabytes or gigabytes (e.g. "512m").
+def formatMemoryThreshold(size):
+    megabytes = max(int(size) >> 20, 1)
+    return (str(megabytes >> 10) + "g" if megabytes % 1024 == 0 else str(megabytes) + "m")
+
+# parses a --memory_budget: "auto" (defaultBudgetFraction of the memory available now), or a size like "12g" (see slice_cache.parseSize()).
+# returns the number of bytes, or None if the budget is "auto" and we can not measure the available memory.
+def parseMemoryBudget(budgetString):
+    if str(budgetString).strip().lower() == "auto":
+        availableMemory = getAvailableMemory()
+        return (int(availableMemory * defaultBudgetFraction) if availableMemory else None)
+    return slice_cache.parseSize(budgetString)
+
+
+class MemoryAdmission:
+    # hostBudget is the memory (in bytes) that the slicers may use between them, and jobCount the number of jobs that run at once,
+    # among which it is shared.
+    # manager, if given, is a multiprocessing manager through which to share the record of the running slicers among the worker
+    # processes (to which this object can then be passed).  Without one, the record is only shared among the threads of this process.
+    # pollInterval is how often (in seconds) a held-back job measures the running slicers again.
+    def __init__(self, hostBudget, jobCount=1, manager=None, pollInterval=0.5):
+        self.hostBudget = hostBudget
+        self.jobBudget = max(hostBudget // max(jobCount, 1), minimumJobBudget)
+        self.pollInterval = pollInterval
+        # maps a key for each admitted slicer to [the process id of the slicer (None until it has started), its share].
+        self._slicers = (manager.dict() if manager else {})
+        self._lock = (manager.Lock() if manager else threading.Lock())
+
+    def getMemoryThreshold(self):
+        return formatMemoryThreshold(self.jobBudget)
+
+    # returns the memory (in bytes) that the given slicers (in the form of self._slicers) are using, as far as we can measure it.
+    @staticmethod
+    def measureUsage(slicers):
+        usage = 0
+        for pid, share in slicers.values():
+            residentMemory = (getProcessResidentMemory(pid) if pid is not None else None)
+            usage += (residentMemory if residentMemory is not None else share)
+        return usage
+
+    # waits until there is room in the host budget for another slicer (or until no slicer is running, so that a job whose share is
+    # bigger than the whole budget still gets to run), and then admits it, for the duration of the with block.
+    # yields a function to be called with the process id of the slicer, once it has started, so that its memory can be measured.
+    @contextlib.contextmanager
+    def admit(self):
+        # the key is unique among all the processes that share the record.
+        key = str(os.getpid()) + "-" + str(next(_admissionCounter))
+        with tracing.span("memory admission", jobBudget=self.jobBudget, hostBudget=self.hostBudget) as admissionSpan:
+            startTime = time.monotonic()
+            heldBack = False
+            while True:
+                with self._lock:
+                    slicers = dict(self._slicers)
+                    usage = self.measureUsage(slicers)
+                    if not slicers or usage + self.jobBudget <= self.hostBudget:
+                        self._slicers[key] = [None, self.jobBudget]
+                        break
+                if not heldBack:
+                    heldBack = True
+                    print("holding back the slicer: the " + str(len(slicers)) + " slicers already running are using " + formatMemoryThreshold(usage) + " of the memory budget of " + formatMemoryThreshold(self.hostBudget) + ".")
+                time.sleep(self.pollInterval)
+            admissionSpan.set(waited=time.monotonic() - startTime)
+        def setProcessId(pid):
+            self._slicers[key] = [pid, self.jobBudget]
+        try:
+            yield setProcessId
+        finally:
+            with self._lock:
+                self._slicers.pop(key, None)
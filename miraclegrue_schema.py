@@ -0,0 +1,244 @@
+import hashlib
+import json
+import os
+import pathlib
+import re
+import subprocess
+import sys
+
+
+# A persistent, on-disk cache of the miracle_grue config schema (the ~100 KB of json that miracle_grue emits in response to --config-schema).
+# The schema only changes when MakerWare is upgraded, so there is no point in spawning miracle_grue and re-parsing the schema on every run.
+# The cache directory contains two kinds of entries:
+#   by_executable/<hash>.json  keyed by the path, size and mtime of the miracle_grue executable.  These are what we consult on a normal run.
+#   by_version/<version>.json  keyed by the miracle_grue version.  These let us work with the schema on a machine that does not have
+#                              miracle_grue installed at all (e.g. by preloading the schemas that we keep under research/).
+# Each entry is a json object of the form {"version": ..., "schema": ...}.
+
+
+# returns the directory where we keep persistent caches by default (LOCALAPPDATA on Windows, XDG_CACHE_HOME or ~/.cache elsewhere).
+def getDefaultCacheDirectory():
+    if sys.platform == "win32" and os.environ.get('LOCALAPPDATA'):
+        base = pathlib.Path(os.environ['LOCALAPPDATA'])
+    elif os.environ.get('XDG_CACHE_HOME'):
+        base = pathlib.Path(os.environ['XDG_CACHE_HOME'])
+    else:
+        base = pathlib.Path.home().joinpath(".cache")
+    return base.joinpath("makerbot_printable_maker")
+
+# returns the version information that miracle_grue reports in response to --version-json, as a canonical json string
+# (or as the raw text, if, for whatever reason, the output is not valid json).
+def getMiraclegrueVersion(miraclegrueExecutablePath):
+    process = subprocess.run(
+        args=[
+            str(miraclegrueExecutablePath),
+            "--version-json"
+        ],
+        capture_output = True,
+        text=True
+    )
+    try:
+        return json.dumps(json.loads(process.stdout), sort_keys=True)
+    except json.decoder.JSONDecodeError:
+        return process.stdout.strip()
+
+# extracts a plain version number (e.g. "5.31.0") from the output of getMiraclegrueVersion(), for use in file names.
+# We expect the --version-json output to be an object with a "version" member, but we fall back to the whole string.
+def getVersionNumber(miraclegrueVersion):
+    try:
+        versionObject = json.loads(miraclegrueVersion)
+    except (json.decoder.JSONDecodeError, TypeError):
+        versionObject = None
+    versionNumber = versionObject.get('version') if isinstance(versionObject, dict) and versionObject.get('version') else miraclegrueVersion
+    return re.sub(r'[^\w.\-]', '_', str(versionNumber).strip())
+
+# returns the config schema that miracle_grue reports in response to --config-schema.
+# raises LookupError if miracle_grue fails, or does not give us a schema.
+def fetchMiraclegrueConfigSchema(miraclegrueExecutablePath):
+    process = subprocess.run(
+        args=[
+            str(miraclegrueExecutablePath),
+            "--config-schema"
+        ],
+        capture_output = True,
+        text=True
+    )
+    if process.returncode != 0:
+        raise LookupError(
+            "miracle_grue (" + str(miraclegrueExecutablePath) + ") failed to report its config schema (--config-schema exited with code " + str(process.returncode) + ")"
+            + (": " + process.stderr.strip().splitlines()[-1] if process.stderr.strip() else ".")
+        )
+    try:
+        return json.loads(process.stdout)
+    except json.decoder.JSONDecodeError as error:
+        raise LookupError("miracle_grue (" + str(miraclegrueExecutablePath) + ") reported a config schema that is not valid json (" + str(error) + ").")
+
+
+class SchemaCache:
+    # the schema files that we keep under research/ are named like this.
+    schemaFileNamePattern = re.compile(r'^miracle_grue_(?P<version>.+)_config_schema\.json$')
+
+    def __init__(self, directory=None):
+        self.directory = pathlib.Path(directory or getDefaultCacheDirectory().joinpath("schemas")).resolve()
+        self.byExecutableDirectory = self.directory.joinpath("by_executable")
+        self.byVersionDirectory = self.directory.joinpath("by_version")
+        # parsed entries, so that asking for the same schema more than once within a process does not even touch the disk.
+        self._loadedEntries = {}
+
+    def getExecutableKey(self, miraclegrueExecutablePath):
+        miraclegrueExecutablePath = pathlib.Path(miraclegrueExecutablePath).resolve()
+        stat = miraclegrueExecutablePath.stat()
+        return hashlib.sha256("\n".join([str(miraclegrueExecutablePath), str(stat.st_size), str(stat.st_mtime_ns)]).encode('utf-8')).hexdigest()
+
+    # returns the {"version": ..., "schema": ...} entry for the given miracle_grue executable, running miracle_grue only if
+    # we do not already have an entry for this exact executable.
+    def getEntry(self, miraclegrueExecutablePath):
+        entryPath = self.byExecutableDirectory.joinpath(self.getExecutableKey(miraclegrueExecutablePath) + ".json")
+        entry = self._loadEntry(entryPath)
+        if entry is None:
+            entry = {
+                'version': getMiraclegrueVersion(miraclegrueExecutablePath),
+                'schema': fetchMiraclegrueConfigSchema(miraclegrueExecutablePath)
+            }
+            self._storeEntry(entryPath, entry)
+            self._storeEntry(self.byVersionDirectory.joinpath(getVersionNumber(entry['version']) + ".json"), entry)
+        return entry
+
+    def getSchema(self, miraclegrueExecutablePath):
+        return self.getEntry(miraclegrueExecutablePath)['schema']
+
+    # returns the schema for the given version (e.g. "5.31.0"), or None if we do not have it.
+    def getSchemaForVersion(self, versionNumber):
+        entry = self._loadEntry(self.byVersionDirectory.joinpath(getVersionNumber(versionNumber) + ".json"))
+        return entry and entry['schema']
+
+    def getAvailableVersions(self):
+        if not self.byVersionDirectory.is_dir():
+            return []
+        return sorted(path.stem for path in self.byVersionDirectory.glob("*.json"))
+
+    # adds a schema file (like the ones under research/) to the cache.  If versionNumber is not given, we take it from the file name.
+    # returns the version number under which the schema was stored.
+    def preload(self, schemaFilePath, versionNumber=None):
+        schemaFilePath = pathlib.Path(schemaFilePath)
+        if not versionNumber:
+            match = self.schemaFileNamePattern.match(schemaFilePath.name)
+            if not match:
+                raise ValueError("cannot determine the miracle_grue version of the schema file " + str(schemaFilePath) + " from its name (expected a name like miracle_grue_5.31.0_config_schema.json).")
+            versionNumber = match.group('version')
+        versionNumber = getVersionNumber(versionNumber)
+        self._storeEntry(
+            self.byVersionDirectory.joinpath(versionNumber + ".json"),
+            {'version': versionNumber, 'schema': json.load(open(schemaFilePath, 'r'))}
+        )
+        return versionNumber
+
+    # returns the schema, either for the given executable (if it exists) or, failing that, for the given version number.
+    def getSchemaForExecutableOrVersion(self, miraclegrueExecutablePath=None, versionNumber=None):
+        if versionNumber:
+            schema = self.getSchemaForVersion(versionNumber)
+            if schema is None:
+                raise LookupError("the schema cache in " + str(self.directory) + " has no schema for miracle_grue version " + str(versionNumber) + " (available versions: " + (", ".join(self.getAvailableVersions()) or "none") + ").")
+            return schema
+        if miraclegrueExecutablePath and pathlib.Path(miraclegrueExecutablePath).is_file():
+            return self.getSchema(miraclegrueExecutablePath)
+        raise LookupError("miracle_grue was not found at " + str(miraclegrueExecutablePath) + ", so a miracle_grue version must be specified in order to use a cached schema (available versions: " + (", ".join(self.getAvailableVersions()) or "none") + ").")
+
+    def _loadEntry(self, entryPath):
+        entry = self._loadedEntries.get(entryPath)
+        if entry is None:
+            try:
+                entry = json.load(open(entryPath, 'r'))
+            except (OSError, ValueError):
+                return None
+            self._loadedEntries[entryPath] = entry
+        return entry
+
+    def _storeEntry(self, entryPath, entry):
+        import tempfile
+        entryPath.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(mode='w', dir=entryPath.parent, prefix="." + entryPath.name + ".", delete=False) as temporaryFile:
+            json.dump(entry, temporaryFile)
+        os.replace(temporaryFile.name, entryPath)
+        self._loadedEntries[entryPath] = entry
+
+
+# A one-time index over a config schema, so that resolving the schemed type of a config entry does not involve re-walking 
+# the path from the root and linearly searching the members of each aggregate type along the way (which, when annotating
+# a whole config, made the cost roughly quadratic in depth times member count).
+# The schema is a dict mapping type names to type specs.  A type spec is either an "aggregate" (with a list of members, each of
+# which has an 'id' and a 'type'), or has a 'json_type' of "object" or "array" (with a 'value_type' or 'element_type', respectively).
+# The type of the config as a whole is '__top__'.
+class SchemaIndex:
+    def __init__(self, schema):
+        self.schema = schema
+        # type name -> member id -> member spec (for aggregate types).  As with the linear search that this replaces, the first
+        # member having a given id wins.
+        self.memberSpecs = {}
+        # type name -> the type name of the children (for object and array types).
+        self.childTypeNames = {}
+        for typeName, schemedType in schema.items():
+            if not isinstance(schemedType, dict):
+                continue
+            if schemedType.get('mode') == "aggregate":
+                memberSpecsById = {}
+                for memberSpec in schemedType.get('members', []):
+                    memberSpecsById.setdefault(memberSpec['id'], memberSpec)
+                self.memberSpecs[typeName] = memberSpecsById
+            elif schemedType.get('json_type') == "object":
+                self.childTypeNames[typeName] = schemedType.get('value_type')
+            elif schemedType.get('json_type') == "array":
+                self.childTypeNames[typeName] = schemedType.get('element_type')
+        # tuple(path) -> type name, filled in as paths are looked up, so that each lookup costs one step beyond its (already resolved) parent.
+        self._typeNamesByPath = {(): '__top__'}
+
+    # path is expected to be a list (or tuple) of keys.
+    # returns the name of the schemed type of the entry at path, or None if the schema does not say.
+    def getSchemedTypeName(self, path):
+        path = tuple(path)
+        try:
+            return self._typeNamesByPath[path]
+        except KeyError:
+            pass
+        typeName = None
+        parentTypeName = self.getSchemedTypeName(path[:-1])
+        if parentTypeName in self.schema:
+            if parentTypeName in self.memberSpecs:
+                memberSpec = self.memberSpecs[parentTypeName].get(path[-1])
+                if memberSpec:
+                    typeName = memberSpec['type']
+            else:
+                typeName = self.childTypeNames.get(parentTypeName)
+        self._typeNamesByPath[path] = typeName
+        return typeName
+
+    def getSchemedType(self, path):
+        schemedTypeName = self.getSchemedTypeName(path)
+        if schemedTypeName:
+            return self.schema.get(schemedTypeName)
+        return None
+
+    # returns (isMemberOfAggregate, memberSpec) for the entry at path: isMemberOfAggregate is True if the parent of the entry is 
+    # of an aggregate type, in which case memberSpec is the spec of the member (or None if the schema has no such member).
+    def getMemberSpec(self, path):
+        parentTypeName = self.getSchemedTypeName(path[:-1])
+        memberSpecsById = self.memberSpecs.get(parentTypeName) if parentTypeName in self.schema else None
+        if memberSpecsById is None:
+            return False, None
+        return True, memberSpecsById.get(path[-1])
+
+    def getMemberIds(self, schemedTypeName):
+        memberSpecsById = self.memberSpecs.get(schemedTypeName)
+        return list(memberSpecsById.keys()) if memberSpecsById is not None else None
+
+
+_schemaIndexes = {}
+
+# returns the SchemaIndex for schema, building it the first time that we see a given schema object.
+def getSchemaIndex(schema):
+    # we hold on to the schema along with its index so that the id cannot be recycled for a different object.
+    cachedSchema, schemaIndex = _schemaIndexes.get(id(schema), (None, None))
+    if cachedSchema is not schema:
+        schemaIndex = SchemaIndex(schema)
+        _schemaIndexes[id(schema)] = (schema, schemaIndex)
+    return schemaIndex
@@ -0,0 +1,192 @@
+import collections
+import datetime
+import functools
+import json
+import math
+import sys
+import threading
+import time
+
+
+# Progress reporting for the stages of a run.  Each stage gets a ProgressReporter, to which it passes its completion ratio as often
+# as it likes (the conversion loops do so every few items); the reporter throttles the updates, by time and by change in progress, and
+# passes the ones that get through to a sink, which is what actually shows them:
+#   TtyProgressSink        draws a progress bar (with the progress library), for when stderr is a terminal.
+#   JsonLinesProgressSink  writes a json object per update, one per line, for when stderr is not a terminal (a log file, a CI job, or
+#                          a program driving us), where the control codes of a progress bar would just be garbage.
+#   NullProgressSink       shows nothing.
+# The sink also sets the throttling: its minimumInterval (seconds) and minimumIncrement (a fraction of the whole) are how much time must
+# have passed, and how far the progress must have advanced, since the last update that the sink was given, before it is given another.
+# An update that does not get through costs a comparison or two, so the throttled reporter is cheap enough to call on every item.
+
+
+class ProgressSink:
+    minimumInterval = 0.1
+    minimumIncrement = 0.001
+
+    # called with a ProgressReporter, when an update of it gets through the throttling.
+    def update(self, reporter):
+        pass
+
+    # called with a ProgressReporter, when its stage is done.
+    def finish(self, reporter):
+        pass
+
+class NullProgressSink(ProgressSink):
+    minimumInterval = math.inf
+    minimumIncrement = math.inf
+
+# This progress bar library is deficient in that it does not make any effort to output any sort of progress indicator in the case where the
+# terminal is not a tty (i.e. in the case where the terminal does not support terminal control codes), which is why, for a terminal
+# that is not a tty, we use a JsonLinesProgressSink instead.  Having chosen a TtyProgressSink, though (perhaps explicitly), we want
+# the bar drawn, so we disable the library's own tty check.
+class _ProgressBarMixin:
+    check_tty = False
+    hide_cursor = False
+    suffix='%(percent)d%% - %(elapsed_td)s/%(estimatedTotalDuration_td)s'
+    @property
+    def estimatedTotalDuration(self):
+        try:
+            return int(math.ceil(1/self.progress * self.elapsed))
+        except ZeroDivisionError:
+            return 0
+    @property
+    def estimatedTotalDuration_td(self):
+        return datetime.timedelta(seconds=self.estimatedTotalDuration)
+
+    def setProgress(self, newValue):
+        self.index = newValue * self.max
+
+    # overriding the original clearln() definition so as to only emit a carriage return (rather than also erasing the line, which the
+    # new bar, being at least as long, overwrites anyway).
+    def clearln(self):
+        if self.file and self.is_tty():
+            print('\r', end='', file=self.file)
+
+# the progress bar class, which we make (importing the progress library) when we draw the first progress bar.
+@functools.lru_cache(maxsize=None)
+def _getProgressBarClass():
+    import progress.bar
+    return type("ProgressBar", (_ProgressBarMixin, progress.bar.Bar), {})
+
+class TtyProgressSink(ProgressSink):
+    def __init__(self):
+        # the progress bar of each reporter that we are showing.
+        self._bars = {}
+
+    def update(self, reporter):
+        bar = self._bars.get(reporter)
+        if bar is None:
+            bar = self._bars[reporter] = _getProgressBarClass()(reporter.name)
+        bar.setProgress(reporter.progress)
+        bar.update()
+
+    def finish(self, reporter):
+        self.update(reporter)
+        self._bars.pop(reporter).finish()
+
+class JsonLinesProgressSink(ProgressSink):
+    minimumInterval = 1.0
+    minimumIncrement = 0.01
+
+    # file is the writable text file to which to write the updates (by default, whatever sys.stderr is at the time).
+    def __init__(self, file=None):
+        self.file = file
+        self._lock = threading.Lock()
+
+    def _write(self, reporter, **extraMembers):
+        line = json.dumps({'stage': reporter.name, 'progress': round(reporter.progress, 4), 'elapsed': round(reporter.elapsed, 3), **extraMembers})
+        file = self.file or sys.stderr
+        with self._lock:
+            file.write(line + "\n")
+            file.flush()
+
+    def update(self, reporter):
+        self._write(reporter)
+
+    def finish(self, reporter):
+        self._write(reporter, finished=True)
+
+sinkKinds = ["auto", "bar", "json", "none"]
+
+# returns a new sink of the given kind (one of sinkKinds), where "auto" means a TtyProgressSink if stderr is a terminal, and
+# a JsonLinesProgressSink otherwise.
+def makeSink(kind="auto"):
+    if kind == "auto":
+        kind = ("bar" if sys.stderr.isatty() else "json")
+    if kind == "bar":
+        return TtyProgressSink()
+    if kind == "json":
+        return JsonLinesProgressSink()
+    if kind == "none":
+        return NullProgressSink()
+    raise ValueError("unknown progress sink " + repr(kind) + " (expected one of " + ", ".join(sinkKinds) + ")")
+
+_defaultSink = None
+
+# returns the sink to which the reporters go unless they are given another (made with makeSink("auto") when first asked for, unless
+# setDefaultSink() has been called).
+def getDefaultSink():
+    global _defaultSink
+    if _defaultSink is None:
+        _defaultSink = makeSink("auto")
+    return _defaultSink
+
+def setDefaultSink(sink):
+    global _defaultSink
+    _defaultSink = sink
+
+
+class ProgressReporter:
+    # name is the name of the stage, and sink the ProgressSink to which to pass the updates (by default, getDefaultSink()).
+    def __init__(self, name, sink=None):
+        self.name = name
+        self.sink = sink or getDefaultSink()
+        self.progress = 0.0
+        self.startTime = time.monotonic()
+        self.finished = False
+        # the progress and the time that an update must reach in order to get through to the sink.  The first update always gets through.
+        self._nextProgress = -math.inf
+        self._nextTime = -math.inf
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.startTime
+
+    # newValue is the completion ratio (from 0 to 1).
+    def setProgressAndUpdate(self, newValue):
+        self.progress = newValue
+        if newValue < self._nextProgress:
+            return
+        now = time.monotonic()
+        if now < self._nextTime:
+            return
+        self._nextProgress = newValue + self.sink.minimumIncrement
+        self._nextTime = now + self.sink.minimumInterval
+        self.sink.update(self)
+
+    def finish(self):
+        if not self.finished:
+            self.finished = True
+            self.sink.finish(self)
+
+
+# starts a (daemon) thread that reads lines from pipe (a readable text-mode file, such as the stdout or stderr of a subprocess) until
+# the end of the file, calling handleLine with each, so that the process never stalls on a full pipe, whatever we are doing meanwhile.
+# returns the thread, which the caller should join() once the process has exited.
+def startDrainingPipe(pipe, handleLine, name="pipe reader"):
+    def drain():
+        with pipe:
+            for line in pipe:
+                handleLine(line)
+    thread = threading.Thread(target=drain, name=name, daemon=True)
+    thread.start()
+    return thread
+
+# a handleLine for startDrainingPipe() that keeps the last maxLength lines (in .lines), for reporting when the process fails.
+class LineTail:
+    def __init__(self, maxLength=50):
+        self.lines = collections.deque(maxlen=maxLength)
+
+    def __call__(self, line):
+        self.lines.append(line.rstrip("\r\n"))
@@ -0,0 +1,212 @@
+import hashlib
+import json
+import os
+import pathlib
+import sys
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows, where we do without reflinks.
+    fcntl = None
+
+
+# A local, content-addressed, on-disk cache of the outputs of miracle_grue (the jsontoolpath, the gcode, and the metadata).
+# An entry is keyed by a hash of everything that determines what miracle_grue will produce:
+#   - the bytes of the model file
+#   - the canonical json of the miracle_grue config (i.e. the config file exactly as we hand it to miracle_grue)
+#   - the miracle_grue version (as reported by miracle_grue --version-json)
+# Each entry is a directory (named by the key) containing one file per slice output.  We bump the mtime of
+# the entry directory whenever the entry is used, and, when the cache grows beyond maxSize bytes, we evict
+# the least-recently-used entries.
+
+
+# parses a size like "500m", "10g", "1024k" or "123456" (bytes) into a number of bytes.
+def parseSize(sizeString):
+    sizeString = str(sizeString).strip().lower()
+    multipliers = {'k': 1<<10, 'm': 1<<20, 'g': 1<<30, 't': 1<<40}
+    if sizeString and sizeString[-1] in multipliers:
+        return int(float(sizeString[:-1]) * multipliers[sizeString[-1]])
+    return int(sizeString)
+
+def hashFile(path, hasher=None, chunkSize=1<<20):
+    hasher = hasher or hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunkSize), b''):
+            hasher.update(chunk)
+    return hasher
+
+# the ioctl request by which Linux clones a file (on file systems that support it, such as btrfs and xfs).
+_FICLONE = 0x40049409
+
+# makes destination a copy-on-write clone of source, if the platform and file system support that.  returns True if it worked.
+def reflinkFile(source, destination):
+    if fcntl is None or not sys.platform.startswith('linux'):
+        return False
+    with open(source, 'rb') as sourceFile, open(destination, 'wb') as destinationFile:
+        try:
+            fcntl.ioctl(destinationFile.fileno(), _FICLONE, sourceFile.fileno())
+            return True
+        except OSError:
+            pass
+    os.remove(destination)
+    return False
+
+# makes destination have the same content as source as cheaply as we can: with a reflink, failing that by copying.  Whatever was at 
+# destination is replaced.
+# returns the method used: "reflink" or "copy".
+# We do not hard link, even though that would often be the only way to avoid the copy: a hard-linked destination would share its content
+# with source, so that writing to one in place (as an editor, or a tool that appends to a file, might well do to an output file) would 
+# silently change the other, and with it every later hit on the slice cache entry.  A reflink is copy-on-write, so the two are independent.
+def linkOrCopyFile(source, destination):
+    try:
+        os.remove(destination)
+    except FileNotFoundError:
+        pass
+    if reflinkFile(source, destination):
+        return "reflink"
+    import shutil
+    shutil.copyfile(source, destination)
+    return "copy"
+
+
+class SliceCache:
+    # the names of the slice outputs that we know how to cache.  These match the keys of tempFilePaths in make_printable.py.
+    outputNames = ["jsontoolpath", "gcode", "metadata"]
+    statsFileName = "stats.json"
+    entriesDirectoryName = "entries"
+
+    def __init__(self, directory, maxSize=None):
+        self.directory = pathlib.Path(directory).resolve()
+        self.entriesDirectory = self.directory.joinpath(self.entriesDirectoryName)
+        self.entriesDirectory.mkdir(parents=True, exist_ok=True)
+        self.maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # the number of bytes that we stored by reflinking rather than copying (see linkOrCopyFile()).
+        self.bytesLinked = 0
+
+    # modelFilePath and configFilePath are paths of files; miraclegrueVersion is a string.
+    # The hash covers each component's length as well as its content so that the boundaries between components are unambiguous.
+    def computeKey(self, modelFilePath, configFilePath, miraclegrueVersion):
+        hasher = hashlib.sha256()
+        for component in [hashFile(modelFilePath).digest(), hashFile(configFilePath).digest(), str(miraclegrueVersion).encode('utf-8')]:
+            hasher.update(str(len(component)).encode('ascii') + b':' + component)
+        return hasher.hexdigest()
+
+    def getEntryDirectory(self, key):
+        return self.entriesDirectory.joinpath(key)
+
+    # returns a dict mapping each of the wantedOutputNames to the path of the cached file, or None if
+    # the cache does not have all of the wanted outputs for this key.
+    def lookup(self, key, wantedOutputNames):
+        entryDirectory = self.getEntryDirectory(key)
+        cachedPaths = {name: entryDirectory.joinpath(name) for name in wantedOutputNames}
+        if entryDirectory.is_dir() and all(path.is_file() for path in cachedPaths.values()) and not self.hasSharedFiles(cachedPaths.values()):
+            self.hits += 1
+            self._touch(entryDirectory)
+            self._recordStats(hits=1)
+            return cachedPaths
+        self.misses += 1
+        self._recordStats(misses=1)
+        return None
+
+    # returns True if any of paths (files of an entry) is hard linked elsewhere, as earlier versions linked the outputs into the cache and
+    # back out again.  Such an entry can not be trusted, since the other link (an output file) might have been written to in place.
+    def hasSharedFiles(self, paths):
+        return any(path.stat().st_nlink > 1 for path in paths)
+
+    # outputPaths is a dict mapping output names (elements of outputNames) to paths of freshly produced slice outputs.
+    # The files are copied into the entry for key (merging with whatever outputs the entry might already hold),
+    # and then the cache is trimmed down to maxSize.
+    # returns a dict mapping each output name to the path of the cached copy.
+    def store(self, key, outputPaths):
+        import tempfile
+        entryDirectory = self.getEntryDirectory(key)
+        entryDirectory.mkdir(exist_ok=True)
+        cachedPaths = {}
+        for name, path in outputPaths.items():
+            if name not in self.outputNames:
+                raise ValueError("SliceCache does not know how to cache an output named " + repr(name))
+            cachedPath = entryDirectory.joinpath(name)
+            # reflink (or copy) to a temporary name within the entry directory, then rename into place, so that a
+            # concurrent reader never sees a partially-written file.
+            with tempfile.NamedTemporaryFile(dir=entryDirectory, prefix="." + name + ".", delete=False) as temporaryFile:
+                temporaryPath = pathlib.Path(temporaryFile.name)
+            if linkOrCopyFile(path, temporaryPath) != "copy":
+                self.bytesLinked += temporaryPath.stat().st_size
+            os.replace(temporaryPath, cachedPath)
+            cachedPaths[name] = cachedPath
+        self._touch(entryDirectory)
+        self.evict(keep=key)
+        return cachedPaths
+
+    def getEntries(self):
+        entries = []
+        for entryDirectory in self.entriesDirectory.iterdir():
+            if not entryDirectory.is_dir():
+                continue
+            size = sum(path.stat().st_size for path in entryDirectory.iterdir() if path.is_file())
+            entries.append({'key': entryDirectory.name, 'lastUsed': entryDirectory.stat().st_mtime, 'size': size})
+        return entries
+
+    def getSize(self):
+        return sum(entry['size'] for entry in self.getEntries())
+
+    # removes least-recently-used entries until the total size of the cache is no more than maxSize.
+    # keep, if given, is the key of an entry that is not to be evicted (typically, the entry we just stored).
+    def evict(self, keep=None):
+        if self.maxSize is None:
+            return
+        import shutil
+        entries = sorted(self.getEntries(), key=lambda entry: entry['lastUsed'])
+        totalSize = sum(entry['size'] for entry in entries)
+        evictions = 0
+        for entry in entries:
+            if totalSize <= self.maxSize:
+                break
+            if entry['key'] == keep:
+                continue
+            shutil.rmtree(self.getEntryDirectory(entry['key']), ignore_errors=True)
+            totalSize -= entry['size']
+            evictions += 1
+        if evictions:
+            self.evictions += evictions
+            self._recordStats(evictions=evictions)
+
+    # returns the hit/miss counts accumulated over the lifetime of the cache directory, along with the counts for this session.
+    def getStats(self):
+        stats = self._loadStats()
+        entries = self.getEntries()
+        stats.update({
+            'sessionHits': self.hits,
+            'sessionMisses': self.misses,
+            'sessionEvictions': self.evictions,
+            'entries': len(entries),
+            'size': sum(entry['size'] for entry in entries),
+            'maxSize': self.maxSize
+        })
+        return stats
+
+    def _touch(self, entryDirectory):
+        now = time.time()
+        os.utime(entryDirectory, (now, now))
+
+    def _loadStats(self):
+        try:
+            stats = json.load(open(self.directory.joinpath(self.statsFileName), 'r'))
+        except (OSError, ValueError):
+            stats = {}
+        return {key: stats.get(key, 0) for key in ['hits', 'misses', 'evictions']}
+
+    def _recordStats(self, hits=0, misses=0, evictions=0):
+        import tempfile
+        stats = self._loadStats()
+        stats['hits'] += hits
+        stats['misses'] += misses
+        stats['evictions'] += evictions
+        with tempfile.NamedTemporaryFile(mode='w', dir=self.directory, prefix="." + self.statsFileName + ".", delete=False) as temporaryFile:
+            json.dump(stats, temporaryFile, indent=4)
+        os.replace(temporaryFile.name, self.directory.joinpath(self.statsFileName))
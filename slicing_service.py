@@ -0,0 +1,454 @@
+import collections
+import concurrent.futures
+import http.server
+import ipaddress
+import json
+import multiprocessing
+import multiprocessing.managers
+import os
+import pathlib
+import re
+import shutil
+import signal
+import socket
+import socketserver
+import threading
+import time
+import urllib.parse
+
+
+# A long-running slicing service, for a frontend (e.g. that of a print farm) that sends jobs in bursts, so that each job does not pay for
+# starting the interpreter, importing our dependencies and loading the config schema.
+# The service runs the jobs on a pool of worker processes (each of which runs one job at a time, including the miracle_grue and
+# sliceconfig processes of the job), which stay up between jobs and keep their caches warm (see getSliceCache(), getSchemaCache() and
+# compileMiraclegrueConfigTransform() in make_printable.py).  Jobs beyond the number of workers wait in a queue, of bounded length: a job
+# submitted while the queue is full is refused (with status 503), so that the frontend can back off.
+#
+# The service speaks HTTP, either on a localhost port or on a Unix domain socket (see parseServiceAddress()):
+#   POST /jobs                           submits a job, given as a json object (with Content-Type application/json) in the form of a job
+#                                        in a batch manifest (see loadBatchManifest() in make_printable.py), where relative paths are taken
+#                                        relative to a directory of the job's own, under the service directory.  Responds (with status 202)
+#                                        with the job's status (see below), including its 'id'.
+#   GET  /jobs                           responds with the status of every job.
+#   GET  /jobs/<id>                      responds with the status of a job.
+#   GET  /jobs/<id>/progress             streams the progress of a job, as json objects, one per line: {'stage': ..., 'percent': ...}
+#                                        for each update (starting with those already made), then the job's final status, once it is finished.
+#   GET  /jobs/<id>/artifacts/<option>   responds with the contents of one of the job's outputs (named by its option, e.g. "output_makerbot_file").
+#   GET  /status                         responds with the number of running and queued jobs, and the limits.
+# The status of a job is a json object with its 'id', 'status' ("queued", "running", "ok", "failed" or "error"), the 'submitted',
+# 'started' and 'finished' times, the 'job' itself (with the paths resolved), the latest 'progress' of each stage, the 'artifacts'
+# that can be fetched, and, once the job is finished, the 'summary' of the job (as for a batch job).
+# A finished job (its status, and its directory, outputs and all) is kept for a while, so that the frontend can fetch its outputs, and
+# then forgotten: once it has been finished for longer than the job lifetime, or once there are more finished jobs than the job limit
+# (the oldest first).  The directories of the jobs of an earlier run of the service are removed when it starts.
+# Since anyone who can reach the service can have it read and write files, the service only listens on the loopback interface (or a
+# Unix domain socket), and keeps each job to its own directory: a job's outputs must be within the job's directory, and its inputs
+# within the job's directory or the service's inputs directory ("inputs", under the service directory, where the frontend can put
+# the models and configs that it means to slice).  Only the outputs that a job wrote, and only once it has succeeded, can be fetched.
+
+
+# parses the address at which to serve: "unix:<path>" for a Unix domain socket, or "[<host>:]<port>" for a TCP port (on localhost, by default).
+# returns a (family, address) tuple, where family is "unix" or "tcp".
+# The service does no authentication, so we refuse a host that is not a loopback address (or a name that resolves only to loopback
+# addresses), which would expose it to the network.
+def parseServiceAddress(text):
+    if text.startswith("unix:"):
+        return "unix", text[len("unix:"):]
+    match = re.fullmatch(r'(?:(?P<host>[^:]+):)?(?P<port>\d+)', text.strip())
+    if not match:
+        raise ValueError("cannot parse the service address " + repr(text) + " (expected something like \"8765\", \"localhost:8765\" or \"unix:/tmp/make_printable.sock\").")
+    host = match.group('host') or "localhost"
+    if not isLoopbackHost(host):
+        raise ValueError("the service address " + repr(text) + " is not on the loopback interface.  The service has no authentication, so it only listens on localhost (or a Unix domain socket).")
+    return "tcp", (host, int(match.group('port')))
+
+def isLoopbackHost(host):
+    try:
+        addresses = [ipaddress.ip_address(host)]
+    except ValueError:
+        try:
+            addresses = [ipaddress.ip_address(info[4][0]) for info in socket.getaddrinfo(host, None)]
+        except (socket.gaierror, ValueError):
+            return False
+    return bool(addresses) and all(address.is_loopback for address in addresses)
+
+# returns True if path (a resolved path) is directory or within it.
+def _isWithin(path, directory):
+    return path == directory or directory in path.parents
+
+
+# (this is installed, as they start, in the worker processes and the manager processes of the service) does nothing about a Ctrl-C or a
+# SIGTERM, which, when it goes to the whole process group (as with systemctl stop), would otherwise kill them out from under the main
+# process (each with a traceback) before it can shut them down in an orderly way (see serve() and close()).
+# A handler that does nothing, rather than SIG_IGN, since the slicers that the workers launch would inherit SIG_IGN, and outlive us.
+def _ignoreShutdownSignal(signalNumber, frame):
+    pass
+
+def _ignoreShutdownSignals():
+    signal.signal(signal.SIGINT, _ignoreShutdownSignal)
+    signal.signal(signal.SIGTERM, _ignoreShutdownSignal)
+
+def _initializeWorker(workerInitializer, workerInitializerArgs):
+    _ignoreShutdownSignals()
+    if workerInitializer:
+        workerInitializer(*workerInitializerArgs)
+
+# returns a started multiprocessing manager (like multiprocessing.Manager() does) that leaves shutting down to the main process.
+def startManager():
+    manager = multiprocessing.managers.SyncManager()
+    manager.start(_ignoreShutdownSignals)
+    return manager
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class SlicingService:
+    # runJob is the function that runs a job in a worker process, which is called as runJob(jobId, job, progressQueue=progressQueue),
+    # and which is expected to put (jobId, stageName, percent) tuples to progressQueue as the job progresses, and to return a
+    # json-serializable summary of the job, with a 'status' member (see runBatchJob() in make_printable.py).
+    # resolveJob is called as resolveJob(jobDescription, jobDirectory) to validate a submitted job and resolve its paths, and is expected
+    # to raise ValueError for an invalid job.
+    # workerInitializer, if given, is called (with workerInitializerArgs) in each worker process, as it starts, to warm it up.
+    # jobLifetime (in seconds) and maxFinishedJobs are the job lifetime and the job limit (see above); either may be None, for no limit.
+    def __init__(self, runJob, resolveJob, directory, slicerCount=None, maxQueueLength=100, workerInitializer=None, workerInitializerArgs=(), jobLifetime=24*60*60, maxFinishedJobs=1000):
+        self.runJob = runJob
+        self.resolveJob = resolveJob
+        self.directory = pathlib.Path(directory).resolve()
+        self.inputsDirectory = self.directory.joinpath("inputs")
+        self.inputsDirectory.mkdir(parents=True, exist_ok=True)
+        # we number the jobs from 1 again, so the directories of the jobs of an earlier run are of no use to anyone.
+        shutil.rmtree(self.directory.joinpath("jobs"), ignore_errors=True)
+        self.slicerCount = slicerCount or os.cpu_count() or 1
+        self.maxQueueLength = maxQueueLength
+        self.jobLifetime = jobLifetime
+        self.maxFinishedJobs = maxFinishedJobs
+        self._jobs = {}
+        self._lastJobId = 0
+        # the ids of the finished jobs, in the order that they finished.
+        self._finishedJobIds = collections.deque()
+        self._queuedJobIds = collections.deque()
+        self._runningCount = 0
+        # guards the jobs and the queue, and is notified whenever a job makes progress or changes status.
+        self._condition = threading.Condition()
+        self._manager = startManager()
+        self._progressQueue = self._manager.Queue()
+        self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.slicerCount, initializer=_initializeWorker, initargs=(workerInitializer, workerInitializerArgs))
+        # we get the worker processes going now, rather than with the first job.
+        self._executor.submit(int).result()
+        self._progressThread = threading.Thread(target=self._recordProgress, name="job progress", daemon=True)
+        self._progressThread.start()
+        self._closed = False
+        self._retentionThread = threading.Thread(target=self._forgetExpiredJobs, name="job retention", daemon=True)
+        self._retentionThread.start()
+        self._server = None
+
+    # submits a job (a dict in the form of a job in a batch manifest), and returns its status.
+    # raises ValueError if the job is invalid, or QueueFullError if the queue is full.
+    def submit(self, jobDescription):
+        with self._condition:
+            if self._runningCount >= self.slicerCount and len(self._queuedJobIds) >= self.maxQueueLength:
+                raise QueueFullError("the queue is full (" + str(len(self._queuedJobIds)) + " jobs are waiting).")
+            jobId = self._lastJobId + 1
+            jobDirectory = self.directory.joinpath("jobs", str(jobId))
+            jobDirectory.mkdir(parents=True, exist_ok=True)
+            try:
+                job = self.resolveJob(jobDescription, jobDirectory)
+                self._checkJobPaths(job, jobDirectory)
+            except ValueError:
+                shutil.rmtree(jobDirectory, ignore_errors=True)
+                raise
+            self._lastJobId = jobId
+            self._jobs[jobId] = {
+                'id': jobId,
+                'directory': jobDirectory,
+                'status': "queued",
+                'submitted': time.time(),
+                'started': None,
+                'finished': None,
+                'job': job,
+                'progress': {},
+                'events': [],
+                'summary': None,
+                'future': None
+            }
+            self._queuedJobIds.append(jobId)
+            self._startQueuedJobs()
+            return self.getStatus(jobId)
+
+    # returns the status of a job (see above), or None if there is no such job.
+    def getStatus(self, jobId):
+        with self._condition:
+            record = self._jobs.get(jobId)
+            return (self._getStatusOfRecord(record) if record is not None else None)
+
+    # (expects the caller to hold self._condition)
+    def _getStatusOfRecord(self, record):
+        status = {key: value for key, value in record.items() if key not in ['directory', 'job', 'events', 'future']}
+        status['job'] = {name: str(value) for name, value in record['job'].items()}
+        status['artifacts'] = self._getArtifactNames(record)
+        return status
+
+    def getStatuses(self):
+        with self._condition:
+            return [self.getStatus(jobId) for jobId in self._jobs]
+
+    def getServiceStatus(self):
+        with self._condition:
+            return {'running': self._runningCount, 'queued': len(self._queuedJobIds), 'slicers': self.slicerCount, 'maxQueueLength': self.maxQueueLength}
+
+    # yields the progress updates of a job (see above), as they happen, followed by its final status.  Yields nothing if there is
+    # no such job.
+    def iterateProgress(self, jobId):
+        with self._condition:
+            record = self._jobs.get(jobId)
+        if record is None:
+            return
+        eventIndex = 0
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: eventIndex < len(record['events']) or record['finished'] is not None)
+                newEvents = record['events'][eventIndex:]
+                eventIndex += len(newEvents)
+                finished = record['finished'] is not None and eventIndex == len(record['events'])
+                # (from the record, rather than by the id, since the job may have been forgotten by now.)
+                finalStatus = (self._getStatusOfRecord(record) if finished else None)
+            yield from newEvents
+            if finished:
+                yield finalStatus
+                return
+
+    # returns the path of one of the outputs of a job (named by its option), or None if the job has no such output (yet).
+    def getArtifactPath(self, jobId, optionName):
+        with self._condition:
+            record = self._jobs.get(jobId)
+            if record is None or optionName not in self._getArtifactNames(record):
+                return None
+            return record['job'][optionName + "_path"]
+
+    # returns the names of the outputs of a job that can be fetched: those that the job wrote, within its directory, once it has succeeded.
+    def _getArtifactNames(self, record):
+        if record['status'] != "ok":
+            return []
+        return [
+            name[:-len("_path")] for name, path in record['job'].items()
+            if name.startswith("output_") and _isWithin(pathlib.Path(path).resolve(), record['directory']) and os.path.isfile(path) 
+            # (the job's directory was emptied when it was submitted, so a file written since then is the job's doing.)
+            and os.stat(path).st_mtime >= record['submitted']
+        ]
+
+    # raises ValueError unless each of the outputs of job (as returned by resolveJob) is within jobDirectory, and is not one of its
+    # inputs, and each of its inputs is within jobDirectory or the inputs directory.
+    def _checkJobPaths(self, job, jobDirectory):
+        inputPaths = {pathlib.Path(path).resolve() for name, path in job.items() if not name.startswith("output_")}
+        for name, path in job.items():
+            if name.startswith("output_") and pathlib.Path(path).resolve() in inputPaths:
+                raise ValueError(name[:-len("_path")] + " (" + str(path) + ") is also an input of the job.")
+            allowedDirectories = ([jobDirectory] if name.startswith("output_") else [jobDirectory, self.inputsDirectory])
+            if not any(_isWithin(pathlib.Path(path).resolve(), directory) for directory in allowedDirectories):
+                raise ValueError(
+                    name[:-len("_path")] + " (" + str(path) + ") is not within " + " or ".join(str(directory) for directory in allowedDirectories) 
+                    + ": a job of the service can only " + ("write within its own directory." if name.startswith("output_") else "read within its own directory, or the inputs directory.")
+                )
+
+    # starts as many of the queued jobs as there are free workers.  Expects the caller to hold self._condition.
+    def _startQueuedJobs(self):
+        while self._queuedJobIds and self._runningCount < self.slicerCount:
+            jobId = self._queuedJobIds.popleft()
+            record = self._jobs[jobId]
+            record['status'] = "running"
+            record['started'] = time.time()
+            self._runningCount += 1
+            record['future'] = self._executor.submit(self.runJob, jobId, record['job'], progressQueue=self._progressQueue)
+            # the job's last progress update is in the queue by the time that the job is done, so this comes after it.
+            record['future'].add_done_callback(lambda future, jobId=jobId: self._putProgress((jobId, None, None)))
+            self._condition.notify_all()
+
+    # (this runs in a thread of its own) records the progress updates that the workers send, and, when a job is done (which we also
+    # learn from the queue, after its last progress update), its outcome.
+    # Should the manager be gone (say, killed along with the rest of the process group), there is no more progress to record.
+    def _recordProgress(self):
+        while True:
+            try:
+                jobId, stageName, percent = self._progressQueue.get()
+            except (EOFError, OSError):
+                return
+            if jobId is None:
+                return
+            with self._condition:
+                record = self._jobs[jobId]
+                if stageName is not None:
+                    record['progress'][stageName] = percent
+                    record['events'].append({'stage': stageName, 'percent': percent})
+                else:
+                    try:
+                        record['summary'] = record.pop('future').result()
+                        record['status'] = record['summary']['status']
+                    except Exception as error:
+                        record['summary'] = {'error': repr(error)}
+                        record['status'] = "error"
+                    record['finished'] = time.time()
+                    self._finishedJobIds.append(jobId)
+                    self._runningCount -= 1
+                    self._startQueuedJobs()
+                    expiredJobDirectories = self._forgetJobs()
+                self._condition.notify_all()
+            if stageName is None:
+                self._removeJobDirectories(expiredJobDirectories)
+
+    # forgets the finished jobs that are past the job lifetime, or beyond the job limit.  Expects the caller to hold self._condition.
+    # returns the directories of the forgotten jobs, which the caller is to remove (see _removeJobDirectories()) once it has let go of
+    # self._condition.
+    def _forgetJobs(self):
+        expiredJobDirectories = []
+        while self._finishedJobIds and (
+            (self.maxFinishedJobs is not None and len(self._finishedJobIds) > self.maxFinishedJobs)
+            or (self.jobLifetime is not None and self._jobs[self._finishedJobIds[0]]['finished'] < time.time() - self.jobLifetime)
+        ):
+            expiredJobDirectories.append(self._jobs.pop(self._finishedJobIds.popleft())['directory'])
+        return expiredJobDirectories
+
+    def _removeJobDirectories(self, jobDirectories):
+        for jobDirectory in jobDirectories:
+            shutil.rmtree(jobDirectory, ignore_errors=True)
+
+    # (this runs in a thread of its own) forgets the jobs that reach the end of the job lifetime, whether or not anything else is going on.
+    def _forgetExpiredJobs(self):
+        while True:
+            with self._condition:
+                if self._closed:
+                    return
+                self._condition.wait(timeout=(min(60, self.jobLifetime) if self.jobLifetime is not None else None))
+                if self._closed:
+                    return
+                expiredJobDirectories = self._forgetJobs()
+            self._removeJobDirectories(expiredJobDirectories)
+
+    # serves requests at address (a (family, address) tuple, as returned by parseServiceAddress()) until interrupted.
+    def serve(self, address):
+        family, address = address
+        if family == "unix":
+            if os.path.exists(address):
+                os.remove(address)
+            self._server = _ThreadingUnixHTTPServer(address, _SlicingServiceRequestHandler)
+        else:
+            self._server = http.server.ThreadingHTTPServer(address, _SlicingServiceRequestHandler)
+        self._server.service = self
+        # we shut down in the same orderly way when we are terminated as when we are interrupted.
+        def interrupt(signalNumber, frame):
+            raise KeyboardInterrupt
+        signal.signal(signal.SIGTERM, interrupt)
+        print("serving at " + (("unix:" + address) if family == "unix" else ("http://" + address[0] + ":" + str(address[1]))) + " with " + str(self.slicerCount) + " slicers")
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+            if family == "unix" and os.path.exists(address):
+                os.remove(address)
+
+    # puts an update to the progress queue, unless the manager is gone (see _recordProgress()).
+    def _putProgress(self, update):
+        try:
+            self._progressQueue.put(update)
+        except (EOFError, OSError):
+            pass
+
+    def close(self):
+        if self._server:
+            self._server.server_close()
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._putProgress((None, None, None))
+        self._progressThread.join()
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._retentionThread.join()
+        try:
+            self._manager.shutdown()
+        except (EOFError, OSError):
+            pass
+
+
+class _ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _SlicingServiceRequestHandler(http.server.BaseHTTPRequestHandler):
+    # (the client address of a Unix domain socket connection is an empty string)
+    def address_string(self):
+        return str(self.client_address[0]) if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _sendJson(self, value, status=200):
+        body = (json.dumps(value, indent=4) + "\n").encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _sendError(self, status, message):
+        self._sendJson({'error': message}, status=status)
+
+    def do_POST(self):
+        service = self.server.service
+        if urllib.parse.urlsplit(self.path).path.rstrip("/") != "/jobs":
+            return self._sendError(404, "not found: " + self.path)
+        # (this also keeps a web page that the user happens to visit from submitting jobs with a simple cross-origin form post.)
+        if self.headers.get_content_type() != "application/json":
+            return self._sendError(415, "expected the job as application/json, not " + self.headers.get_content_type())
+        try:
+            jobDescription = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"null")
+            if not isinstance(jobDescription, dict):
+                raise ValueError("expected the job to be a json object.")
+            self._sendJson(service.submit(jobDescription), status=202)
+        except QueueFullError as error:
+            self._sendError(503, str(error))
+        except ValueError as error:
+            self._sendError(400, str(error))
+
+    def do_GET(self):
+        service = self.server.service
+        parts = [urllib.parse.unquote(part) for part in urllib.parse.urlsplit(self.path).path.strip("/").split("/")]
+        if parts == ["status"]:
+            return self._sendJson(service.getServiceStatus())
+        if parts == ["jobs"]:
+            return self._sendJson(service.getStatuses())
+        if len(parts) < 2 or parts[0] != "jobs" or not parts[1].isdigit() or service.getStatus(int(parts[1])) is None:
+            return self._sendError(404, "not found: " + self.path)
+        jobId = int(parts[1])
+        if len(parts) == 2:
+            return self._sendJson(service.getStatus(jobId))
+        if parts[2:] == ["progress"]:
+            # we stream the updates as they come, and close the connection after the last one.
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            for event in service.iterateProgress(jobId):
+                self.wfile.write((json.dumps(event) + "\n").encode())
+                self.wfile.flush()
+            self.close_connection = True
+            return
+        if len(parts) == 4 and parts[2] == "artifacts":
+            artifactPath = service.getArtifactPath(jobId, parts[3])
+            if artifactPath is None:
+                return self._sendError(404, "job " + str(jobId) + " has no artifact " + repr(parts[3]) + " (yet).")
+            try:
+                artifactFile = open(artifactPath, 'rb')
+            except FileNotFoundError:
+                # (the job was forgotten after all, in the meantime.)
+                return self._sendError(404, "job " + str(jobId) + " has no artifact " + repr(parts[3]) + " (any longer).")
+            with artifactFile:
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(os.fstat(artifactFile.fileno()).st_size))
+                self.end_headers()
+                shutil.copyfileobj(artifactFile, self.wfile, 1 << 20)
+            return
+        self._sendError(404, "not found: " + self.path)
@@ -0,0 +1,227 @@
+import math
+import re
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import jsontoolpath
+
+
+# Statistics of a toolpath, computed with numpy over the columns of a columnar toolpath (see columnar_toolpath), so that we can
+# report them for every job (even for toolpaths of millions of moves) without opening the previewable gcode in Cura:
+#   the length of the extruding moves and the length of filament that they extrude, by noodle type (the ";TYPE:..." of the
+#   previewable gcode, as given by jsontoolpath.getNoodleType(), with the noodle type carrying on through moves whose tags do not
+#   imply one, just as in generatePreviewableGcode()), the length of the travel moves, the number of retracts, and the estimated
+#   print time, in total and per layer.
+# A move is "extruding" if it moves the nozzle and advances the filament (the 'a' axis), a "travel" move if it moves the nozzle
+# without advancing the filament, and a "retract" if it draws the filament back.
+# The print time is estimated from the feedrates, either assuming that every move runs at its feedrate throughout or, if an
+# acceleration is given, with a simple trapezoidal speed profile for each move (without the lookahead planning that the printer
+# does), where the speed at the junction between two moves is limited by the lower of the two feedrates and by the angle between them.
+# Lengths are in mm, times in seconds.
+
+
+# the name under which we report the moves that precede the first move having a noodle type.
+untypedNoodleTypeName = "NONE"
+
+# returns the layers of a columnar toolpath, in the form of the layer index (see layer_index, and with no byte offsets), by the same
+# rule as jsontoolpath.iterateLayers() and generatePreviewableGcode().  This lets us build the layer index of a columnar toolpath
+# without converting it, since we only have to look at the comments, which are a small fraction of the rows, and at the tags of the moves.
+def findLayers(toolpath):
+    function = toolpath.column('function')
+    layers = [{'layerNumber': 0, 'upperPosition': None, 'itemIndex': 0, 'byteOffset': None, 'layerSections': [], 'parenthesizedNumbers': [], 'noodleType': None, 'layerSectionIndex': -1}]
+    if 'comment' not in toolpath.functions:
+        return layers
+    isComment = (function == toolpath.functions.index('comment'))
+    # a comment sequence is interrupted by a command other than a comment (but not by an item that is not a command).
+    isCommand = numpy.array([layout is not None for layout in toolpath.layouts] or [False])[toolpath.column('layout')]
+    sequenceNumbers = numpy.cumsum(isCommand & ~isComment)
+    commentRows = numpy.flatnonzero(isComment)
+    comments = toolpath.getStringParameters(commentRows, 'comment')
+    lastUpperPosition = None
+    layerSectionIndex = -1
+    sequenceStartRow = None
+    upperPositionOfSequence = None
+    parenthesizedNumberOfSequence = None
+    for i, (row, comment) in enumerate(zip(commentRows.tolist(), comments)):
+        if sequenceStartRow is None:
+            sequenceStartRow = row
+        if comment is not None and comment.startswith(jsontoolpath.upperPositionPrefix):
+            upperPositionOfSequence = comment[len(jsontoolpath.upperPositionPrefix):].strip()
+        if comment is not None and comment.startswith(jsontoolpath.layerSectionPrefix):
+            parenthesizedNumberOfSequence = int(re.search(r'\(\s*(\d+)\s*\)', comment[len(jsontoolpath.layerSectionPrefix):]).group(1))
+        if i + 1 == len(commentRows) or sequenceNumbers[commentRows[i + 1]] != sequenceNumbers[row]:
+            if upperPositionOfSequence is not None and upperPositionOfSequence != lastUpperPosition:
+                layers.append({
+                    'layerNumber': len(layers), 
+                    'upperPosition': upperPositionOfSequence, 
+                    'itemIndex': sequenceStartRow,
+                    'byteOffset': None,
+                    'layerSections': [],
+                    'parenthesizedNumbers': [],
+                    'noodleType': None,
+                    'layerSectionIndex': layerSectionIndex
+                })
+                lastUpperPosition = upperPositionOfSequence
+            # a comment sequence that declares a layer section counts towards the layer that it is on (which might be the layer that it starts).
+            if parenthesizedNumberOfSequence is not None:
+                layerSectionIndex += 1
+                layers[-1]['layerSections'].append(layerSectionIndex)
+                layers[-1]['parenthesizedNumbers'].append(parenthesizedNumberOfSequence)
+            sequenceStartRow = None
+            upperPositionOfSequence = None
+            parenthesizedNumberOfSequence = None
+
+    # the noodle type in effect at the start of each layer is that of the last move before it that has a noodle type.
+    moveRows = (numpy.flatnonzero(function == toolpath.functions.index('move')) if 'move' in toolpath.functions else numpy.zeros(0, dtype=numpy.int64))
+    noodleTypeNames, noodleTypeOfMove = _getNoodleTypesOfMoves(toolpath, moveRows)
+    typedMoveRows = moveRows[noodleTypeOfMove >= 0]
+    typedMoveNoodleTypes = noodleTypeOfMove[noodleTypeOfMove >= 0]
+    lastTypedMoveBeforeLayers = numpy.searchsorted(typedMoveRows, [layer['itemIndex'] for layer in layers], side='left') - 1
+    for layer, lastTypedMove in zip(layers[1:], lastTypedMoveBeforeLayers[1:].tolist()):
+        layer['noodleType'] = (noodleTypeNames[typedMoveNoodleTypes[lastTypedMove]] if lastTypedMove >= 0 else None)
+    return layers
+
+# returns (noodleTypeNames, noodleTypeOfMove), where noodleTypeOfMove gives, for each of the moves at moveRows, the index in 
+# noodleTypeNames of the noodle type that its tags imply (see jsontoolpath.getNoodleType()), or -1 if its tags do not imply one.
+def _getNoodleTypesOfMoves(toolpath, moveRows):
+    noodleTypeNames = []
+    noodleTypeOfTags = []
+    for tags in toolpath.tags:
+        noodleType = jsontoolpath.getNoodleType(set(tags))
+        if noodleType is not None and noodleType not in noodleTypeNames:
+            noodleTypeNames.append(noodleType)
+        noodleTypeOfTags.append(-1 if noodleType is None else noodleTypeNames.index(noodleType))
+    return noodleTypeNames, numpy.array(noodleTypeOfTags or [-1])[toolpath.column('tags')[moveRows]]
+
+# returns the time (in seconds) of each move, given the length of the path of each move (lengths), the feedrates, the cosine of the
+# angle between each move and the one before it (cosines; irrelevant for the first move), and the acceleration (None for no acceleration model).
+def estimateMoveTimes(lengths, feedrates, cosines, acceleration=None):
+    hasFeedrate = feedrates > 0
+    safeFeedrates = numpy.where(hasFeedrate, feedrates, 1)
+    if not acceleration:
+        return numpy.where(hasFeedrate, lengths / safeFeedrates, 0)
+    # the speed at the junction before each move (zero before the first move, and after the last).
+    junctionSpeeds = numpy.zeros(len(lengths) + 1)
+    if len(lengths) > 1:
+        junctionSpeeds[1:-1] = numpy.minimum(feedrates[:-1], feedrates[1:]) * (1 + numpy.clip(cosines[1:], -1, 1)) / 2
+    junctionSpeeds = numpy.where(numpy.isfinite(junctionSpeeds), junctionSpeeds, 0)
+    entrySpeeds = numpy.minimum(junctionSpeeds[:-1], safeFeedrates)
+    exitSpeeds = numpy.minimum(junctionSpeeds[1:], safeFeedrates)
+    accelerationDistance = (safeFeedrates**2 - entrySpeeds**2) / (2 * acceleration)
+    decelerationDistance = (safeFeedrates**2 - exitSpeeds**2) / (2 * acceleration)
+    cruiseDistance = lengths - accelerationDistance - decelerationDistance
+    trapezoidTimes = (
+        (safeFeedrates - entrySpeeds) / acceleration
+        + (safeFeedrates - exitSpeeds) / acceleration
+        + numpy.maximum(cruiseDistance, 0) / safeFeedrates
+    )
+    # where the move is too short to reach its feedrate, the speed peaks (at best) part way along.
+    peakSpeeds = numpy.maximum(numpy.sqrt((2 * acceleration * lengths + entrySpeeds**2 + exitSpeeds**2) / 2), numpy.maximum(entrySpeeds, exitSpeeds))
+    triangleTimes = ((peakSpeeds - entrySpeeds) + (peakSpeeds - exitSpeeds)) / acceleration
+    times = numpy.where(cruiseDistance >= 0, trapezoidTimes, triangleTimes)
+    return numpy.where(hasFeedrate & (lengths > 0), numpy.maximum(times, lengths / safeFeedrates), 0)
+
+# computes the statistics (see above) of toolpath (a columnar_toolpath.ColumnarToolpath).
+# acceleration, if given, is the acceleration (in mm/s^2) for the estimate of the print time.
+# layers, if given, is the list of the layers of the toolpath (from the layer index, see layer_index), which saves us finding them.
+# returns a json-serializable dict:
+#   'moveCount', 'printTime', 'acceleration'
+#   'noodleTypes': a dict mapping each noodle type to a dict of the 'moveCount', 'pathLength', 'filamentLength' and 'printTime' of its extruding moves.
+#   'travel':      the 'moveCount', 'pathLength' and 'printTime' of the travel moves.
+#   'retracts':    the 'count' of retracts and the 'filamentLength' that they draw back.
+#   'layers':      a list of the 'layerNumber', 'upperPosition', 'moveCount' and 'printTime' of each layer.
+def computeToolpathStats(toolpath, acceleration=None, layers=None):
+    if numpy is None:
+        raise RuntimeError("computing toolpath statistics requires numpy, which is not installed.")
+    if layers is None:
+        layers = findLayers(toolpath)
+    function = toolpath.column('function')
+    moveRows = (numpy.flatnonzero(function == toolpath.functions.index('move')) if 'move' in toolpath.functions else numpy.zeros(0, dtype=numpy.int64))
+    x, y, z, a, feedrates = (numpy.nan_to_num(toolpath.column(name)[moveRows]) for name in ['x', 'y', 'z', 'a', 'feedrate'])
+    # the first move starts from wherever the printer happens to be, so we regard it as having no length.
+    dx, dy, dz, da = (numpy.diff(values, prepend=values[:1]) for values in (x, y, z, a))
+    distances = numpy.sqrt(dx**2 + dy**2 + dz**2)
+    isExtruding = (distances > 0) & (da > 0)
+    isTravel = (distances > 0) & (da <= 0)
+    isRetract = (da < 0)
+    # a move that only moves the filament (e.g. a retract or a restart) takes as long as the filament takes to move.
+    lengths = numpy.where(distances > 0, distances, numpy.abs(da))
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        safeDistances = numpy.where(distances > 0, distances, 1)
+        cosines = numpy.zeros(len(moveRows))
+        if len(moveRows) > 1:
+            cosines[1:] = numpy.where(
+                (distances[1:] > 0) & (distances[:-1] > 0),
+                (dx[1:] * dx[:-1] + dy[1:] * dy[:-1] + dz[1:] * dz[:-1]) / (safeDistances[1:] * safeDistances[:-1]),
+                -1
+            )
+        times = estimateMoveTimes(lengths, feedrates, cosines, acceleration=acceleration)
+
+    # the noodle type of each move, as an index into noodleTypeNames (or -1 before the first move that has a noodle type).
+    noodleTypeNames, noodleTypeOfMove = _getNoodleTypesOfMoves(toolpath, moveRows)
+    lastTypedMove = numpy.where(noodleTypeOfMove >= 0, numpy.arange(len(moveRows)), -1)
+    numpy.maximum.accumulate(lastTypedMove, out=lastTypedMove)
+    noodleTypeOfMove = numpy.where(lastTypedMove >= 0, noodleTypeOfMove[numpy.maximum(lastTypedMove, 0)], -1)
+
+    # sums the weights (restricted to the moves selected by mask) by noodle type (with the untyped moves first).
+    sumByNoodleType = lambda weights, mask: numpy.bincount(noodleTypeOfMove[mask] + 1, weights=(None if weights is None else weights[mask]), minlength=len(noodleTypeNames) + 1)
+    extrudingMoveCounts = sumByNoodleType(None, isExtruding)
+    extrudingLengths = sumByNoodleType(distances, isExtruding)
+    extrudedFilamentLengths = sumByNoodleType(da, isExtruding)
+    extrudingTimes = sumByNoodleType(times, isExtruding)
+
+    layerStartRows = numpy.array([layer['itemIndex'] for layer in layers])
+    layerOfMove = numpy.searchsorted(layerStartRows, moveRows, side='right') - 1
+    layerMoveCounts = numpy.bincount(layerOfMove, minlength=len(layers))
+    layerTimes = numpy.bincount(layerOfMove, weights=times, minlength=len(layers))
+
+    return {
+        'moveCount': int(len(moveRows)),
+        'printTime': float(times.sum()),
+        'acceleration': acceleration,
+        'noodleTypes': {
+            name: {
+                'moveCount': int(extrudingMoveCounts[index]),
+                'pathLength': float(extrudingLengths[index]),
+                'filamentLength': float(extrudedFilamentLengths[index]),
+                'printTime': float(extrudingTimes[index])
+            }
+            for index, name in enumerate([untypedNoodleTypeName] + noodleTypeNames)
+            if extrudingMoveCounts[index]
+        },
+        'travel': {
+            'moveCount': int(isTravel.sum()),
+            'pathLength': float(distances[isTravel].sum()),
+            'printTime': float(times[isTravel].sum())
+        },
+        'retracts': {
+            'count': int(isRetract.sum()),
+            'filamentLength': float(-da[isRetract].sum())
+        },
+        'layers': [
+            {
+                'layerNumber': layer['layerNumber'],
+                'upperPosition': layer['upperPosition'],
+                'moveCount': int(layerMoveCounts[index]),
+                'printTime': float(layerTimes[index])
+            }
+            for index, layer in enumerate(layers)
+        ]
+    }
+
+# returns a few lines summarizing the stats (as returned by computeToolpathStats()).
+def formatToolpathStats(stats):
+    formatDuration = lambda seconds: "{:d}:{:02d}:{:02d}".format(int(seconds // 3600), int(seconds % 3600 // 60), int(math.floor(seconds % 60)))
+    lines = [
+        "estimated print time: " + formatDuration(stats['printTime'])
+        + (" (with an acceleration of " + str(stats['acceleration']) + " mm/s^2)" if stats['acceleration'] else " (at the nominal feedrates)"),
+        "layers: " + str(len(stats['layers']) - 1) + ", moves: " + str(stats['moveCount'])
+    ]
+    for name, figures in stats['noodleTypes'].items():
+        lines.append("  " + name + ": " + "{:.1f}".format(figures['pathLength']) + " mm of path, " + "{:.1f}".format(figures['filamentLength']) + " mm of filament")
+    lines.append("  travel: " + "{:.1f}".format(stats['travel']['pathLength']) + " mm in " + str(stats['travel']['moveCount']) + " moves")
+    lines.append("  retracts: " + str(stats['retracts']['count']))
+    return "\n".join(lines)
@@ -0,0 +1,130 @@
+import json
+import os
+import threading
+import time
+
+
+# Lightweight instrumentation of the stages of a run: each stage is wrapped in a span (with tracing.span("name"): ...), and,
+# when tracing has been enabled, the span is recorded as a Chrome trace event (a "complete" event, with "ph": "X"), so that the
+# trace file can be loaded into chrome://tracing or https://ui.perfetto.dev.
+# Tracing can alternatively write a JSON-lines log, with one event per line, written as each span ends.
+# When tracing is not enabled, span() returns a shared do-nothing object, so that the instrumentation costs no more than a function call.
+
+
+formats = ["chrome", "jsonl"]
+
+_tracer = None
+
+class Tracer:
+    # path is the file to write the trace to (or None, to just accumulate the events in self.events, as the batch workers do).
+    # format is one of formats.
+    def __init__(self, path=None, format="chrome"):
+        if format not in formats:
+            raise ValueError("unknown trace format " + repr(format) + " (expected one of " + ", ".join(formats) + ")")
+        self.path = path
+        self.format = format
+        self.events = []
+        self.pid = os.getpid()
+        # the event timestamps are in microseconds since the epoch, so that events recorded by different processes line up.
+        # We measure with perf_counter_ns (which is monotonic and precise) and convert using this offset.
+        self.epochOffset = time.time_ns() - time.perf_counter_ns()
+        self._lock = threading.Lock()
+        self._file = open(path, 'w') if (path and format == "jsonl") else None
+
+    def record(self, name, start, duration, args):
+        event = {
+            'name': name,
+            'cat': "make_printable",
+            'ph': "X",
+            'ts': (start + self.epochOffset) / 1000,
+            'dur': duration / 1000,
+            'pid': self.pid,
+            'tid': threading.get_ident(),
+            'args': args
+        }
+        self.addEvents([event])
+
+    # adds events that were recorded elsewhere (for instance, by a Tracer in a batch worker process).
+    def addEvents(self, events):
+        with self._lock:
+            self.events.extend(events)
+            if self._file:
+                for event in events:
+                    self._file.write(json.dumps(event, default=str) + "\n")
+                self._file.flush()
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+        elif self.path and self.format == "chrome":
+            with open(self.path, 'w') as traceFile:
+                json.dump({'traceEvents': self.events, 'displayTimeUnit': "ms"}, traceFile, default=str)
+        return self.events
+
+
+class Span:
+    __slots__ = ('tracer', 'name', 'args', 'start')
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exceptionType, exception, traceback):
+        if exceptionType is not None:
+            self.args['error'] = exceptionType.__name__
+        self.tracer.record(self.name, self.start, time.perf_counter_ns() - self.start, self.args)
+        return False
+
+    # attaches more information (e.g. the exit code of a subprocess) to the span.
+    def set(self, **args):
+        self.args.update(args)
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exceptionType, exception, traceback):
+        return False
+
+    def set(self, **args):
+        pass
+
+_nullSpan = _NullSpan()
+
+# returns a context manager that records a span named name (with args as its arguments), if tracing is enabled.
+def span(name, **args):
+    if _tracer is None:
+        return _nullSpan
+    return Span(_tracer, name, args)
+
+def isEnabled():
+    return _tracer is not None
+
+def enable(path=None, format="chrome"):
+    global _tracer
+    disable()
+    _tracer = Tracer(path=path, format=format)
+    return _tracer
+
+# stops tracing, writing out the trace file (if any).  returns the list of recorded events.
+def disable():
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is None or tracer.pid != os.getpid():
+        # a tracer inherited by a forked worker process belongs to the parent, which will write it out.
+        return []
+    return tracer.close()
+
+def addEvents(events):
+    if _tracer is not None:
+        _tracer.addEvents(events)